@@ -1,9 +1,6 @@
-import sqlite3
+import migrations
 
-conn = sqlite3.connect("instance/petcare.db")
-cur = conn.cursor()
-cur.execute("ALTER TABLE pets ADD COLUMN photo_filename TEXT;")
-conn.commit()
-conn.close()
+# pets.photo_filename is part of migration 1 now
+migrations.migrate("instance/petcare.db")
 
 print("Column added successfully!")
@@ -1,8 +1,9 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, abort
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 import os
 import uuid
+import calendar
 import threading
 import re
 from flask import jsonify
@@ -11,6 +12,15 @@ from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import google.generativeai as genai
 from apscheduler.schedulers.background import BackgroundScheduler
+from db import ConnectionPool, DatabaseBusy, WriteCoordinator
+import migrations
+import appointment_status as appt_status
+from repositories import Repositories
+import booking
+import idempotency
+from expiry import ExpiryQueue
+from doctor_schedule import WEEKDAYS, format_minute
+import slot_mask
 
 app = Flask(__name__)
 #STRIPE CONFIGURATION 
@@ -19,7 +29,7 @@ app.config['STRIPE_SECRET_KEY'] = 'sk_test_51Sg9a30Cz9n3DbBIvWBYcHJw6pAeSQWPCAhp
 stripe.api_key = app.config['STRIPE_SECRET_KEY']
 #======================================================
 app.config["SECRET_KEY"] = "change-this-secret-key"
-app.config["DATABASE"] = os.path.join("instance", "petcare.db")
+app.config["DATABASE"] = os.path.join(app.instance_path, "petcare.db")
 app.config["UPLOAD_FOLDER"] = os.path.join("static", "pet_photos")
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
 
@@ -216,29 +226,21 @@ def _pretty_datetime(dt_str: str) -> str:
     except Exception:
         return dt_str
 
-def _fetch_email_context(conn, appt_id: int):
+def _epoch_minutes(dt: datetime) -> int:
     """
-    Gets owner email + details needed for email.
-    Returns dict or None.
+    Wall-clock datetime -> minutes since 1970-01-01 00:00.
+    Same scale as appointments.appointment_start (kept in sync by triggers).
     """
-    row = conn.execute("""
-        SELECT
-            a.id,
-            a.status,
-            a.appointment_date,
-            o.email AS owner_email,
-            o.name  AS owner_name,
-            p.name  AS pet_name,
-            d.name  AS doctor_name,
-            c.name  AS clinic_name
-        FROM appointments a
-        JOIN pets p    ON a.pet_id = p.id
-        JOIN owners o  ON p.owner_id = o.id
-        JOIN doctors d ON a.doctor_id = d.id
-        JOIN clinics c ON d.clinic_id = c.id
-        WHERE a.id = ?
-    """, (appt_id,)).fetchone()
-    return dict(row) if row else None
+    return calendar.timegm(dt.timetuple()) // 60
+
+
+def _epoch_day(day) -> int:
+    """date -> days since 1970-01-01 (appointment_start // 1440, doctor_day_booked.day)."""
+    return calendar.timegm(day.timetuple()) // 86400
+
+def get_appointment_context(conn, appt_id):
+    """AppointmentContext for one appointment (see AppointmentRepository.contexts)."""
+    return Repositories(conn).appointments.context(appt_id)
 
 def send_owner_status_email(owner_email: str, owner_name: str, clinic_name: str,
                             doctor_name: str, pet_name: str, appt_dt: str, status: str):
@@ -271,36 +273,34 @@ Pet Care & Vet-Connect
 
 
 
+db_pool = ConnectionPool(app.config["DATABASE"])
+# GET-only dashboards/search: mode=ro + query_only, never waits on writers
+db_read_pool = ConnectionPool(app.config["DATABASE"], g_key="_db_ro_conn", read_only=True)
+# booking/review/payment/sweep writes: one writer per process, group commit
+db_writer = WriteCoordinator(app.config["DATABASE"])
+
+
 def get_db():
-    conn = sqlite3.connect(app.config["DATABASE"])
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Shared connection for the current request (see db.py)."""
+    return db_pool.connection()
 
 
-def ensure_runtime_schema():
-    """Add columns needed by newer features without breaking existing DBs."""
-    conn = get_db()
-    cur = conn.cursor()
+def get_read_db():
+    """Read-only connection for the current request; writes on it raise."""
+    return db_read_pool.connection()
 
-    def add_column_if_missing(table, column_def):
-        col_name = column_def.split()[0]
-        cols = cur.execute(f"PRAGMA table_info({table})").fetchall()
-        existing = {c["name"] if isinstance(c, sqlite3.Row) else c[1] for c in cols}
-        if col_name not in existing:
-            cur.execute(f"ALTER TABLE {table} ADD COLUMN {column_def}")
 
-    # Existing app features
-    add_column_if_missing("appointments", "rating INTEGER")
-    add_column_if_missing("appointments", "doctor_review TEXT")
-    add_column_if_missing("appointments", "clinic_review TEXT")
-    add_column_if_missing("appointments", "reviewed_at TEXT")
+@app.teardown_appcontext
+def release_db(exc):
+    db_pool.teardown(exc)
+    db_read_pool.teardown(exc)
 
-    # Outbreak radar inputs
-    add_column_if_missing("appointments", "appointment_reason TEXT")
-    add_column_if_missing("appointments", "symptom_notes TEXT")
 
-    conn.commit()
-    conn.close()
+def ensure_runtime_schema():
+    """Apply pending migrations (one PRAGMA read when the DB is already current)."""
+    applied = migrations.migrate(app.config["DATABASE"])
+    if applied:
+        print(f"[Schema] Applied migrations: {applied}")
 
 
 def detect_outbreak_clusters(reports, threshold=8):
@@ -409,22 +409,9 @@ def compute_pet_outbreak_alerts(conn, days_window=14, area_filter=None):
     Wrapper function that fetches reports from DB and calls detect_outbreak_clusters.
     Uses the standard threshold of 8 reports.
     """
-    rows = conn.execute(
-        """
-        SELECT
-            a.appointment_date,
-            COALESCE(a.symptom_notes, '') AS symptom_notes,
-            COALESCE(a.appointment_reason, '') AS appointment_reason,
-            COALESCE(o.location, '') AS owner_area,
-            COALESCE(p.animal_type, 'Pet') AS animal_type
-        FROM appointments a
-        JOIN pets p   ON a.pet_id = p.id
-        JOIN owners o ON p.owner_id = o.id
-        WHERE datetime(a.appointment_date) >= datetime('now', ?)
-          AND LOWER(COALESCE(a.status, '')) NOT IN ('cancelled', 'canceled', 'owner_cancelled', 'clinic_cancelled')
-        """,
-        (f"-{int(days_window)} days",),
-    ).fetchall()
+    rows = Repositories(conn).appointments.recent_reports(
+        _epoch_minutes(datetime.now() - timedelta(days=int(days_window)))
+    )
 
     # Convert to report format for detect_outbreak_clusters
     reports = []
@@ -458,21 +445,9 @@ def save_outbreak_alerts_to_db():
         conn.row_factory = sqlite3.Row
         
         # Get all recent appointments (last 14 days)
-        rows = conn.execute(
-            """
-            SELECT
-                a.appointment_date,
-                COALESCE(a.symptom_notes, '') AS symptom_notes,
-                COALESCE(a.appointment_reason, '') AS appointment_reason,
-                COALESCE(o.location, '') AS owner_area,
-                COALESCE(p.animal_type, 'Pet') AS animal_type
-            FROM appointments a
-            JOIN pets p   ON a.pet_id = p.id
-            JOIN owners o ON p.owner_id = o.id
-            WHERE datetime(a.appointment_date) >= datetime('now', '-14 days')
-              AND LOWER(COALESCE(a.status, '')) NOT IN ('cancelled', 'canceled', 'owner_cancelled', 'clinic_cancelled')
-            """
-        ).fetchall()
+        rows = Repositories(conn).appointments.recent_reports(
+            _epoch_minutes(datetime.now() - timedelta(days=14))
+        )
         
         # Convert to reports format
         reports = []
@@ -488,31 +463,17 @@ def save_outbreak_alerts_to_db():
         # Detect clusters
         alerts = detect_outbreak_clusters(reports, threshold=8)
         
-        # Update outbreak_alerts table
-        for alert in alerts:
-            conn.execute(
-                """
-                INSERT OR REPLACE INTO outbreak_alerts 
-                (disease_guess, area, number_of_reports, timeframe_days, risk_level, recommendation, detected_at, status)
-                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, 'active')
-                """,
-                (
-                    alert["disease_guess"],
-                    alert["area"],
-                    alert["number_of_reports"],
-                    alert["timeframe_days"],
-                    alert["risk_level"],
-                    alert["recommendation"]
-                )
-            )
-        
-        # Remove old alerts (> 14 days old)
-        conn.execute(
-            "DELETE FROM outbreak_alerts WHERE datetime(detected_at) < datetime('now', '-14 days')"
-        )
-        
-        conn.commit()
         conn.close()
+
+        # Update outbreak_alerts table and remove old alerts (> 14 days old)
+        # in one writer transaction
+        def save_alerts(wconn):
+            wrepos = Repositories(wconn)
+            for alert in alerts:
+                wrepos.outbreak_alerts.save(alert)
+            wrepos.outbreak_alerts.purge_older_than(14)
+
+        db_writer.run(save_alerts)
         
         print(f"[Outbreak Alert Job] Ran at {datetime.now()}. Found {len(alerts)} active clusters.")
         
@@ -521,12 +482,11 @@ def save_outbreak_alerts_to_db():
 
 
 def init_db():
-    if not os.path.exists("instance"):
-        os.makedirs("instance")
+    os.makedirs(app.instance_path, exist_ok=True)
 
     conn = get_db()
 
-    with open("schema.sql", "r") as f:
+    with open(os.path.join(app.root_path, "schema.sql"), "r") as f:
         conn.executescript(f.read())
     conn.commit()
 
@@ -560,14 +520,12 @@ def get_or_create_owner_for_current_user():
         return None
 
     conn = get_db()
-    cur = conn.cursor()
+    repos = Repositories(conn)
 
-    owner = cur.execute(
-        "SELECT * FROM owners WHERE user_id = ?", (user_id,)
-    ).fetchone()
+    owner = repos.owners.by_user(user_id)
 
     if not owner:
-        user = cur.execute(
+        user = conn.execute(
             "SELECT * FROM users WHERE id = ?", (user_id,)
         ).fetchone()
 
@@ -575,19 +533,9 @@ def get_or_create_owner_for_current_user():
             conn.close()
             return None
 
-        cur.execute(
-            """
-            INSERT INTO owners (user_id, name, email, location, password)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (user["id"], user["name"], user["email"], "", ""),
-        )
+        owner = repos.owners.create_from_user(user)
         conn.commit()
 
-        owner = cur.execute(
-            "SELECT * FROM owners WHERE user_id = ?", (user_id,)
-        ).fetchone()
-
     conn.close()
     return owner
 
@@ -600,14 +548,12 @@ def get_or_create_clinic_for_current_user():
         return None
 
     conn = get_db()
-    cur = conn.cursor()
+    repos = Repositories(conn)
 
-    clinic = cur.execute(
-        "SELECT * FROM clinics WHERE user_id = ?", (user_id,)
-    ).fetchone()
+    clinic = repos.clinics.by_user(user_id)
 
     if not clinic:
-        user = cur.execute(
+        user = conn.execute(
             "SELECT * FROM users WHERE id = ?", (user_id,)
         ).fetchone()
 
@@ -615,131 +561,49 @@ def get_or_create_clinic_for_current_user():
             conn.close()
             return None
 
-        cur.execute(
-            """
-            INSERT INTO clinics (user_id, name, license_number, email, contact_number, location)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (
-                user["id"],
-                user["clinic_name"] or user["name"],
-                user["clinic_license"] or "",
-                user["email"],
-                user["phone"] or "",
-                user["clinic_location"] or "",
-            ),
-        )
+        clinic = repos.clinics.create_from_user(user)
         conn.commit()
 
-        clinic = cur.execute(
-            "SELECT * FROM clinics WHERE user_id = ?", (user_id,)
-        ).fetchone()
-
     conn.close()
     return clinic
 
 
-def build_weekly_schedule_from_form(form):
-    days = [
-        ("Saturday", "sat"),
-        ("Sunday", "sun"),
-        ("Monday", "mon"),
-        ("Tuesday", "tue"),
-        ("Wednesday", "wed"),
-        ("Thursday", "thu"),
-        ("Friday", "fri"),
-    ]
+# the doctor forms list days in this order
+SCHEDULE_FORM_DAYS = [
+    ("Saturday", "sat"),
+    ("Sunday", "sun"),
+    ("Monday", "mon"),
+    ("Tuesday", "tue"),
+    ("Wednesday", "wed"),
+    ("Thursday", "thu"),
+    ("Friday", "fri"),
+]
 
+
+def build_weekly_schedule_from_form(form):
+    # a day may carry several From/To pairs (split shifts)
     parts = []
-    for label, key in days:
+    for label, key in SCHEDULE_FORM_DAYS:
         if form.get(f"{key}_enabled"):
-            start = form.get(f"{key}_start")
-            end = form.get(f"{key}_end")
-            if start and end:
-                parts.append(f"{label} {start} - {end}")
+            for start, end in zip(form.getlist(f"{key}_start"), form.getlist(f"{key}_end")):
+                if start and end:
+                    parts.append(f"{label} {start} - {end}")
     return "; ".join(parts)
 
 
-def parse_schedule_to_fields(schedule_text):
-    fields = {
-        "sat_start": "", "sat_end": "",
-        "sun_start": "", "sun_end": "",
-        "mon_start": "", "mon_end": "",
-        "tue_start": "", "tue_end": "",
-        "wed_start": "", "wed_end": "",
-        "thu_start": "", "thu_end": "",
-        "fri_start": "", "fri_end": "",
-    }
-
-    if not schedule_text:
-        return fields
-
-    day_map = {
-        "Saturday": "sat",
-        "Sunday": "sun",
-        "Monday": "mon",
-        "Tuesday": "tue",
-        "Wednesday": "wed",
-        "Thursday": "thu",
-        "Friday": "fri",
-    }
-
-    parts = schedule_text.split(";")
-    for part in parts:
-        part = part.strip()
-        if not part:
-            continue
-
-        try:
-            day_name, times = part.split(" ", 1)
-        except ValueError:
-            continue
-
-        key = day_map.get(day_name)
-        if not key or " - " not in times:
-            continue
-
-        start, end = [t.strip() for t in times.split(" - ", 1)]
-        fields[f"{key}_start"] = start
-        fields[f"{key}_end"] = end
-
-    return fields
-
-
-def get_appointment_context(appt_id):
-    """
-    Returns one row with:
-    - owner_name, owner_email
-    - clinic_name, clinic_email
-    - doctor_name, pet_name
-    - appointment_date, status
-    """
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT
-            a.id,
-            a.appointment_date,
-            a.status,
-            o.name   AS owner_name,
-            o.email  AS owner_email,
-            c.name   AS clinic_name,
-            c.email  AS clinic_email,
-            d.name   AS doctor_name,
-            p.name   AS pet_name
-        FROM appointments a
-        JOIN pets p    ON a.pet_id = p.id
-        JOIN owners o  ON p.owner_id = o.id
-        JOIN doctors d ON a.doctor_id = d.id
-        JOIN clinics c ON d.clinic_id = c.id
-        WHERE a.id = ?
-        """,
-        (appt_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
-    return row
+def schedule_to_fields(schedule):
+    """doctor_schedule ranges -> edit form rows: every range of every day, in form order."""
+    return [
+        {
+            "key": key,
+            "label": label,
+            "ranges": [
+                (format_minute(start), format_minute(end))
+                for start, end in schedule.get(WEEKDAYS.index(key), [])
+            ],
+        }
+        for label, key in SCHEDULE_FORM_DAYS
+    ]
 
 
 # create DB file if it doesn't exist yet
@@ -749,72 +613,150 @@ if not os.path.exists(app.config["DATABASE"]):
 # keep schema forward-compatible for existing databases
 ensure_runtime_schema()
 
+# don't carry import-time handles into forked gunicorn workers
+db_pool.close_all()
+
+# ------------- SQL TRACING (opt-in: SQL_TRACE=1) -------------
+# Statement budgets per endpoint; anything not listed gets the default (25).
+SQL_QUERY_BUDGETS = {
+    "book_appointment": 12,
+    "clinic_dashboard": 10,
+    "owner_appointments": 8,
+    "owner_search": 6,
+}
+
+sql_tracer = None
+if os.getenv("SQL_TRACE") == "1":
+    from sql_trace import SqlTracer
+
+    sql_tracer = SqlTracer(
+        slow_ms=int(os.getenv("SQL_SLOW_MS", "50")),
+        budgets=SQL_QUERY_BUDGETS,
+        log_path=os.path.join("instance", "slow_queries.log"),
+    )
+    sql_tracer.init_app(app, pools=(db_pool, db_read_pool), writers=(db_writer,))
+
 from datetime import datetime
 
-def auto_update_past_appointments(conn):
+# Backstop only: expiry_queue fires transitions on time; this catches rows
+# whose queue entry lived in a process that has since gone away.
+SWEEP_INTERVAL_SECONDS = 15 * 60
+SWEEP_STATE_NAME = "past_appointments"
+
+def auto_update_past_appointments():
     """
+    Background job (every SWEEP_INTERVAL_SECONDS), never called from routes:
     - approved in the past -> completed
     - pending/reschedule_pending in the past -> cancelled + notify owner
+    Runs on the write coordinator; a busy database just skips this round.
     """
-    now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
-    cur = conn.cursor()
-
-    # approved -> completed
-    cur.execute("""
-        UPDATE appointments
-        SET status = 'completed'
-        WHERE appointment_date < ?
-          AND LOWER(status) = 'approved'
-    """, (now_str,))
-
-    # 🔹 1) Fetch appointments that will be auto-cancelled
-    rows = cur.execute("""
-        SELECT
-            a.id,
-            a.appointment_date,
-            o.email AS owner_email,
-            o.name  AS owner_name,
-            p.name  AS pet_name,
-            d.name  AS doctor_name,
-            c.name  AS clinic_name
-        FROM appointments a
-        JOIN pets p    ON a.pet_id = p.id
-        JOIN owners o  ON p.owner_id = o.id
-        JOIN doctors d ON a.doctor_id = d.id
-        JOIN clinics c ON d.clinic_id = c.id
-        WHERE a.appointment_date < ?
-          AND LOWER(a.status) IN ('pending', 'reschedule_pending')
-    """, (now_str,)).fetchall()
+    try:
+        rows = db_writer.run(_sweep_past_appointments)
+    except DatabaseBusy as e:
+        print(f"[Auto-update] Skipped: {e}")
+        return
 
-    # 🔹 2) Cancel them
-    cur.execute("""
-        UPDATE appointments
-        SET status = 'cancelled'
-        WHERE appointment_date < ?
-          AND LOWER(status) IN ('pending', 'reschedule_pending')
-    """, (now_str,))
+    _send_auto_cancel_emails(rows)
 
-    conn.commit()
 
+def _send_auto_cancel_emails(rows):
     # 🔹 3) Send email ONCE per appointment
     for a in rows:
         send_email_async(
-            a["owner_email"],
+            a.owner_email,
             "Appointment Update: Auto-cancelled",
-            f"""Hello {a['owner_name']},
+            f"""Hello {a.owner_name},
 
 Your appointment was automatically cancelled because the clinic did not approve it before the scheduled time.
 
-Clinic: {a['clinic_name']}
-Doctor: {a['doctor_name']}
-Pet: {a['pet_name']}
-Time: {_pretty_datetime(a['appointment_date'])}
+Clinic: {a.clinic_name}
+Doctor: {a.doctor_name}
+Pet: {a.pet_name}
+Time: {_pretty_datetime(a.appointment_date)}
 
 {EMAIL_SIGNATURE}
 """
         )
 
 
+def _sweep_past_appointments(conn):
+    """
+    Incremental: only appointments whose start fell in [high-water, now) are
+    examined, and the high-water mark moves in the same transaction, so
+    every appointment is processed once even with several app processes.
+    """
+    repos = Repositories(conn)
+    now_min = _epoch_minutes(datetime.now())
+    since = repos.sweep_state.high_water(SWEEP_STATE_NAME)
+    if since >= now_min:
+        return []
+
+    # approved -> completed
+    repos.appointments.complete_approved_between(since, now_min)
+
+    # 🔹 1) Fetch appointments that will be auto-cancelled
+    ids = repos.appointments.awaiting_ids_between(since, now_min)
+    contexts = repos.appointments.contexts(ids)
+
+    # 🔹 2) Cancel them
+    if ids:
+        repos.appointments.set_status_many(ids, appt_status.CANCELLED)
+
+    repos.sweep_state.set_high_water(SWEEP_STATE_NAME, now_min)
+
+    # holds are reclaimed lazily on their slot; this just drops the leftovers
+    repos.holds.purge_expired(int(_wall_clock_seconds()))
+    # what it cancels has already started, so there is nobody to promote:
+    # waitlist entries for started slots just go
+    repos.waitlist.purge_started(now_min)
+    repos.idempotency.purge_expired(int(_wall_clock_seconds()))
+    return list(contexts.values())
+
+
+def _wall_clock_seconds():
+    """datetime.now() in seconds on the appointment_start scale (minutes * 60)."""
+    now = datetime.now()
+    return calendar.timegm(now.timetuple()) + now.microsecond / 1_000_000
+
+
+def _load_expiry_entries():
+    # runs outside a request: get_db() hands out a pooled connection
+    conn = get_db()
+    try:
+        starts = Repositories(conn).appointments.active_starts()
+    finally:
+        conn.close()
+    return [(appt_id, start * 60) for appt_id, start in starts]
+
+
+def _expire_appointments(appt_ids):
+    """
+    Called by expiry_queue with the ids that just became due. The UPDATEs
+    re-check status and start time, so ids another process (or the sweep)
+    already handled are skipped and nobody is emailed twice.
+    """
+    now_min = _epoch_minutes(datetime.now())
+
+    def expire(conn):
+        appts = Repositories(conn).appointments
+        appts.transition_due(appt_ids, now_min, {appt_status.APPROVED}, appt_status.COMPLETED)
+        cancelled = appts.transition_due(
+            appt_ids, now_min, appt_status.AWAITING_CLINIC, appt_status.CANCELLED
+        )
+        return list(appts.contexts(cancelled).values())
+
+    # DatabaseBusy propagates: the queue retries these ids shortly
+    _send_auto_cancel_emails(db_writer.run(expire))
+
+
+expiry_queue = ExpiryQueue(_load_expiry_entries, _expire_appointments, clock=_wall_clock_seconds)
+
+def schedule_expiry(appt_id, appointment_start):
+    """(Re)arm auto-complete/auto-cancel for an active appointment."""
+    if appointment_start is not None:  # legacy rows with an unparseable date
+        expiry_queue.schedule(appt_id, appointment_start * 60)
+
+
 @app.route("/")
 def index():
     return redirect(url_for("login"))
@@ -956,26 +898,21 @@ def admin_dashboard():
         flash("Access Denied: Admins only.", "danger")
         return redirect(url_for('login'))
 
-    conn = get_db()
+    conn = get_read_db()
 
     # 2. Fetch lists for all 3 categories
     # Pending (is_verified = 0)
-    pending = conn.execute('SELECT * FROM users WHERE role=? AND is_verified=?',
-                           ('clinic', 0)).fetchall()
+    users = Repositories(conn).users
+    pending = users.with_role('clinic', 0)
 
     # Approved (is_verified = 1)
-    approved = conn.execute('SELECT * FROM users WHERE role=? AND is_verified=?',
-                            ('clinic', 1)).fetchall()
+    approved = users.with_role('clinic', 1)
 
     # Rejected (is_verified = 2)
-    rejected = conn.execute('SELECT * FROM users WHERE role=? AND is_verified=?',
-                            ('clinic', 2)).fetchall()
+    rejected = users.with_role('clinic', 2)
 
     # Fetch active outbreak alerts from database
-    outbreak_alerts = conn.execute(
-        "SELECT disease_guess, area, number_of_reports, timeframe_days, risk_level, recommendation "
-        "FROM outbreak_alerts WHERE status='active' ORDER BY number_of_reports DESC"
-    ).fetchall()
+    outbreak_alerts = Repositories(conn).outbreak_alerts.active()
     
     conn.close()
 
@@ -988,6 +925,17 @@ def admin_dashboard():
                            wide_mode=True)
 
 
+@app.route('/admin/sql-stats')
+def admin_sql_stats():
+    """Rolling per-endpoint SQL aggregates (statement count, DB time, slowest)."""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({"error": "Unauthorized"}), 403
+
+    if sql_tracer is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **sql_tracer.snapshot()})
+
+
 @app.route('/api/outbreak-radar')
 def outbreak_radar_api():
     if 'user_id' not in session or session.get('role') not in ('admin', 'clinic'):
@@ -996,7 +944,7 @@ def outbreak_radar_api():
     days = request.args.get('days', default=14, type=int) or 14
     days = max(7, min(days, 30))
 
-    conn = get_db()
+    conn = get_read_db()
     area_filter = None
     if session.get('role') == 'clinic':
         clinic = get_or_create_clinic_for_current_user()
@@ -1051,10 +999,7 @@ def owner_dashboard():
         return redirect(url_for("login"))
 
     conn = get_db()
-    cur = conn.cursor()
-    pets = cur.execute(
-        "SELECT * FROM pets WHERE owner_id = ?", (owner["id"],)
-    ).fetchall()
+    pets = Repositories(conn).pets.for_owner(owner["id"])
     
     # Fetch outbreak alerts for owner's area
     owner_area = ""
@@ -1066,11 +1011,7 @@ def owner_dashboard():
     
     outbreak_alerts = []
     if owner_area:
-        outbreak_alerts = cur.execute(
-            "SELECT disease_guess, area, number_of_reports, timeframe_days, risk_level, recommendation "
-            "FROM outbreak_alerts WHERE status='active' AND area=? ORDER BY number_of_reports DESC",
-            (owner_area,)
-        ).fetchall()
+        outbreak_alerts = Repositories(conn).outbreak_alerts.active(owner_area)
     
     conn.close()
 
@@ -1107,13 +1048,8 @@ def add_pet_form():
             photo_file.save(save_path)
 
         conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO pets (owner_id, name, age, animal_type, breed, gender, vaccination_status, photo_filename)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (owner["id"], name, age, animal_type, breed, gender, vaccination_status, photo_filename),
+        Repositories(conn).pets.add(
+            owner["id"], name, age, animal_type, breed, gender, vaccination_status, photo_filename
         )
 
         conn.commit()
@@ -1135,11 +1071,8 @@ def edit_pet_form(pet_id):
         return redirect(url_for("login"))
 
     conn = get_db()
-    cur = conn.cursor()
-    pet = cur.execute(
-        "SELECT * FROM pets WHERE id = ? AND owner_id = ?",
-        (pet_id, owner["id"]),
-    ).fetchone()
+    repos = Repositories(conn)
+    pet = repos.pets.get_for_owner(pet_id, owner["id"])
 
     if not pet:
         conn.close()
@@ -1165,13 +1098,8 @@ def edit_pet_form(pet_id):
             photo_file.save(save_path)
             photo_filename = new_filename
 
-        cur.execute(
-            """
-            UPDATE pets
-            SET name = ?, age = ?, animal_type = ?, breed = ?, gender = ?, vaccination_status = ?, photo_filename = ?
-            WHERE id = ? AND owner_id = ?
-            """,
-            (name, age, animal_type, breed, gender, vaccination_status, photo_filename, pet_id, owner["id"]),
+        repos.pets.update(
+            pet_id, owner["id"], name, age, animal_type, breed, gender, vaccination_status, photo_filename
         )
 
         conn.commit()
@@ -1194,11 +1122,7 @@ def delete_pet_from_dashboard(pet_id):
         return redirect(url_for("login"))
 
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "DELETE FROM pets WHERE id = ? AND owner_id = ?",
-        (pet_id, owner["id"]),
-    )
+    Repositories(conn).pets.delete(pet_id, owner["id"])
     conn.commit()
     conn.close()
 
@@ -1230,16 +1154,10 @@ def edit_owner_profile():
 
         conn = get_db()
         cur = conn.cursor()
+        repos = Repositories(conn)
 
         # Update basic profile info 
-        cur.execute(
-            """
-            UPDATE owners
-            SET name = ?, email = ?, location = ?
-            WHERE id = ?
-            """,
-            (name, email, location, owner["id"]),
-        )
+        repos.owners.update_profile(owner["id"], name, email, location)
 
         # Handle optional password change
         if current_password or new_password or confirm_password:
@@ -1271,10 +1189,7 @@ def edit_owner_profile():
             )
 
             # update plain password column in owners 
-            cur.execute(
-                "UPDATE owners SET password = ? WHERE id = ?",
-                (new_password, owner["id"])
-            )
+            repos.owners.set_password(owner["id"], new_password)
 
         conn.commit()
         conn.close()
@@ -1297,7 +1212,6 @@ def owner_accept_reschedule(appt_id):
         return guard
 
     conn = _get_conn()
-    cur = conn.cursor()
 
     # Ensure this appointment belongs to the logged in owner
     owner = _get_owner_for_current_user(conn)
@@ -1306,45 +1220,52 @@ def owner_accept_reschedule(appt_id):
         flash("Owner profile not found.", "danger")
         return redirect(url_for("owner_dashboard"))
 
-    cur.execute(
-        """
-        SELECT a.*
-        FROM appointments a
-        JOIN pets p ON a.pet_id = p.id
-        JOIN owners o ON p.owner_id = o.id
-        WHERE a.id = ? AND o.id = ?
-        """,
-        (appt_id, owner["id"]),
-    )
-    row = cur.fetchone()
+    repos = Repositories(conn)
+    row = repos.appointments.for_owner_id(appt_id, owner["id"])
     if not row:
         conn.close()
         flash("Appointment not found for your account.", "warning")
         return redirect(url_for("owner_appointments"))
 
-    # Update status to approved (new time confirmed)
-    conn.execute(
-        "UPDATE appointments SET status = 'approved' WHERE id = ?",
-        (appt_id,),
-    )
-    conn.commit()
+    # Update status to approved (new time confirmed); re-checked in the write
+    # so a stale or repeated accept can't revive a cancelled appointment
+    def accept(wconn):
+        return Repositories(wconn).appointments.change_status(
+            appt_id, (appt_status.RESCHEDULE_PENDING,), appt_status.APPROVED
+        )
+
+    try:
+        accepted = db_writer.run(accept)
+    except DatabaseBusy:
+        conn.close()
+        flash("The system is busy right now. Please try again in a moment.", "warning")
+        return redirect(url_for("owner_appointments"))
+    except sqlite3.IntegrityError:
+        conn.close()
+        flash("That time slot has already been taken by another booking.", "warning")
+        return redirect(url_for("owner_appointments"))
     conn.close()
 
+    if not accepted:
+        flash("This appointment is no longer pending a new time.", "warning")
+        return redirect(url_for("owner_appointments"))
+    schedule_expiry(appt_id, row["appointment_start"])
+
     # notify clinic that owner accepted
-    appt = get_appointment_context(appt_id)
+    appt = get_appointment_context(get_db(), appt_id)
     if appt:
         subject = "PetConnect: Owner Accepted Rescheduled Appointment"
         body = (
-            f"Hello {appt['clinic_name']},\n\n"
+            f"Hello {appt.clinic_name},\n\n"
             f"The pet owner has accepted the new time for this appointment.\n\n"
-            f"Owner  : {appt['owner_name']}\n"
-            f"Pet    : {appt['pet_name']}\n"
-            f"Doctor : {appt['doctor_name']}\n"
-            f"Time   : {appt['appointment_date']}\n"
+            f"Owner  : {appt.owner_name}\n"
+            f"Pet    : {appt.pet_name}\n"
+            f"Doctor : {appt.doctor_name}\n"
+            f"Time   : {appt.appointment_date}\n"
             f"Status : Approved\n\n"
             "– Pet Care & Vet-Connect"
         )
-        send_email_async(appt["clinic_email"], subject, body)
+        send_email_async(appt.clinic_email, subject, body)
 
     flash("New time confirmed.", "success")
     return redirect(url_for("owner_appointments"))
@@ -1361,7 +1282,6 @@ def owner_decline_reschedule(appt_id):
         return guard
 
     conn = _get_conn()
-    cur = conn.cursor()
 
     #Ensure this appointment belongs to the logged-in owner
     owner = _get_owner_for_current_user(conn)
@@ -1370,46 +1290,55 @@ def owner_decline_reschedule(appt_id):
         flash("Owner profile not found.", "danger")
         return redirect(url_for("owner_dashboard"))
 
-    cur.execute(
-        """
-        SELECT a.*
-        FROM appointments a
-        JOIN pets p ON a.pet_id = p.id
-        JOIN owners o ON p.owner_id = o.id
-        WHERE a.id = ? AND o.id = ?
-        """,
-        (appt_id, owner["id"]),
-    )
-    row = cur.fetchone()
+    repos = Repositories(conn)
+    row = repos.appointments.for_owner_id(appt_id, owner["id"])
     if not row:
         conn.close()
         flash("Appointment not found for your account.", "warning")
         return redirect(url_for("owner_appointments"))
 
-    #Update status to owner_cancelled
-    conn.execute(
-        "UPDATE appointments SET status = 'owner_cancelled' WHERE id = ?",
-        (appt_id,),
-    )
-    conn.commit()
+    #Update status to owner_cancelled; the freed slot goes to its waitlist
+    #in the same transaction
+    def decline(wconn):
+        wrepos = Repositories(wconn)
+        if not wrepos.appointments.change_status(
+            appt_id, (appt_status.RESCHEDULE_PENDING,), appt_status.OWNER_CANCELLED
+        ):
+            return None
+        return booking_service.promote_waitlist(
+            wrepos, row["doctor_id"], row["appointment_start"], row["duration_minutes"]
+        )
+
+    try:
+        promoted = db_writer.run(decline)
+    except DatabaseBusy:
+        conn.close()
+        flash("The system is busy right now. Please try again in a moment.", "warning")
+        return redirect(url_for("owner_appointments"))
+    if promoted is None:
+        conn.close()
+        flash("This appointment is no longer pending a new time.", "warning")
+        return redirect(url_for("owner_appointments"))
+    expiry_queue.discard(appt_id)
+    _waitlist_promoted(promoted)
     conn.close()
 
     #notify clinic that owner cancelled 
-    appt = get_appointment_context(appt_id)
+    appt = get_appointment_context(get_db(), appt_id)
     if appt:
         subject = "PetConnect: Rescheduled Appointment Declined by Owner"
         body = (
-            f"Hello {appt['clinic_name']},\n\n"
+            f"Hello {appt.clinic_name},\n\n"
             f"The pet owner has declined the proposed new time. "
             f"The appointment is now cancelled by the owner.\n\n"
-            f"Owner  : {appt['owner_name']}\n"
-            f"Pet    : {appt['pet_name']}\n"
-            f"Doctor : {appt['doctor_name']}\n"
-            f"Time   : {appt['appointment_date']}\n"
+            f"Owner  : {appt.owner_name}\n"
+            f"Pet    : {appt.pet_name}\n"
+            f"Doctor : {appt.doctor_name}\n"
+            f"Time   : {appt.appointment_date}\n"
             f"Status : Cancelled\n\n"
             "– Pet Care & Vet-Connect"
         )
-        send_email(appt["clinic_email"], subject, body)
+        send_email(appt.clinic_email, subject, body)
 
     flash("Rescheduled time declined. Appointment cancelled.", "info")
     return redirect(url_for("owner_appointments"))
@@ -1428,126 +1357,29 @@ def clinic_dashboard():
     tab = request.args.get("tab", "doctors")
 
     conn = get_db()
-    cur = conn.cursor()
 
     # Always load doctors (left-side list)
-    doctors = cur.execute(
-        "SELECT * FROM doctors WHERE clinic_id = ? ORDER BY name",
-        (clinic["id"],),
-    ).fetchall()
+    doctors = Repositories(conn).doctors.for_clinic(clinic["id"])
 
     # Only load requests if we are on the Appointments tab
     appointments_requests = []
     appointments_approved = []
     if tab == "appointments":
-        appointments_requests = cur.execute(
-            """
-            SELECT
-                a.id,
-                a.appointment_date,
-                a.status,
-                p.name               AS pet_name,
-                CASE
-                    WHEN p.photo_filename IS NOT NULL AND p.photo_filename != ''
-                    THEN 'pet_photos/' || p.photo_filename
-                    ELSE 'images/paw-placeholder.png'
-                END AS pet_photo,
-
-
-                p.age                AS age,
-                p.age                AS pet_age,
-                p.animal_type        AS animal_type,
-                p.animal_type        AS pet_animal_type,
-                p.breed              AS breed,
-                p.breed              AS pet_breed,
-                p.gender             AS gender,
-                p.gender             AS pet_gender,
-                p.vaccination_status AS vaccination_status,
-                p.vaccination_status AS pet_vaccination_status,
-                COALESCE(a.appointment_reason, '') AS appointment_reason,
-                COALESCE(a.symptom_notes, '') AS symptom_notes,
-                o.name               AS owner_name,
-                d.name               AS doctor_name
-            FROM appointments a
-            JOIN pets    p ON a.pet_id   = p.id
-            JOIN owners  o ON p.owner_id = o.id
-            JOIN doctors d ON a.doctor_id = d.id
-            WHERE d.clinic_id = ?
-            AND a.status IN ('pending', 'reschedule_pending')
-            ORDER BY a.appointment_date ASC
-            """,
-            (clinic["id"],),
-        ).fetchall()
+        appointments_requests = Repositories(conn).appointments.clinic_requests(clinic["id"])
 
         # Load approved and completed appointments (history)
-        appointments_approved = cur.execute(
-            """
-            SELECT
-                a.id,
-                a.appointment_date,
-                a.status,
-                p.name               AS pet_name,
-                CASE
-                    WHEN p.photo_filename IS NOT NULL AND p.photo_filename != ''
-                    THEN 'pet_photos/' || p.photo_filename
-                    ELSE 'images/paw-placeholder.png'
-                END AS pet_photo,
-                p.age                AS age,
-                p.age                AS pet_age,
-                p.animal_type        AS animal_type,
-                p.animal_type        AS pet_animal_type,
-                p.breed              AS breed,
-                p.breed              AS pet_breed,
-                p.gender             AS gender,
-                p.gender             AS pet_gender,
-                p.vaccination_status AS vaccination_status,
-                p.vaccination_status AS pet_vaccination_status,
-                COALESCE(a.appointment_reason, '') AS appointment_reason,
-                COALESCE(a.symptom_notes, '') AS symptom_notes,
-                o.name               AS owner_name,
-                d.name               AS doctor_name
-            FROM appointments a
-            JOIN pets    p ON a.pet_id   = p.id
-            JOIN owners  o ON p.owner_id = o.id
-            JOIN doctors d ON a.doctor_id = d.id
-            WHERE d.clinic_id = ?
-            AND a.status IN ('approved', 'completed')
-            ORDER BY a.appointment_date DESC
-            """,
-            (clinic["id"],),
-        ).fetchall()
+        appointments_approved = Repositories(conn).appointments.clinic_history(clinic["id"])
 
     # 3. Reviews tab ( SRITI )
     reviews = []
     if tab == "reviews":
-        reviews = cur.execute("""
-            SELECT 
-                a.rating, 
-                a.doctor_review, 
-                a.clinic_review, 
-                a.reviewed_at, 
-                a.appointment_date,
-                d.name AS doctor_name,
-                p.name AS pet_name,
-                o.name AS owner_name
-            FROM appointments a
-            JOIN doctors d ON a.doctor_id = d.id
-            JOIN pets p ON a.pet_id = p.id
-            JOIN owners o ON p.owner_id = o.id
-            WHERE d.clinic_id = ? 
-            AND a.rating IS NOT NULL
-            ORDER BY a.reviewed_at DESC
-        """, (clinic["id"],)).fetchall()
+        reviews = Repositories(conn).appointments.clinic_reviews(clinic["id"])
 
     local_area = (clinic["location"] or "").strip() if clinic else ""
     
     # Fetch alerts for this clinic's area from database
     if local_area:
-        outbreak_alerts = cur.execute(
-            "SELECT disease_guess, area, number_of_reports, timeframe_days, risk_level, recommendation "
-            "FROM outbreak_alerts WHERE status='active' AND area=? ORDER BY number_of_reports DESC",
-            (local_area,)
-        ).fetchall()
+        outbreak_alerts = Repositories(conn).outbreak_alerts.active(local_area)
     else:
         outbreak_alerts = []
 
@@ -1575,16 +1407,10 @@ def clinic_doctor_appointments(doctor_id):
         return redirect(url_for("login"))
 
     conn = get_db()
-    cur = conn.cursor()
-
-    # ✅ Auto-move past appointments before loading lists
-    auto_update_past_appointments(conn)
 
     # Make sure this doctor belongs to this clinic
-    doctor = cur.execute(
-        "SELECT * FROM doctors WHERE id = ? AND clinic_id = ?",
-        (doctor_id, clinic["id"]),
-    ).fetchone()
+    repos = Repositories(conn)
+    doctor = repos.doctors.get_for_clinic(doctor_id, clinic["id"])
 
     if not doctor:
         conn.close()
@@ -1592,58 +1418,7 @@ def clinic_doctor_appointments(doctor_id):
         return redirect(url_for("clinic_dashboard", tab="appointments"))
 
     q = (request.args.get("q") or "").strip()
-    params = [doctor_id]
-    where_extra = ""
-    if q:
-        where_extra = " AND LOWER(p.name) LIKE ?"
-        params.append(f"%{q.lower()}%")
-
-    rows = cur.execute(
-        f"""
-        SELECT
-            a.id,
-            a.appointment_date,
-            a.status,
-            a.rating,
-            p.name               AS pet_name,
-            CASE
-                WHEN p.photo_filename IS NOT NULL AND p.photo_filename != ''
-                THEN 'pet_photos/' || p.photo_filename
-                ELSE 'images/paw-placeholder.png'
-            END AS pet_photo,
-
-            p.age                AS pet_age,
-            p.age                AS age,
-
-            p.animal_type        AS pet_animal_type,
-            p.animal_type        AS animal_type,
-
-            p.breed              AS pet_breed,
-            p.breed              AS breed,
-
-            p.gender             AS pet_gender,
-            p.gender             AS gender,
-
-            p.vaccination_status AS pet_vaccination_status,
-            p.vaccination_status AS vaccination_status,
-
-            COALESCE(a.appointment_reason, '') AS appointment_reason,
-            COALESCE(a.appointment_reason, '') AS reason,
-            COALESCE(a.symptom_notes, '') AS symptom_notes,
-            COALESCE(a.symptom_notes, '') AS symptoms,
-
-            o.name               AS owner_name,
-            d.name               AS doctor_name
-        FROM appointments a
-        JOIN pets    p ON a.pet_id   = p.id
-        JOIN owners  o ON p.owner_id = o.id
-        JOIN doctors d ON a.doctor_id = d.id
-        WHERE a.doctor_id = ?
-          {where_extra}
-        ORDER BY a.appointment_date ASC
-        """,
-        params,
-    ).fetchall()
+    rows = repos.appointments.for_doctor(doctor_id, pet_name_like=q)
 
     conn.close()
 
@@ -1651,15 +1426,15 @@ def clinic_doctor_appointments(doctor_id):
     requests, upcoming, completed, cancelled = [], [], [], []
 
     for r in rows:
-        status = (r["status"] or "").lower()
+        status = r["status"]
 
-        if status in ("pending", "reschedule_pending"):
+        if appt_status.is_awaiting_clinic(status):
             requests.append(r)
-        elif status == "approved":
+        elif appt_status.is_approved(status):
             upcoming.append(r)
-        elif status in ("completed", "done"):
+        elif appt_status.is_completed(status):
             completed.append(r)
-        elif status in ("clinic_cancelled", "owner_cancelled", "cancelled", "canceled"):
+        elif appt_status.is_cancelled(status):
             cancelled.append(r)
 
     return render_template(
@@ -1685,54 +1460,74 @@ def clinic_appointment_action(appt_id, action):
         return redirect(url_for("login"))
 
     conn = get_db()
-    cur = conn.cursor()
 
     # Ensure appointment belongs to this clinic
-    cur.execute(
-        """
-        SELECT a.id, a.status, d.clinic_id
-        FROM appointments a
-        JOIN doctors d ON a.doctor_id = d.id
-        WHERE a.id = ?
-        """,
-        (appt_id,),
-    )
-    row = cur.fetchone()
+    row = Repositories(conn).appointments.with_clinic(appt_id)
 
     if not row or row["clinic_id"] != clinic["id"]:
         conn.close()
         flash("Appointment not found for this clinic.", "warning")
         return redirect(url_for("clinic_dashboard", tab="appointments"))
 
-    new_status = None
-
     if action == "approve":
-        new_status = "approved"
-        cur.execute("UPDATE appointments SET status = ? WHERE id = ?", (new_status, appt_id))
-        flash("Appointment approved.", "success")
-
+        from_states = appt_status.AWAITING_CLINIC
+        new_status = appt_status.APPROVED
+        done_message = ("Appointment approved.", "success")
     elif action == "cancel":
-        new_status = "clinic_cancelled"
-        cur.execute("UPDATE appointments SET status = ? WHERE id = ?", (new_status, appt_id))
-        flash("Appointment cancelled.", "info")
-
+        from_states = appt_status.ACTIVE
+        new_status = appt_status.CLINIC_CANCELLED
+        done_message = ("Appointment cancelled.", "info")
     else:
         conn.close()
         flash("Invalid action.", "warning")
         return redirect(url_for("clinic_dashboard", tab="appointments"))
 
-    conn.commit()
+    def apply_action(wconn):
+        wrepos = Repositories(wconn)
+        # re-checked here: the status may have changed since the page was drawn
+        if not wrepos.appointments.change_status(appt_id, from_states, new_status):
+            return None
+        if new_status != appt_status.CLINIC_CANCELLED:
+            return []
+        # the next owner on the waitlist gets the slot in this transaction
+        return booking_service.promote_waitlist(
+            wrepos, row["doctor_id"], row["appointment_start"], row["duration_minutes"]
+        )
+
+    try:
+        promoted = db_writer.run(apply_action)
+    except DatabaseBusy:
+        conn.close()
+        flash("The system is busy right now. Please try again in a moment.", "warning")
+        return redirect(url_for("clinic_dashboard", tab="appointments"))
+    except sqlite3.IntegrityError:
+        conn.close()
+        flash("That time slot has already been taken by another booking.", "warning")
+        return redirect(url_for("clinic_dashboard", tab="appointments"))
+
+    if promoted is None:
+        conn.close()
+        flash(f"This appointment can no longer be {'approved' if action == 'approve' else 'cancelled'}.", "warning")
+        return redirect(url_for("clinic_dashboard", tab="appointments"))
+
+    if new_status == appt_status.APPROVED:
+        schedule_expiry(appt_id, row["appointment_start"])
+    else:
+        expiry_queue.discard(appt_id)
+    _waitlist_promoted(promoted)
+
+    flash(*done_message)
 
     # Email owner 
-    ctx = _fetch_email_context(conn, appt_id)
-    if ctx and ctx.get("owner_email"):
+    ctx = get_appointment_context(conn, appt_id)
+    if ctx and ctx.owner_email:
         send_owner_status_email(
-            owner_email=ctx["owner_email"],
-            owner_name=ctx.get("owner_name"),
-            clinic_name=ctx.get("clinic_name"),
-            doctor_name=ctx.get("doctor_name"),
-            pet_name=ctx.get("pet_name"),
-            appt_dt=ctx.get("appointment_date"),
+            owner_email=ctx.owner_email,
+            owner_name=ctx.owner_name,
+            clinic_name=ctx.clinic_name,
+            doctor_name=ctx.doctor_name,
+            pet_name=ctx.pet_name,
+            appt_dt=ctx.appointment_date,
             status=new_status,
         )
 
@@ -1741,6 +1536,20 @@ def clinic_appointment_action(appt_id, action):
 
 
 
+def doctor_timing_from_form(form, doctor=None):
+    """
+    (visit_minutes, slot_minutes) from the add/edit doctor form, limited to
+    slot_mask.CHOICES; missing or invalid values keep the doctor's current
+    setting (or the 30-minute default).
+    """
+    values = []
+    for field in ("visit_minutes", "slot_minutes"):
+        current = doctor[field] if doctor else slot_mask.DEFAULT_MINUTES
+        value = form.get(field, type=int)
+        values.append(value if value in slot_mask.CHOICES else current)
+    return tuple(values)
+
+
 @app.route("/clinic/doctors/add", methods=["GET", "POST"])
 def add_doctor_form():
     if "user_id" not in session or session.get("role") != "clinic":
@@ -1758,22 +1567,18 @@ def add_doctor_form():
         qualifications = request.form["qualifications"]
 
         weekly_schedule = build_weekly_schedule_from_form(request.form)
+        visit_minutes, slot_minutes = doctor_timing_from_form(request.form)
 
         conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO doctors (clinic_id, name, email, base_fee, qualifications, rating, weekly_schedule)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (clinic["id"], name, email, base_fee, qualifications, 0, weekly_schedule),
+        Repositories(conn).doctors.add(
+            clinic["id"], name, email, base_fee, qualifications, weekly_schedule, visit_minutes, slot_minutes
         )
         conn.commit()
         conn.close()
 
         return redirect(url_for("clinic_dashboard", tab="doctors"))
 
-    return render_template("add_doctor.html")
+    return render_template("add_doctor.html", timing_choices=slot_mask.CHOICES)
 
 
 @app.route("/clinic/doctors/<int:doctor_id>/edit", methods=["GET", "POST"])
@@ -1787,12 +1592,9 @@ def edit_doctor_form(doctor_id):
         return redirect(url_for("login"))
 
     conn = get_db()
-    cur = conn.cursor()
+    repos = Repositories(conn)
 
-    doctor = cur.execute(
-        "SELECT * FROM doctors WHERE id = ? AND clinic_id = ?",
-        (doctor_id, clinic["id"]),
-    ).fetchone()
+    doctor = repos.doctors.get_for_clinic(doctor_id, clinic["id"])
 
     if not doctor:
         conn.close()
@@ -1808,24 +1610,23 @@ def edit_doctor_form(doctor_id):
         old_schedule = doctor["weekly_schedule"] or ""
         new_schedule = build_weekly_schedule_from_form(request.form)
         final_schedule = new_schedule if new_schedule else old_schedule
+        visit_minutes, slot_minutes = doctor_timing_from_form(request.form, doctor)
 
-        cur.execute(
-            """
-            UPDATE doctors
-            SET name = ?, email = ?, base_fee = ?, qualifications = ?, weekly_schedule = ?
-            WHERE id = ? AND clinic_id = ?
-            """,
-            (name, email, base_fee, qualifications, final_schedule, doctor_id, clinic["id"]),
+        repos.doctors.update(
+            doctor_id, clinic["id"], name, email, base_fee, qualifications, final_schedule,
+            visit_minutes, slot_minutes
         )
         conn.commit()
         conn.close()
 
         return redirect(url_for("clinic_dashboard", tab="doctors"))
 
-    schedule_fields = parse_schedule_to_fields(doctor["weekly_schedule"] or "")
+    schedule_fields = schedule_to_fields(repos.doctors.schedule(doctor_id))
     conn.close()
 
-    return render_template("edit_doctor.html", doctor=doctor, schedule=schedule_fields)
+    return render_template(
+        "edit_doctor.html", doctor=doctor, schedule=schedule_fields, timing_choices=slot_mask.CHOICES
+    )
 
 
 @app.route("/clinic/doctors/<int:doctor_id>/delete", methods=["POST"])
@@ -1839,11 +1640,7 @@ def delete_doctor_from_dashboard(doctor_id):
         return redirect(url_for("login"))
 
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "DELETE FROM doctors WHERE id = ? AND clinic_id = ?",
-        (doctor_id, clinic["id"]),
-    )
+    Repositories(conn).doctors.delete(doctor_id, clinic["id"])
     conn.commit()
     conn.close()
 
@@ -1857,36 +1654,8 @@ def clinic_appointments():
 
     clinic = get_or_create_clinic_for_current_user()
     conn = get_db()
-    cur = conn.cursor()
 
-    rows = cur.execute(
-        """
-        SELECT
-            a.*,
-            d.name               AS doctor_name,
-            p.name               AS pet_name,
-            p.animal_type        AS animal_type,
-            p.animal_type        AS pet_animal,
-            p.animal_type        AS pet_animal_type,
-            p.breed              AS breed,
-            p.breed              AS pet_breed,
-            p.gender             AS gender,
-            p.gender             AS pet_gender,
-            p.age                AS age,
-            p.age                AS pet_age,
-            p.vaccination_status AS vaccination_status,
-            p.vaccination_status AS pet_vaccination,
-            p.vaccination_status AS pet_vaccination_status,
-            o.name               AS owner_name
-        FROM appointments a
-        JOIN doctors d ON a.doctor_id = d.id
-        JOIN pets    p ON a.pet_id   = p.id
-        JOIN owners  o ON p.owner_id = o.id
-        WHERE d.clinic_id = ?
-        ORDER BY a.appointment_date ASC
-        """,
-        (clinic["id"],),
-    ).fetchall()
+    rows = Repositories(conn).appointments.for_clinic(clinic["id"])
 
     conn.close()
 
@@ -1900,38 +1669,29 @@ def clinic_appointments():
 
 
 
+RESCHEDULE_SUGGESTIONS = 5
+RESCHEDULE_SEARCH_DAYS = 14
+
+
 @app.route("/clinic/appointment/<int:appt_id>/reschedule", methods=["GET", "POST"])
 def reschedule_appointment(appt_id):
     # ✅ Must be logged in as clinic
     if "user_id" not in session or session.get("role") != "clinic":
         return redirect(url_for("login"))
 
+    clinic = get_or_create_clinic_for_current_user()
+    if not clinic:
+        flash("Clinic profile not found.", "danger")
+        return redirect(url_for("login"))
+
     conn = get_db()
-    cur = conn.cursor()
 
-    # ✅ Fetch appointment + doctor_id
-    cur.execute(
-        """
-        SELECT
-            a.*,
-            d.id   AS doctor_id,
-            d.name AS doctor_name,
-            p.name AS pet_name,
-            o.name AS owner_name
-        FROM appointments a
-        JOIN doctors d ON a.doctor_id = d.id
-        JOIN pets p    ON a.pet_id   = p.id
-        JOIN owners o  ON p.owner_id = o.id
-        WHERE a.id = ?
-        """,
-        (appt_id,),
-    )
-    appt = cur.fetchone()
+    # ✅ Fetch appointment + doctor_id (only this clinic's appointments)
+    appt = Repositories(conn).appointments.for_reschedule(appt_id, clinic["id"])
 
     if not appt:
         conn.close()
-        flash("Appointment not found.", "danger")
-        return redirect(url_for("clinic_dashboard", tab="appointments"))
+        abort(404)
 
     # ✅ Used by date input min=""
     today = datetime.now().strftime("%Y-%m-%d")
@@ -1960,30 +1720,85 @@ def reschedule_appointment(appt_id):
             return redirect(url_for("reschedule_appointment", appt_id=appt_id))
 
         new_dt_str = dt.strftime("%Y-%m-%d %H:%M")
+        new_start = _epoch_minutes(dt)
+        visit = appt["duration_minutes"]
+        conn.close()
 
-        # ✅ Update appointment
-        cur.execute(
-            """
-            UPDATE appointments
-            SET appointment_date = ?, status = 'reschedule_pending'
-            WHERE id = ?
-            """,
-            (new_dt_str, appt_id),
-        )
-        conn.commit()
+        def move(wconn):
+            # ✅ Check + move in one write transaction: the new slot must be on
+            # the doctor's grid and hours, free of other bookings and not held
+            # by another owner (idx_appointments_active_slot backs this up)
+            wrepos = Repositories(wconn)
+            # ✅ Re-read: only a visit that still holds its slot can be moved
+            current = wrepos.appointments.with_clinic(appt_id)
+            if not current or not appt_status.is_active(current["status"]):
+                return None, []
+            doctor = wrepos.doctors.by_id(appt["doctor_id"])
+            if not doctor:
+                return False, []
+            minute = dt.hour * 60 + dt.minute
+            free = (
+                minute % doctor["slot_minutes"] == 0
+                and wrepos.doctors.works_at(doctor["id"], dt.weekday(), minute, visit)
+                and not wrepos.appointments.slot_taken(doctor["id"], new_start, visit, exclude_id=appt_id)
+                and not wrepos.holds.held_by_other(
+                    doctor["id"], new_start, appt["owner_id"], int(_wall_clock_seconds()), visit
+                )
+            )
+            if free:
+                try:
+                    wrepos.appointments.move(appt_id, new_dt_str, appt_status.RESCHEDULE_PENDING)
+                except sqlite3.IntegrityError:
+                    free = False
+            if not free:
+                return False, booking.nearest_free(
+                    wrepos, doctor["id"], visit, doctor["slot_minutes"], new_start,
+                    _epoch_minutes(datetime.now()), k=RESCHEDULE_SUGGESTIONS, max_days=RESCHEDULE_SEARCH_DAYS,
+                )
+            if current["appointment_start"] is None:
+                return True, []
+            # the old slot goes to its waitlist in the same transaction
+            return True, booking_service.promote_waitlist(
+                wrepos, current["doctor_id"], current["appointment_start"], current["duration_minutes"]
+            )
+
+        try:
+            moved, result = db_writer.run(move)
+        except DatabaseBusy:
+            flash("The system is busy right now. Please try again in a moment.", "warning")
+            return redirect(url_for("reschedule_appointment", appt_id=appt_id, date=new_date))
+
+        if moved is None:
+            flash("This appointment can no longer be rescheduled.", "warning")
+            return redirect(url_for("clinic_dashboard", tab="appointments"))
+
+        if not moved:
+            flash("That time is not available. The nearest free times are listed below.", "warning")
+            return render_template(
+                "reschedule_form.html",
+                appointment=appt,
+                selected_date=new_date,
+                available_slots=[],
+                suggestions=[booking.from_epoch_minutes(m) for m in result],
+                today=today,
+            ), 409
+
+        schedule_expiry(appt_id, new_start)
+        _waitlist_promoted(result)
 
         # ✅ Email owner (use your pretty email helper)
-        ctx = _fetch_email_context(conn, appt_id)
-        if ctx and ctx.get("owner_email"):
+        conn = get_read_db()
+        ctx = get_appointment_context(conn, appt_id)
+        if ctx and ctx.owner_email:
             try:
                 send_owner_status_email(
-                    owner_email=ctx["owner_email"],
-                    owner_name=ctx.get("owner_name"),
-                    clinic_name=ctx.get("clinic_name"),
-                    doctor_name=ctx.get("doctor_name"),
-                    pet_name=ctx.get("pet_name"),
+                    owner_email=ctx.owner_email,
+                    owner_name=ctx.owner_name,
+                    clinic_name=ctx.clinic_name,
+                    doctor_name=ctx.doctor_name,
+                    pet_name=ctx.pet_name,
                     appt_dt=new_dt_str,
-                    status="reschedule_pending",
+                    status=appt_status.RESCHEDULE_PENDING,
                 )
             except Exception as e:
                 print("Email error:", e)
@@ -1995,9 +1810,26 @@ def reschedule_appointment(appt_id):
     # ---------------- GET: show slots for selected date ----------------
     selected_date = (request.args.get("date") or "").strip()
     available_slots = []
+    suggestions = []
 
     if selected_date:
-        available_slots = _doctor_slots_for_date(conn, appt["doctor_id"], selected_date)
+        available_slots = _doctor_slots_for_date(conn, appt["doctor_id"], selected_date, appt["owner_id"])
+
+    # ✅ Nothing free that day: nearest free times around the same time of day
+    if selected_date and not available_slots:
+        try:
+            day = _date.fromisoformat(selected_date)
+        except ValueError:
+            day = None
+        if day:
+            # same time of day as now; from the start of the day if it has none
+            time_of_day = (appt["appointment_start"] or 0) % slot_mask.MINUTES_PER_DAY
+            wanted = _epoch_day(day) * slot_mask.MINUTES_PER_DAY + time_of_day
+            suggestions = [booking.from_epoch_minutes(m) for m in booking.nearest_free(
+                Repositories(conn), appt["doctor_id"], appt["duration_minutes"], appt["slot_minutes"],
+                wanted, _epoch_minutes(datetime.now()),
+                k=RESCHEDULE_SUGGESTIONS, max_days=RESCHEDULE_SEARCH_DAYS,
+            )]
 
     conn.close()
     return render_template(
@@ -2005,6 +1837,7 @@ def reschedule_appointment(appt_id):
         appointment=appt,
         selected_date=selected_date or None,
         available_slots=available_slots,
+        suggestions=suggestions,
         today=today,  # REQUIRED so past dates can’t be selected in HTML
     )
 
@@ -2021,7 +1854,7 @@ def edit_clinic_profile():
         return redirect(url_for("login"))
 
     conn = get_db()
-    cur = conn.cursor()
+    repos = Repositories(conn)
 
     if request.method == "POST":
         name = request.form["name"]
@@ -2035,14 +1868,7 @@ def edit_clinic_profile():
         confirm_password = request.form.get("confirm_password", "").strip()
 
         #Update basic clinic profile 
-        cur.execute(
-            """
-            UPDATE clinics
-            SET name = ?, license_number = ?, email = ?, contact_number = ?, location = ?
-            WHERE id = ?
-            """,
-            (name, license_number, email, contact_number, location, clinic["id"]),
-        )
+        repos.clinics.update_profile(clinic["id"], name, license_number, email, contact_number, location)
 
         # pass change
         if current_password or new_password or confirm_password:
@@ -2056,31 +1882,21 @@ def edit_clinic_profile():
                 flash("New password and confirmation do not match.", "warning")
                 return redirect(url_for("edit_clinic_profile"))
 
-            user = cur.execute(
-                "SELECT * FROM users WHERE id = ?",
-                (clinic["user_id"],)
-            ).fetchone()
+            user = repos.users.by_id(clinic["user_id"])
 
             if not user or not check_password_hash(user["password_hash"], current_password):
                 conn.close()
                 flash("Current password is incorrect.", "danger")
                 return redirect(url_for("edit_clinic_profile"))
 
-            new_hash = generate_password_hash(new_password)
-            cur.execute(
-                "UPDATE users SET password_hash = ? WHERE id = ?",
-                (new_hash, clinic["user_id"])
-            )
+            repos.users.set_password_hash(clinic["user_id"], generate_password_hash(new_password))
 
         conn.commit()
         conn.close()
 
         return redirect(url_for("clinic_dashboard", tab="profile"))
 
-    clinic = cur.execute(
-        "SELECT * FROM clinics WHERE id = ?",
-        (clinic["id"],),
-    ).fetchone()
+    clinic = repos.clinics.by_id(clinic["id"])
     conn.close()
 
     return render_template("edit_clinic_profile.html", clinic=clinic)
@@ -2105,7 +1921,7 @@ def admin_view_list(status):
     per_page = 5
     offset = (page - 1) * per_page
 
-    conn = get_db()
+    conn = get_read_db()
 
     # Fetch users for this page
     users = conn.execute(
@@ -2139,24 +1955,14 @@ def clinic_reports():
         return redirect(url_for("login"))
 
     clinic = get_or_create_clinic_for_current_user()
-    conn = get_db()
-    
-    # 2. Metric: Total Appointments (Approved AND Completed)
-    total_appointments = conn.execute('''
-        SELECT COUNT(*) 
-        FROM appointments a
-        JOIN doctors d ON a.doctor_id = d.id
-        WHERE d.clinic_id = ? AND a.status IN ('approved', 'completed')
-    ''', (clinic['id'],)).fetchone()[0]
-
-    # 3. Financials: Gross Revenue (Approved AND Completed)
-    raw_revenue = conn.execute('''
-        SELECT SUM(d.base_fee) 
-        FROM appointments a
-        JOIN doctors d ON a.doctor_id = d.id
-        WHERE d.clinic_id = ? AND a.status IN ('approved', 'completed')
-    ''', (clinic['id'],)).fetchone()[0]
+    conn = get_read_db()
     
+    # 2. Metrics: Total Appointments and Gross Revenue (Approved AND Completed),
+    #    Average Rating (Only Completed/Rated ones)
+    total_appointments, raw_revenue, avg_rating = (
+        Repositories(conn).appointments.clinic_totals(clinic['id'])
+    )
+
     # Safety check
     gross_revenue = raw_revenue if raw_revenue else 0.0
     
@@ -2169,14 +1975,6 @@ def clinic_reports():
     clinic_commission = round(clinic_commission, 2)
     doctor_payout = round(doctor_payout, 2)
 
-    # 4. Metric: Average Rating (Only Completed/Rated ones)
-    avg_rating = conn.execute('''
-        SELECT AVG(a.rating) 
-        FROM appointments a
-        JOIN doctors d ON a.doctor_id = d.id
-        WHERE d.clinic_id = ? AND a.rating IS NOT NULL
-    ''', (clinic['id'],)).fetchone()[0]
-
     average_rating = round(avg_rating, 1) if avg_rating else 0.0
 
     conn.close()
@@ -2195,20 +1993,13 @@ def clinic_reports():
 # MODULE 2 - Search & Appointment Booking (Sriti)
 # ---------------------------------------------------------
 
-import os as _os  # avoid clashing with above imports
-import re as _re
-import sqlite3 as _sqlite3
-from datetime import datetime as _dt2, timedelta
+from datetime import datetime as _dt2, date as _date, timedelta
 from flask import jsonify as _jsonify
 
-DB_PATH = _os.path.join("instance", "petcare.db")
-
 
 def _get_conn():
-    """Simple helper JUST for these routes."""
-    conn = _sqlite3.connect(DB_PATH)
-    conn.row_factory = _sqlite3.Row
-    return conn
+    """Same request-scoped connection as get_db()."""
+    return get_db()
 
 
 def _require_owner():
@@ -2227,9 +2018,13 @@ def _get_owner_for_current_user(conn):
     user_id = session.get("user_id")
     if not user_id:
         return None
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM owners WHERE user_id = ?", (user_id,))
-    return cur.fetchone()
+    return Repositories(conn).owners.by_user(user_id)
+
+
+def _current_owner_id(conn):
+    """owners.id of the logged-in owner, or None."""
+    owner = _get_owner_for_current_user(conn)
+    return owner["id"] if owner else None
 
 
 # -------------------------- Search --------------------------
@@ -2237,7 +2032,8 @@ def _get_owner_for_current_user(conn):
 @app.route("/owner/search")
 def owner_search():
     """
-    Search clinics by name, location, rating.
+    Search clinics by name, location, doctor name or qualification
+    (directory_fts, prefix matches ranked by bm25), location and rating.
     Uses clinics + doctors + users.is_verified.
     Clinic rating = AVG(doctors.rating) (doctor avg ratings)
     Clinic review count = total number of appointment ratings across doctors in that clinic
@@ -2249,71 +2045,33 @@ def owner_search():
     q = (request.args.get("q") or "").strip()
     location_filter = (request.args.get("location") or "").strip()
     rating_filter = (request.args.get("rating") or "").strip()
+    mode = "earliest" if request.args.get("mode") == "earliest" else "clinics"
+    max_fee = (request.args.get("max_fee") or "").strip()
 
-    conn = _get_conn()
+    conn = get_read_db()
     owner = _get_owner_for_current_user(conn)
 
-    cur = conn.cursor()
+    repos = Repositories(conn)
 
     # Locations list from clinics table
-    cur.execute("SELECT DISTINCT location FROM clinics ORDER BY location")
-    locations = [row["location"] for row in cur.fetchall() if row["location"]]
-
-    # ✅ Updated query:
-    # - clinic_rating = average of doctors.rating (doctor average ratings)
-    # - clinic_review_count = total number of reviews (appointments.rating IS NOT NULL) across that clinic
-    sql = """
-        SELECT
-            c.*,
-            u.clinic_location,
-            COALESCE(AVG(COALESCE(d.rating, 0)), 0) AS clinic_rating,
-            (
-                SELECT COUNT(a.rating)
-                FROM appointments a
-                JOIN doctors d2 ON a.doctor_id = d2.id
-                WHERE d2.clinic_id = c.id
-                  AND a.rating IS NOT NULL
-            ) AS clinic_review_count,
-            COUNT(d.id) AS doctor_count
-        FROM clinics c
-        JOIN users u ON c.user_id = u.id
-        LEFT JOIN doctors d ON d.clinic_id = c.id
-        WHERE u.is_verified = 1
-    """
-    params = []
-
-    # Free-text search on name or location (case-insensitive)
-    if q:
-        sql += " AND (LOWER(c.name) LIKE ? OR LOWER(c.location) LIKE ?)"
-        like_q = f"%{q.lower()}%"
-        params.extend([like_q, like_q])
-
-    # Exact location filter, if chosen
-    if location_filter and location_filter.lower() != "all":
-        sql += " AND c.location = ?"
-        params.append(location_filter)
-
-    sql += " GROUP BY c.id ORDER BY c.name"
+    locations = repos.clinics.locations()
+
+    # clinic_rating = average of doctors.rating (doctor average ratings)
+    # clinic_review_count = total number of reviews across that clinic
+    # Full-text search (clinic/doctor names, location, qualifications); exact location
+    # and minimum clinic_rating filters, if chosen, applied in the query
+    clinics = repos.clinics.search_verified(
+        q,
+        location_filter if location_filter and location_filter.lower() != "all" else None,
+        min_rating=RATING_FILTERS.get(rating_filter),
+    )
 
-    cur.execute(sql, params)
-    clinics = cur.fetchall()
+    # "Earliest available" mode: next free slots across all matching doctors
+    earliest = _earliest_slots(
+        conn, *_earliest_filters(request.args), owner_id=owner["id"] if owner else None
+    ) if mode == "earliest" else []
     conn.close()
 
-    # Rating filter (using computed clinic_rating)
-    def passes_rating(c):
-        if not rating_filter or rating_filter == "all":
-            return True
-        rating = c["clinic_rating"] or 0
-        if rating_filter == "4.5plus":
-            return rating >= 4.5
-        if rating_filter == "4plus":
-            return rating >= 4.0
-        if rating_filter == "3plus":
-            return rating >= 3.0
-        return True
-
-    clinics = [c for c in clinics if passes_rating(c)]
-
     return render_template(
         "owner_search.html",
         clinics=clinics,
@@ -2321,131 +2079,219 @@ def owner_search():
         q=q,
         location_filter=location_filter,
         rating_filter=rating_filter,
+        mode=mode,
+        max_fee=max_fee,
+        earliest=earliest,
         owner = owner
     )
 
 
 
-DAY_TOKENS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+def _doctor_slots_for_date(conn, doctor_id: int, date_str: str, owner_id=None):
+    """
+    Return available start times (['HH:MM', ...]) for a given doctor on a given date,
+    on the doctor's slot grid and with room for a whole visit.
+    Filters by weekly schedule, removes times overlapping booked/rescheduled visits
+    or other owners' holds (owner_id's own hold stays free), and removes past
+    times if date is today.
+    """
+    try:
+        day = _date.fromisoformat(date_str)
+    except ValueError:
+        return []
+
+    repos = Repositories(conn)
+    doctor = repos.doctors.by_id(doctor_id)
+    if not doctor:
+        return []
 
+    # Working ranges for that weekday (doctor_schedule primary key lookup)
+    schedule = slot_mask.from_ranges(repos.doctors.day_ranges(doctor_id, day.weekday()))
+    if not schedule:
+        return []
 
-def _expand_half_hours(start_str: str, end_str: str):
-    """Return ['HH:MM', ...] every 30 min from start (inclusive) to end (exclusive)."""
-    start = _dt2.strptime(start_str, "%H:%M")
-    end = _dt2.strptime(end_str, "%H:%M")
-    out = []
-    t = start
-    while t < end:
-        out.append(t.strftime("%H:%M"))
-        t += timedelta(minutes=30)
-    return out
+    # Already booked minutes as one bitmask (doctor_day_booked primary key lookup)
+    booked = repos.appointments.booked_mask(doctor_id, _epoch_day(day))
+    booked |= _held_masks(repos, [doctor_id], _epoch_day(day), 1, owner_id).get((doctor_id, 0), 0)
 
+    return slot_mask.to_times(slot_mask.free_starts(
+        schedule, booked, _past_mask(day, _dt2.now()),
+        doctor["visit_minutes"], doctor["slot_minutes"],
+    ))
 
-def _parse_weekly_schedule_by_day(weekly_schedule: str):
-    """
-    Parse a free-text weekly schedule into a dict:
-      {'mon': [('12:00','20:00'), ('09:00','11:00')], 'tue': [...], ...}
-    """
-    if not weekly_schedule:
-        return {}
 
-    text = weekly_schedule.lower() + " __END__"
+def _held_masks(repos, doctor_ids, first_day, days, owner_id=None):
+    """Other owners' unexpired holds, keyed like the booked masks."""
+    return repos.holds.held_masks(doctor_ids, first_day, days, int(_wall_clock_seconds()), owner_id)
+
 
-    positions = []
-    for d in DAY_TOKENS:
-        for m in _re.finditer(rf"\b{d}\w*\b", text):  
-            positions.append((m.start(), d))
-    positions.sort()
+def _with_holds(booked, held):
+    """booked masks with the held minutes added."""
+    merged = dict(booked)
+    for key, mask in held.items():
+        merged[key] = merged.get(key, 0) | mask
+    return merged
 
-    chunks = []
-    for i, (pos, day) in enumerate(positions):
-        end_pos = positions[i + 1][0] if i + 1 < len(positions) else text.index(" __END__")
-        chunks.append((day, text[pos:end_pos]))
 
-    out = {d: [] for d in DAY_TOKENS}
-    for day, chunk in chunks:
-        times = _re.findall(r"(\d{2}:\d{2})", chunk)
-        for i in range(0, len(times), 2):
-            if i + 1 < len(times):
-                out[day].append((times[i], times[i + 1]))
+def _past_mask(day, now):
+    """Minutes already started if `day` is today, nothing for later days."""
+    if day != now.date():
+        return 0
+    return slot_mask.past_mask(now.hour * 60 + now.minute)
 
-    return {d: ranges for d, ranges in out.items() if ranges}
 
+AVAILABILITY_DAYS = 14
+MAX_AVAILABILITY_DAYS = 31
 
-def _doctor_slots_for_date(conn, doctor_id: int, date_str: str):
+
+def _clinic_free_masks(conn, clinic_id, start_day, days=AVAILABILITY_DAYS, owner_id=None):
     """
-    Return 30-min available start times (['HH:MM', ...]) for a given doctor on a given date.
-    Filters by weekly schedule, removes booked/rescheduled times,
-    and removes past times if date is today.
+    {(doctor_id, day_offset): bookable start slot_mask} for every doctor of
+    a clinic over `days` days from start_day: schedule + visit/grid queries,
+    one doctor_day_booked range read and one slot_holds range read (holds
+    of owners other than owner_id count as booked). Doctor-days with nothing
+    free are left out.
     """
-    cur = conn.cursor()
+    repos = Repositories(conn)
+    schedules = repos.doctors.clinic_schedules(clinic_id)
+    if not schedules:
+        return {}
 
-    cur.execute(
-        "SELECT weekly_schedule FROM doctors WHERE id = ?",
-        (doctor_id,)
+    timings = repos.doctors.timings(schedules)
+    booked = _with_holds(
+        repos.appointments.clinic_booked_masks(clinic_id, _epoch_day(start_day), days),
+        _held_masks(repos, schedules, _epoch_day(start_day), days, owner_id),
     )
-    row = cur.fetchone()
-    if not row:
-        return []
 
-    weekly = row["weekly_schedule"] or ""
-    schedule_by_day = _parse_weekly_schedule_by_day(weekly)
+    weekly_masks = {
+        doctor_id: {weekday: slot_mask.from_ranges(ranges) for weekday, ranges in weekly.items()}
+        for doctor_id, weekly in schedules.items()
+    }
 
-    try:
-        day_dt = _dt2.strptime(date_str, "%Y-%m-%d")
-    except ValueError:
-        return []
+    now = _dt2.now()
+    free = {}
+    for offset in range(days):
+        day = start_day + timedelta(days=offset)
+        if day < now.date():
+            continue
+        past = _past_mask(day, now)
+        for doctor_id, weekly in weekly_masks.items():
+            mask = slot_mask.free_starts(
+                weekly.get(day.weekday(), 0), booked.get((doctor_id, offset), 0), past,
+                *timings[doctor_id]
+            )
+            if mask:
+                free[(doctor_id, offset)] = mask
+    return free
 
-    weekday = day_dt.strftime("%a").lower()[:3]  # mon, tue, wed
-    if weekday not in schedule_by_day:
-        return []
 
-    # Expand schedule → 30-min slots
-    slots = []
-    for start, end in schedule_by_day[weekday]:
-        slots.extend(_expand_half_hours(start, end))
+def _clinic_availability(conn, clinic_id, start_day, days=AVAILABILITY_DAYS, owner_id=None):
+    """
+    {doctor_id: {'YYYY-MM-DD': ['HH:MM', ...]}} for every doctor of a clinic,
+    instead of one /slots call per doctor per date.
+    """
+    availability = {}
+    for (doctor_id, offset), mask in sorted(_clinic_free_masks(conn, clinic_id, start_day, days, owner_id).items()):
+        day = start_day + timedelta(days=offset)
+        availability.setdefault(doctor_id, {})[day.isoformat()] = slot_mask.to_times(mask)
+    return availability
+
+
+EARLIEST_DAYS = 30
+EARLIEST_LIMIT = 10
+MAX_EARLIEST_LIMIT = 50
 
-    if not slots:
+# owner_search rating filter values -> minimum rating
+RATING_FILTERS = {"4.5plus": 4.5, "4plus": 4.0, "3plus": 3.0}
+
+
+def _earliest_slots(conn, location=None, max_fee=None, min_rating=None,
+                    limit=EARLIEST_LIMIT, days=EARLIEST_DAYS, owner_id=None):
+    """
+    The `limit` earliest free slots across the doctors of all verified
+    clinics (optionally in one location, under a fee, above a doctor rating),
+    looking `days` days ahead. Four indexed reads: candidate doctors, their
+    weekly schedule masks, their doctor_day_booked intervals and the holds
+    of owners other than owner_id; the rest is mask arithmetic, day by day
+    until enough slots are found.
+    """
+    repos = Repositories(conn)
+    doctors = {d["id"]: d for d in repos.doctors.bookable(location, max_fee, min_rating)}
+    week_masks = repos.doctors.week_masks(doctors)
+    if not week_masks:
         return []
 
-    # Fetch already taken slots
-    cur.execute(
-        """
-        SELECT appointment_date
-        FROM appointments
-        WHERE doctor_id = ?
-          AND appointment_date LIKE ?
-          AND status IN (
-            'pending',
-            'approved',
-            'completed',
-            'rescheduled',
-            'reschedule_pending'
-          )
-        """,
-        (doctor_id, f"{date_str}%"),
+    now = _dt2.now()
+    today = now.date()
+    booked = _with_holds(
+        repos.appointments.booked_masks(week_masks, _epoch_day(today), days),
+        _held_masks(repos, week_masks, _epoch_day(today), days, owner_id),
     )
 
-    taken = set()
-    for r in cur.fetchall():
-        try:
-            hm = _dt2.strptime(
-                r["appointment_date"], "%Y-%m-%d %H:%M"
-            ).strftime("%H:%M")
-            taken.add(hm)
-        except Exception:
-            pass
+    results = []
+    for offset in range(days):
+        day = today + timedelta(days=offset)
+        past = _past_mask(day, now)
+        found = []
+        for doctor_id, weekly in week_masks.items():
+            d = doctors[doctor_id]
+            mask = slot_mask.free_starts(
+                weekly.get(day.weekday(), 0), booked.get((doctor_id, offset), 0), past,
+                d["visit_minutes"], d["slot_minutes"],
+            )
+            found.extend((m, doctor_id) for m in slot_mask.minutes(mask)[:limit])
+        found.sort(key=lambda f: (f[0], doctors[f[1]]["name"]))
+        for minute, doctor_id in found[:limit - len(results)]:
+            d = doctors[doctor_id]
+            results.append({
+                "date": day.isoformat(),
+                "time": format_minute(minute),
+                "doctor_id": doctor_id,
+                "doctor_name": d["name"],
+                "base_fee": d["base_fee"],
+                "rating": d["rating"],
+                "visit_minutes": d["visit_minutes"],
+                "clinic_id": d["clinic_id"],
+                "clinic_name": d["clinic_name"],
+                "location": d["location"],
+            })
+        if len(results) >= limit:
+            break
+    return results
 
-    # Remove taken slots
-    available = [s for s in slots if s not in taken]
 
-    # Remove past times if date is today
-    today_str = _dt2.now().strftime("%Y-%m-%d")
-    if date_str == today_str:
-        now_hm = _dt2.now().strftime("%H:%M")
-        available = [s for s in available if s > now_hm]
+def _earliest_filters(args):
+    """(location, max_fee, min_rating) from owner_search-style query args."""
+    location = (args.get("location") or "").strip()
+    location = location if location and location.lower() != "all" else None
+    max_fee = args.get("max_fee", type=float)
+    min_rating = args.get("min_rating", type=float)
+    if min_rating is None:
+        min_rating = RATING_FILTERS.get((args.get("rating") or "").strip())
+    return location, max_fee, min_rating
 
-    return available
+
+@app.route("/owner/search/earliest")
+def owner_earliest_slots():
+    """
+    JSON API: ?location=Dhaka&max_fee=800&min_rating=4&limit=10
+      -> [{"date", "time", "doctor_id", "doctor_name", "clinic_id", ...}, ...]
+    Earliest free slots across verified clinics. Only for logged-in owners.
+    """
+    guard = _require_owner()
+    if guard:
+        return guard
+
+    limit = request.args.get("limit", EARLIEST_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_EARLIEST_LIMIT))
+
+    conn = get_read_db()
+    try:
+        return _jsonify(_earliest_slots(
+            conn, *_earliest_filters(request.args), limit=limit, owner_id=_current_owner_id(conn)
+        ))
+    finally:
+        conn.close()
 
 
 @app.route("/owner/clinic/<int:clinic_id>")
@@ -2459,46 +2305,18 @@ def owner_clinic_detail(clinic_id):
     if guard:
         return guard
 
-    conn = _get_conn()
-    cur = conn.cursor()
+    conn = get_read_db()
+    repos = Repositories(conn)
 
     # ✅ Updated clinic info: rating + review count
-    cur.execute(
-        """
-        SELECT
-            c.*,
-            COALESCE(AVG(COALESCE(d.rating, 0)), 0) AS clinic_rating,
-            (
-                SELECT COUNT(a.rating)
-                FROM appointments a
-                JOIN doctors d2 ON a.doctor_id = d2.id
-                WHERE d2.clinic_id = c.id
-                  AND a.rating IS NOT NULL
-            ) AS clinic_review_count
-        FROM clinics c
-        LEFT JOIN doctors d ON d.clinic_id = c.id
-        WHERE c.id = ?
-        GROUP BY c.id
-        """,
-        (clinic_id,),
-    )
-    clinic = cur.fetchone()
+    clinic = repos.clinics.with_rating(clinic_id)
     if not clinic:
         conn.close()
         flash("Clinic not found.", "danger")
         return redirect(url_for("owner_search"))
 
     # Doctors in this clinic
-    cur.execute(
-        """
-        SELECT *
-        FROM doctors
-        WHERE clinic_id = ?
-        ORDER BY name
-        """,
-        (clinic_id,),
-    )
-    doctors = cur.fetchall()
+    doctors = repos.doctors.for_clinic(clinic_id)
 
     # Owner + pets
     owner = _get_owner_for_current_user(conn)
@@ -2507,16 +2325,10 @@ def owner_clinic_detail(clinic_id):
         flash("Owner profile not found.", "danger")
         return redirect(url_for("owner_dashboard"))
 
-    cur.execute(
-        """
-        SELECT *
-        FROM pets
-        WHERE owner_id = ?
-        ORDER BY name
-        """,
-        (owner["id"],),
-    )
-    pets = cur.fetchall()
+    pets = repos.pets.for_owner(owner["id"], by_name=True)
+
+    # Slot picker data for the next AVAILABILITY_DAYS days, all doctors at once
+    doctor_slots = _clinic_availability(conn, clinic_id, _dt2.now().date(), owner_id=owner["id"])
 
     conn.close()
 
@@ -2527,13 +2339,127 @@ def owner_clinic_detail(clinic_id):
         clinic=clinic,
         doctors=doctors,
         pets=pets,
-        doctor_slots={},
+        doctor_slots=doctor_slots,
+        availability_days=AVAILABILITY_DAYS,
+        series_max_count=SERIES_MAX_COUNT,
         today=today
     )
 
 
 
 
+@app.route("/owner/clinic/<int:clinic_id>/availability")
+def owner_clinic_availability(clinic_id):
+    """
+    JSON API: ?start=YYYY-MM-DD&days=14  ->  {"<doctor_id>": {"YYYY-MM-DD": ["09:00", ...]}}
+    Every doctor of the clinic in one response. Only for logged-in owners.
+    """
+    guard = _require_owner()
+    if guard:
+        return guard
+
+    try:
+        start_day = _date.fromisoformat((request.args.get("start") or "").strip())
+    except ValueError:
+        start_day = _dt2.now().date()
+    days = request.args.get("days", AVAILABILITY_DAYS, type=int)
+    days = max(1, min(days, MAX_AVAILABILITY_DAYS))
+
+    conn = get_read_db()
+    try:
+        availability = _clinic_availability(conn, clinic_id, start_day, days, _current_owner_id(conn))
+        return _jsonify({str(doctor_id): dates for doctor_id, dates in availability.items()})
+    finally:
+        conn.close()
+
+
+@app.route("/owner/clinic/<int:clinic_id>/free_at")
+def owner_clinic_free_at(clinic_id):
+    """
+    JSON API: ?date=YYYY-MM-DD&time=HH:MM  ->  [doctor_id, ...]
+    Doctors of the clinic with that slot free. Only for logged-in owners.
+    """
+    guard = _require_owner()
+    if guard:
+        return guard
+
+    try:
+        day = _date.fromisoformat((request.args.get("date") or "").strip())
+        at = _dt2.strptime((request.args.get("time") or "").strip(), "%H:%M")
+    except ValueError:
+        return _jsonify([])
+
+    conn = get_read_db()
+    try:
+        masks = {
+            doctor_id: mask
+            for (doctor_id, _), mask in _clinic_free_masks(conn, clinic_id, day, 1, _current_owner_id(conn)).items()
+        }
+        return _jsonify(sorted(slot_mask.who_is_free(masks, at.hour * 60 + at.minute)))
+    finally:
+        conn.close()
+
+
+HOLD_TTL_SECONDS = 5 * 60
+
+
+@app.route("/owner/doctor/<int:doctor_id>/hold", methods=["POST"])
+def owner_hold_slot(doctor_id):
+    """
+    JSON API: POST date=YYYY-MM-DD&time=HH:MM  ->  {"held": true, "expires_in": 300}
+    Reserves the slot for HOLD_TTL_SECONDS while the owner fills in the
+    booking form (one hold per owner). 409 if the slot is booked or held by
+    someone else; the client picks another slot instead of retrying.
+    """
+    guard = _require_owner()
+    if guard:
+        return guard
+
+    try:
+        dt = _dt2.strptime(
+            f"{(request.form.get('date') or '').strip()} {(request.form.get('time') or '').strip()}",
+            "%Y-%m-%d %H:%M",
+        )
+    except ValueError:
+        return _jsonify({"held": False, "error": "Please pick a valid date and time."}), 400
+    if dt < _dt2.now().replace(second=0, microsecond=0):
+        return _jsonify({"held": False, "error": "This time has already passed."}), 409
+
+    conn = get_read_db()
+    repos = Repositories(conn)
+    owner = _get_owner_for_current_user(conn)
+    doctor = repos.doctors.by_id(doctor_id)
+    on_grid = doctor is not None and booking.on_slot_grid(doctor, dt)
+    works = on_grid and booking.fits_doctor_day(repos, doctor, dt)
+    conn.close()
+    if not owner:
+        return _jsonify({"held": False, "error": "Owner profile not found."}), 403
+    if doctor is not None and not on_grid:
+        return _jsonify({"held": False, "error": "That time doesn't match the doctor's appointment slots."}), 409
+    if not works:
+        return _jsonify({"held": False, "error": "The doctor is not available at that time."}), 409
+
+    start_minute = _epoch_minutes(dt)
+    visit = doctor["visit_minutes"]
+
+    def place_hold(wconn):
+        wrepos = Repositories(wconn)
+        if wrepos.appointments.slot_taken(doctor_id, start_minute, visit):
+            return False
+        return wrepos.holds.place(
+            doctor_id, start_minute, owner["id"], int(_wall_clock_seconds()), HOLD_TTL_SECONDS, visit
+        )
+
+    try:
+        held = db_writer.run(place_hold)
+    except DatabaseBusy:
+        return _jsonify({"held": False, "error": "Busy right now. Please try again in a moment."}), 503
+
+    if not held:
+        return _jsonify({"held": False, "error": "This slot was just taken. Please pick another."}), 409
+    return _jsonify({"held": True, "expires_in": HOLD_TTL_SECONDS})
+
+
 @app.route("/owner/doctor/<int:doctor_id>/slots")
 def owner_doctor_slots(doctor_id):
     """
@@ -2548,9 +2474,9 @@ def owner_doctor_slots(doctor_id):
     if not date_str:
         return _jsonify([])
 
-    conn = _get_conn()
+    conn = get_read_db()
     try:
-        slots = _doctor_slots_for_date(conn, doctor_id, date_str)
+        slots = _doctor_slots_for_date(conn, doctor_id, date_str, _current_owner_id(conn))
         return _jsonify(slots)
     finally:
         conn.close()
@@ -2711,7 +2637,92 @@ def owner_doctor_slots(doctor_id):
 #=========================================================
 #ADD THIS BLOCK BY RAYAN
 #=========================================================
+POINTS_PER_BOOKING = 10
+
+BOOKING_REJECTIONS = {
+    booking.DOCTOR_NOT_FOUND: ("Doctor not found.", "danger"),
+    booking.NOT_AVAILABLE: ("This doctor is not available on that day. Please choose another date.", "warning"),
+    booking.OFF_GRID: ("That time doesn't match the doctor's appointment slots. Please pick one of the listed times.", "warning"),
+    booking.INVALID_PET: ("Invalid pet selected.", "danger"),
+    booking.SLOT_HELD: ("Someone else is booking this slot right now. Please choose another timing.", "warning"),
+    booking.SLOT_TAKEN: ("Slot is filled, choose another timing.", "danger"),
+    booking.ALREADY_BOOKED: ("You already have an appointment with this doctor at that time.", "warning"),
+}
+
+booking_service = booking.BookingService(db_writer, _epoch_minutes, _wall_clock_seconds)
+
+# Double-clicks / retries of booking, review and payment requests replay the
+# first outcome (idempotency.py); forms render a fresh key each time.
+idempotency_store = idempotency.IdempotencyStore(db_writer, get_read_db, _wall_clock_seconds)
+app.jinja_env.globals["idempotency_key"] = idempotency.new_key
+PAYMENT_KEY_TTL_SECONDS = 90 * 24 * 60 * 60
+
+
+def _waitlist_promoted(promoted):
+    """After the commit that freed a slot: arm expiry + run hooks for promoted bookings."""
+    for booked in promoted:
+        schedule_expiry(booked.appt_id, booked.start_minute)
+    booking_service.committed(promoted)
+
+
+@booking_service.on_commit
+def _booking_emails(booked):
+    """Owner confirmation + clinic notification for a new request."""
+    appt = booked.context
+    if not appt:
+        return
+    pretty_status = _pretty_status(appt.status or "pending")
+    pretty_dt = _pretty_datetime(appt.appointment_date)
+
+    if booked.from_waitlist:
+        placed = "A slot you were waiting for opened up, so we booked it for you."
+    else:
+        placed = "Your appointment request has been placed successfully."
+
+    owner_subject = f"Appointment Update: {pretty_status}"
+    owner_body = (
+        f"Hello {appt.owner_name or 'there'},\n\n"
+        f"{placed}\n\n"
+        f"Clinic: {appt.clinic_name}\n"
+        f"Doctor: {appt.doctor_name}\n"
+        f"Pet: {appt.pet_name}\n"
+        f"Time: {pretty_dt}\n"
+        f"Status: {pretty_status}\n\n"
+        f"You will receive another update when the clinic approves, cancels, or reschedules this appointment.\n\n"
+        f"{EMAIL_SIGNATURE}\n"
+    )
+    send_email(appt.owner_email, owner_subject, owner_body)
+
+    clinic_subject = f"New Appointment Request: {pretty_status}"
+    clinic_body = (
+        f"Hello {appt.clinic_name or 'there'},\n\n"
+        f"A new appointment request has been made.\n\n"
+        f"Owner: {appt.owner_name}\n"
+        f"Pet: {appt.pet_name}\n"
+        f"Doctor: {appt.doctor_name}\n"
+        f"Time: {pretty_dt}\n"
+        f"Status: {pretty_status}\n\n"
+        f"Please review this request from your clinic dashboard.\n\n"
+        f"{EMAIL_SIGNATURE}\n"
+    )
+    send_email(appt.clinic_email, clinic_subject, clinic_body)
+
+
+#Feature 12 (Rayan)
+# Award points ONLY if premium (is_premium = 1 when the booking was made)
+@booking_service.on_commit(when=lambda booked: booked.is_premium)
+def _booking_reward_points(booked):
+    db_writer.run(lambda conn: Repositories(conn).owners.add_reward_points(booked.owner_id, POINTS_PER_BOOKING))
+
+
+# Auto-trigger outbreak detection if symptoms were provided
+@booking_service.on_commit(coalesce=True, when=lambda booked: bool(booked.symptom_notes))
+def _booking_outbreak_detection(booked):
+    save_outbreak_alerts_to_db()
+
+
 @app.route("/owner/book/<int:clinic_id>/<int:doctor_id>", methods=["POST"])
+@idempotency_store.guard()
 def book_appointment(clinic_id, doctor_id):
     """Book an appointment for a pet with a doctor."""
     if "user_id" not in session or session.get("role") != "owner":
@@ -2728,6 +2739,8 @@ def book_appointment(clinic_id, doctor_id):
     time_str = request.form.get("time")
     appointment_reason = (request.form.get("appointment_reason") or "").strip()
     symptom_notes = (request.form.get("symptom_notes") or "").strip()
+    join_waitlist = request.form.get("waitlist") == "1"
+    repeat_count = request.form.get("repeat_count", type=int) or 1
 
     # keep payload small
     appointment_reason = appointment_reason[:300]
@@ -2746,115 +2759,158 @@ def book_appointment(clinic_id, doctor_id):
         flash("Please pick a valid date and time.", "warning")
         return redirect(url_for("owner_clinic_detail", clinic_id=clinic_id))
 
-    appointment_dt = dt.strftime("%Y-%m-%d %H:%M")
-    weekday_short = dt.strftime("%a").lower()
-
-    conn = get_db()
-    cur = conn.cursor()
+    if repeat_count > 1:
+        series = _series_datetimes(dt, request.form.get("repeat_every", type=int), repeat_count)
+        if not series:
+            flash(f"A series repeats every 1-{SERIES_MAX_EVERY_DAYS} days, at most {SERIES_MAX_COUNT} times.", "warning")
+            return redirect(url_for("owner_clinic_detail", clinic_id=clinic_id))
+        try:
+            booked = booking_service.book_series(
+                owner, clinic_id, doctor_id, pet_id, series, appointment_reason, symptom_notes
+            )
+        except DatabaseBusy:
+            idempotency.retry_later()
+            flash("Lots of bookings are coming in right now. Please try again in a moment.", "warning")
+            return redirect(url_for("owner_clinic_detail", clinic_id=clinic_id))
+        except booking.BookingRejected as e:
+            message, category = BOOKING_REJECTIONS[e.reason]
+            flash(message, category)
+            return redirect(url_for("owner_clinic_detail", clinic_id=clinic_id))
+        except booking.SeriesConflicts as e:
+            flash("Nothing was booked. " + " ".join(_series_conflict_text(c) for c in e.conflicts), "warning")
+            return redirect(url_for("owner_clinic_detail", clinic_id=clinic_id))
+        for b in booked:
+            schedule_expiry(b.appt_id, b.start_minute)
+        flash(f"{len(booked)} appointments booked! Waiting for clinic confirmation.", "success")
+        return redirect(url_for("owner_appointments"))
 
-    # Check doctor's weekly availability
-    cur.execute("SELECT weekly_schedule FROM doctors WHERE id = ?", (doctor_id,))
-    doctor_row = cur.fetchone()
-    if not doctor_row:
-        conn.close()
-        flash("Doctor not found.", "danger")
+    # Validation + insert: one short write transaction (booking.py);
+    # emails, outbreak detection and reward points run after the commit.
+    try:
+        if join_waitlist:
+            booked, position = booking_service.book_or_wait(
+                owner, clinic_id, doctor_id, pet_id, dt, appointment_reason, symptom_notes
+            )
+        else:
+            booked = booking_service.book(
+                owner, clinic_id, doctor_id, pet_id, dt, appointment_reason, symptom_notes
+            )
+    except DatabaseBusy:
+        idempotency.retry_later()
+        flash("Lots of bookings are coming in right now. Please try again in a moment.", "warning")
         return redirect(url_for("owner_clinic_detail", clinic_id=clinic_id))
-
-    weekly_schedule = (doctor_row["weekly_schedule"] or "").lower()
-    day_code = {"mon": "mon", "tue": "tue", "wed": "wed", "thu": "thu", 
-                "fri": "fri", "sat": "sat", "sun": "sun"}[weekday_short]
-
-    if day_code not in weekly_schedule:
-        conn.close()
-        flash("This doctor is not available on that day. Please choose another date.", "warning")
+    except booking.BookingRejected as e:
+        message, category = BOOKING_REJECTIONS[e.reason]
+        flash(message, category)
         return redirect(url_for("owner_clinic_detail", clinic_id=clinic_id))
 
-    # Verify pet belongs to owner
-    cur.execute("SELECT 1 FROM pets WHERE id = ? AND owner_id = ?", (pet_id, owner["id"]))
-    if not cur.fetchone():
-        conn.close()
-        flash("Invalid pet selected.", "danger")
-        return redirect(url_for("owner_clinic_detail", clinic_id=clinic_id))
+    if not booked:
+        flash(f"That slot is taken. You are #{position} on the waitlist and will be booked "
+              "automatically (and emailed) if it frees up.", "info")
+        return redirect(url_for("owner_appointments"))
 
-    # Prevent double booking
-    cur.execute("""
-        SELECT id FROM appointments
-        WHERE doctor_id = ? AND appointment_date = ?
-          AND status IN ('pending', 'completed', 'approved')
-    """, (doctor_id, appointment_dt))
-    if cur.fetchone():
-        conn.close()
-        flash("Slot is filled, choose another timing.", "danger")
-        return redirect(url_for("owner_clinic_detail", clinic_id=clinic_id))
+    schedule_expiry(booked.appt_id, booked.start_minute)
 
-    # Insert appointment
-    cur.execute("""
-        INSERT INTO appointments (
-            pet_id, doctor_id, appointment_date, status,
-            appointment_reason, symptom_notes
-        )
-        VALUES (?, ?, ?, 'pending', ?, ?)
-    """, (pet_id, doctor_id, appointment_dt, appointment_reason, symptom_notes))
-    appt_id = cur.lastrowid
-    #Feature 12 (Rayan)
-    # Award points ONLY if premium (check is_premium = 1)
-    if owner['is_premium'] == 1:
-        POINTS_PER_BOOKING = 10
-        cur.execute("""
-            UPDATE owners 
-            SET reward_points = COALESCE(reward_points, 0) + ? 
-            WHERE id = ?
-        """, (POINTS_PER_BOOKING, owner['id']))
-        flash(f"Appointment booked! You earned {POINTS_PER_BOOKING} reward points! 🏆", "success")
+    if booked.is_premium:
+        # _booking_reward_points runs after the commit, so the points are still on their way
+        flash(f"Appointment booked! {POINTS_PER_BOOKING} reward points will be credited to your account shortly. 🏆", "success")
     else:
         flash("Appointment booked! Waiting for clinic confirmation.", "success")
 
-    conn.commit()
+    return redirect(url_for("owner_appointments"))
+
+
+SERIES_MAX_COUNT = 12
+SERIES_MAX_EVERY_DAYS = 365
+
+SERIES_CONFLICT_WORDS = {
+    booking.NOT_AVAILABLE: "is outside the doctor's hours",
+    booking.OFF_GRID: "doesn't match the doctor's appointment slots",
+    booking.SLOT_TAKEN: "is taken",
+    booking.SLOT_HELD: "is being booked by someone else",
+}
+
+
+def _series_datetimes(first, every_days, count):
+    """The occurrences of a series, or None if the rule is out of bounds."""
+    if not every_days or not 1 <= every_days <= SERIES_MAX_EVERY_DAYS or not 1 <= count <= SERIES_MAX_COUNT:
+        return None
+    return booking.series_datetimes(first, every_days, count)
+
+
+def _series_conflict_text(conflict):
+    text = f"{conflict.when.strftime('%Y-%m-%d %H:%M')} {SERIES_CONFLICT_WORDS[conflict.reason]}"
+    if conflict.alternative:
+        text += f" (nearest free: {conflict.alternative.strftime('%Y-%m-%d %H:%M')})"
+    return text + "."
+
+
+@app.route("/owner/book/<int:clinic_id>/<int:doctor_id>/series", methods=["POST"])
+@idempotency_store.guard()
+def book_appointment_series(clinic_id, doctor_id):
+    """
+    JSON API: POST pet_id, date, time, every_days, count (+ appointment_reason,
+    symptom_notes) -> {"booked": [{"id": 12, "date": "YYYY-MM-DD HH:MM"}, ...]}
+    Books the whole series or nothing. 409 lists each conflicting occurrence
+    with the nearest free alternative:
+    {"booked": [], "conflicts": [{"date": ..., "reason": "taken", "alternative": ... or null}]}
+    """
+    guard = _require_owner()
+    if guard:
+        return guard
+
+    conn = get_read_db()
+    owner = _get_owner_for_current_user(conn)
     conn.close()
-    
-    # Auto-trigger outbreak detection if symptoms were provided
-    if symptom_notes and symptom_notes.strip():
-        try:
-            save_outbreak_alerts_to_db()
-        except Exception as e:
-            # Don't break booking flow if detection fails
-            print(f"[Auto-Detection] Error: {e}")
+    if not owner:
+        return _jsonify({"booked": [], "error": "Owner profile not found."}), 403
 
-    # Send emails
-    appt = get_appointment_context(appt_id)
-    if appt:
-        pretty_status = _pretty_status(appt["status"] or "pending")
-        pretty_dt = _pretty_datetime(appt["appointment_date"])
-
-        owner_subject = f"Appointment Update: {pretty_status}"
-        owner_body = (
-            f"Hello {appt['owner_name'] or 'there'},\n\n"
-            f"Your appointment request has been placed successfully.\n\n"
-            f"Clinic: {appt['clinic_name']}\n"
-            f"Doctor: {appt['doctor_name']}\n"
-            f"Pet: {appt['pet_name']}\n"
-            f"Time: {pretty_dt}\n"
-            f"Status: {pretty_status}\n\n"
-            f"You will receive another update when the clinic approves, cancels, or reschedules this appointment.\n\n"
-            f"{EMAIL_SIGNATURE}\n"
-        )
-        send_email_async(appt["owner_email"], owner_subject, owner_body)
-
-        clinic_subject = f"New Appointment Request: {pretty_status}"
-        clinic_body = (
-            f"Hello {appt['clinic_name'] or 'there'},\n\n"
-            f"A new appointment request has been made.\n\n"
-            f"Owner: {appt['owner_name']}\n"
-            f"Pet: {appt['pet_name']}\n"
-            f"Doctor: {appt['doctor_name']}\n"
-            f"Time: {pretty_dt}\n"
-            f"Status: {pretty_status}\n\n"
-            f"Please review this request from your clinic dashboard.\n\n"
-            f"{EMAIL_SIGNATURE}\n"
+    try:
+        dt = _dt2.strptime(
+            f"{(request.form.get('date') or '').strip()} {(request.form.get('time') or '').strip()}",
+            "%Y-%m-%d %H:%M",
         )
-        send_email_async(appt["clinic_email"], clinic_subject, clinic_body)
+    except ValueError:
+        return _jsonify({"booked": [], "error": "Please pick a valid date and time."}), 400
+    if dt < _dt2.now().replace(second=0, microsecond=0):
+        return _jsonify({"booked": [], "error": "You cannot book an appointment in the past."}), 400
+    series = _series_datetimes(
+        dt, request.form.get("every_days", type=int), request.form.get("count", type=int) or 0
+    )
+    if not series:
+        return _jsonify({
+            "booked": [],
+            "error": f"every_days must be 1-{SERIES_MAX_EVERY_DAYS} and count 1-{SERIES_MAX_COUNT}.",
+        }), 400
 
-    return redirect(url_for("owner_appointments"))
+    try:
+        booked = booking_service.book_series(
+            owner, clinic_id, doctor_id, request.form.get("pet_id", type=int), series,
+            (request.form.get("appointment_reason") or "").strip()[:300],
+            (request.form.get("symptom_notes") or "").strip()[:700],
+        )
+    except DatabaseBusy:
+        return _jsonify({"booked": [], "error": "Busy right now. Please try again in a moment."}), 503
+    except booking.BookingRejected as e:
+        return _jsonify({"booked": [], "error": BOOKING_REJECTIONS[e.reason][0]}), 400
+    except booking.SeriesConflicts as e:
+        return _jsonify({
+            "booked": [],
+            "conflicts": [
+                {
+                    "date": c.when.strftime("%Y-%m-%d %H:%M"),
+                    "reason": c.reason,
+                    "alternative": c.alternative.strftime("%Y-%m-%d %H:%M") if c.alternative else None,
+                }
+                for c in e.conflicts
+            ],
+        }), 409
+
+    for b in booked:
+        schedule_expiry(b.appt_id, b.start_minute)
+    return _jsonify({
+        "booked": [{"id": b.appt_id, "date": b.context.appointment_date if b.context else None} for b in booked],
+    })
 
 
 @app.route("/owner/appointments")
@@ -2869,9 +2925,6 @@ def owner_appointments():
         return guard
 
     conn = get_db()
-    auto_update_past_appointments(conn)
-
-    cur = conn.cursor()
 
     owner = _get_owner_for_current_user(conn)
     if not owner:
@@ -2879,47 +2932,26 @@ def owner_appointments():
         flash("Owner profile not found.", "danger")
         return redirect(url_for("owner_dashboard"))
 
-    cur.execute(
-        """
-        SELECT
-            a.*,
-            d.name               AS doctor_name,
-            c.name               AS clinic_name,
-            c.location           AS clinic_location,
-            p.name               AS pet_name,
-            p.animal_type        AS pet_animal_type,
-            p.breed              AS pet_breed,
-            p.gender             AS pet_gender,
-            p.age                AS pet_age,
-            p.vaccination_status AS pet_vaccination_status
-        FROM appointments a
-        JOIN pets    p ON a.pet_id   = p.id
-        JOIN owners  o ON p.owner_id = o.id
-        JOIN doctors d ON a.doctor_id = d.id
-        JOIN clinics c ON d.clinic_id = c.id
-        WHERE o.id = ?
-        ORDER BY a.appointment_date DESC
-        """,
-        (owner["id"],),
-    )
-    rows = cur.fetchall()
+    repos = Repositories(conn)
+    rows = repos.appointments.for_owner(owner["id"])
+    waiting = repos.waitlist.for_owner(owner["id"], _epoch_minutes(datetime.now()))
     conn.close()
 
     upcoming, completed, cancelled = [], [], []
 
     for r in rows:
-        status = (r["status"] or "").lower()
+        status = r["status"]
 
-        if status in ("completed", "done"):
+        if appt_status.is_completed(status):
             completed.append(r)
-        elif status in ("cancelled", "canceled", "owner_cancelled", "clinic_cancelled"):
+        elif appt_status.is_cancelled(status):
             cancelled.append(r)
         else:
             upcoming.append(r)
 
     def upcoming_sort_key(a):
-        st = (a["status"] or "").lower()
-        priority = 0 if st == "reschedule_pending" else 1
+        st = appt_status.normalize(a["status"])
+        priority = 0 if st == appt_status.RESCHEDULE_PENDING else 1
         return (priority, a["appointment_date"])
 
     upcoming = sorted(upcoming, key=upcoming_sort_key)
@@ -2929,10 +2961,37 @@ def owner_appointments():
         upcoming=upcoming,
         completed=completed,
         cancelled=cancelled,
+        waiting=waiting,
         owner = owner
     )
 
 
+@app.route("/owner/waitlist/<int:entry_id>/leave", methods=["POST"])
+def owner_leave_waitlist(entry_id):
+    guard = _require_owner()
+    if guard:
+        return guard
+
+    conn = get_read_db()
+    owner = _get_owner_for_current_user(conn)
+    conn.close()
+    if not owner:
+        flash("Owner profile not found.", "danger")
+        return redirect(url_for("owner_dashboard"))
+
+    try:
+        left = db_writer.run(lambda wconn: Repositories(wconn).waitlist.leave(entry_id, owner["id"]))
+    except DatabaseBusy:
+        flash("The system is busy right now. Please try again in a moment.", "warning")
+        return redirect(url_for("owner_appointments"))
+
+    if left:
+        flash("You left the waitlist.", "info")
+    else:
+        flash("Waitlist entry not found.", "warning")
+    return redirect(url_for("owner_appointments"))
+
+
 
 # ---------------- DEMO HELPERS (temporary) ----------------
 DEMO_MODE = True  # set to False before final submission if you want
@@ -2950,32 +3009,25 @@ def owner_demo_complete(appt_id):
         return redirect(url_for("login"))
 
     conn = get_db()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
+    repos = Repositories(conn)
 
     # Ensure appointment belongs to this owner AND is approved
-    row = cur.execute("""
-        SELECT a.id, a.status
-        FROM appointments a
-        JOIN pets p ON a.pet_id = p.id
-        JOIN owners o ON p.owner_id = o.id
-        WHERE a.id = ? AND o.user_id = ?
-    """, (appt_id, session["user_id"])).fetchone()
+    row = repos.appointments.for_owner_user(appt_id, session["user_id"])
 
     if not row:
         conn.close()
         flash("Appointment not found.", "danger")
         return redirect(url_for("owner_appointments"))
 
-    status = (row["status"] or "").lower()
-    if status != "approved":
+    if not appt_status.is_approved(row["status"]):
         conn.close()
         flash("Only APPROVED appointments can be marked completed (demo).", "warning")
         return redirect(url_for("owner_appointments"))
 
-    cur.execute("UPDATE appointments SET status = 'completed' WHERE id = ?", (appt_id,))
+    repos.appointments.set_status(appt_id, appt_status.COMPLETED)
     conn.commit()
     conn.close()
+    expiry_queue.discard(appt_id)
 
     flash("✅ Marked as completed (demo).", "success")
     return redirect(url_for("owner_appointments"))
@@ -2983,38 +3035,13 @@ def owner_demo_complete(appt_id):
 # Rewiew and Rating (Sriti)
 
 def update_doctor_rating_and_clinic_rating(conn, doctor_id):
-    cur = conn.cursor()
-
-    # ✅ Doctor avg rating (only completed appointments with rating)
-    avg_doctor = cur.execute("""
-        SELECT AVG(rating)
-        FROM appointments
-        WHERE doctor_id = ? AND rating IS NOT NULL
-    """, (doctor_id,)).fetchone()[0]
-
-    avg_doctor = round(avg_doctor, 1) if avg_doctor else 0.0
-
-    cur.execute("""
-        UPDATE doctors SET rating = ?
-        WHERE id = ?
-    """, (avg_doctor, doctor_id))
+    # ✅ Doctor avg rating (only completed appointments with rating);
+    # clinic rating is derived from doctors.rating when it is displayed
+    Repositories(conn).doctors.refresh_rating(doctor_id)
 
-    # ✅ Update clinic rating based on all doctor ratings
-    clinic_id = cur.execute("SELECT clinic_id FROM doctors WHERE id = ?", (doctor_id,)).fetchone()[0]
 
-    avg_clinic = cur.execute("""
-        SELECT AVG(rating)
-        FROM doctors
-        WHERE clinic_id = ?
-    """, (clinic_id,)).fetchone()[0]
-
-    avg_clinic = round(avg_clinic, 1) if avg_clinic else 0.0
-
-    cur.execute("""
-        UPDATE clinics SET location = location
-        WHERE id = ?
-    """, (clinic_id,))
 @app.route("/owner/review/<int:appt_id>", methods=["POST"])
+@idempotency_store.guard()
 def owner_submit_review(appt_id):
     guard = _require_owner()
     if guard:
@@ -3037,17 +3064,9 @@ def owner_submit_review(appt_id):
         return redirect(url_for("owner_appointments"))
 
     conn = get_db()
-    cur = conn.cursor()
 
     # ✅ Ensure appointment belongs to this owner + is completed
-    cur.execute("""
-        SELECT a.*, p.owner_id, o.user_id
-        FROM appointments a
-        JOIN pets p ON a.pet_id = p.id
-        JOIN owners o ON p.owner_id = o.id
-        WHERE a.id = ?
-    """, (appt_id,))
-    appt = cur.fetchone()
+    appt = Repositories(conn).appointments.with_owner_user(appt_id)
 
     if not appt:
         conn.close()
@@ -3059,7 +3078,7 @@ def owner_submit_review(appt_id):
         flash("You cannot review this appointment.", "danger")
         return redirect(url_for("owner_appointments"))
 
-    if (appt["status"] or "").lower() != "completed":
+    if not appt_status.is_completed(appt["status"]):
         conn.close()
         flash("You can only review completed appointments.", "warning")
         return redirect(url_for("owner_appointments"))
@@ -3069,22 +3088,31 @@ def owner_submit_review(appt_id):
         flash("You already reviewed this appointment.", "info")
         return redirect(url_for("owner_appointments"))
 
+    conn.close()
+
     reviewed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    # ✅ Save review to appointment
-    cur.execute("""
-        UPDATE appointments
-        SET rating = ?, doctor_review = ?, clinic_review = ?, reviewed_at = ?
-        WHERE id = ?
-    """, (doctor_rating, doctor_review, clinic_review, reviewed_at, appt_id))
+    def save_review(wconn):
+        # ✅ Save review to appointment (reviewed_at guard makes double posts a no-op)
+        saved = Repositories(wconn).appointments.save_review(
+            appt_id, doctor_rating, doctor_review, clinic_review, reviewed_at
+        )
 
-    conn.commit()
+        # ✅ Update doctor rating avg
+        if saved:
+            update_doctor_rating_and_clinic_rating(wconn, appt["doctor_id"])
+        return saved
 
-    # ✅ Update doctor rating avg
-    update_doctor_rating_and_clinic_rating(conn, appt["doctor_id"])
+    try:
+        saved = db_writer.run(save_review)
+    except DatabaseBusy:
+        idempotency.retry_later()
+        flash("The system is busy right now. Please submit your review again in a moment.", "warning")
+        return redirect(url_for("owner_appointments"))
 
-    conn.commit()
-    conn.close()
+    if not saved:
+        flash("You already reviewed this appointment.", "info")
+        return redirect(url_for("owner_appointments"))
 
     flash("✅ Review submitted successfully!", "success")
     return redirect(url_for("owner_appointments"))
@@ -3097,8 +3125,7 @@ def owner_my_reviews():
     if guard:
         return guard
 
-    conn = _get_conn()
-    cur = conn.cursor()
+    conn = get_read_db()
 
     owner = _get_owner_for_current_user(conn)
     if not owner:
@@ -3106,25 +3133,7 @@ def owner_my_reviews():
         flash("Owner profile not found.", "danger")
         return redirect(url_for("owner_dashboard"))
 
-    reviews = cur.execute("""
-        SELECT
-            a.id,
-            a.appointment_date,
-            a.rating,
-            a.reviewed_at,
-            a.doctor_review,
-            a.clinic_review,
-            p.name AS pet_name,
-            d.name AS doctor_name,
-            c.name AS clinic_name
-        FROM appointments a
-        JOIN pets p ON a.pet_id = p.id
-        JOIN doctors d ON a.doctor_id = d.id
-        JOIN clinics c ON d.clinic_id = c.id
-        WHERE p.owner_id = ?
-          AND a.reviewed_at IS NOT NULL
-        ORDER BY a.reviewed_at DESC
-    """, (owner["id"],)).fetchall()
+    reviews = Repositories(conn).appointments.reviews_for_owner(owner["id"])
 
     conn.close()
 
@@ -3236,7 +3245,14 @@ def create_checkout_session(plan):
 
 
 # Payment success now EXTENDS subscription if already premium
+def _payment_key():
+    # Stripe's checkout session id: reloading the success URL replays it
+    session_id = request.args.get('session_id')
+    return f"payment:{session_id}" if session_id else None
+
+
 @app.route('/payment/success')
+@idempotency_store.guard(_payment_key, ttl=PAYMENT_KEY_TTL_SECONDS)
 def payment_success():
     if "user_id" not in session or session.get("role") != "owner":
         return redirect(url_for("login"))
@@ -3248,7 +3264,6 @@ def payment_success():
     discount_amount = int(request.args.get('discount_amount', 0))
     
     owner = get_or_create_owner_for_current_user()
-    conn = get_db()
     
     #Smart expiry calculation - EXTEND if already premium
     now = datetime.now()
@@ -3293,23 +3308,23 @@ def payment_success():
     
     final_amount = base_amount - discount_amount
 
-    # Record payment
-    conn.execute("""
-        INSERT INTO payments (owner_id, amount, trx_id, payment_method, payment_date, status)
-        VALUES (?, ?, ?, 'Stripe', ?, 'completed')
-    """, (owner['id'], final_amount, session_id, payment_date))
-    
-    # Update owner - deduct redeemed points, add earned points
-    conn.execute("""
-        UPDATE owners 
-        SET is_premium = 1, 
-            subscription_expiry = ?, 
-            reward_points = COALESCE(reward_points, 0) - ? + ?
-        WHERE id = ?
-    """, (expiry_str, points_redeemed, points_earned, owner['id']))
-    
-    conn.commit()
-    conn.close()
+    def record_payment(wconn):
+        wrepos = Repositories(wconn)
+        # Record payment
+        wrepos.payments.record(owner['id'], final_amount, session_id, payment_date)
+
+        # Update owner - deduct redeemed points, add earned points
+        wrepos.owners.activate_premium(owner['id'], expiry_str, points_redeemed, points_earned)
+
+    try:
+        db_writer.run(record_payment)
+    except DatabaseBusy:
+        # Stripe already charged: keep the success URL so a refresh retries
+        idempotency.retry_later()
+        return render_template('payment_success.html', message=(
+            "Your payment went through, but we are busy activating Premium. "
+            "Please refresh this page in a moment."
+        ))
 
     # Success message
     if is_renewal:
@@ -3346,9 +3361,53 @@ def payment_cancel():
 # Initialize Background Scheduler for outbreak alert detection
 scheduler = BackgroundScheduler()
 scheduler.add_job(save_outbreak_alerts_to_db, 'cron', hour=0, minute=0, id='outbreak_alert_job')
+# Past-due appointments are swept here instead of on page views
+scheduler.add_job(
+    auto_update_past_appointments, 'interval', seconds=SWEEP_INTERVAL_SECONDS,
+    id='past_appointments_sweep', max_instances=1, coalesce=True,
+    next_run_time=datetime.now(),
+)
+
+# Background jobs are started explicitly, never at import (scripts, benchmarks
+# and tests import this module too): by __main__ below, and under gunicorn by
+# the post_worker_init hook in gunicorn.conf.py. Every worker drains its own
+# expiry queue (fire re-checks status in SQL). One process per host runs the
+# scheduler: the one holding SCHEDULER_LOCK_PATH, an OS lock that is held
+# until the process exits, so a replacement worker takes over.
+# A second sweep would be harmless anyway (sweep_state high-water mark).
+SCHEDULER_LOCK_PATH = os.path.join(app.instance_path, "scheduler.lock")
+_scheduler_lock = None
+
+def _claim_scheduler_lock():
+    global _scheduler_lock
+    lock_file = None
+    try:
+        os.makedirs(os.path.dirname(SCHEDULER_LOCK_PATH), exist_ok=True)
+        lock_file = open(SCHEDULER_LOCK_PATH, "a+")
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        if lock_file:
+            lock_file.close()
+        return False
+    _scheduler_lock = lock_file  # keep it open (and locked) for the process lifetime
+    return True
+
+
+def start_background_jobs():
+    expiry_queue.start()
+    if scheduler.running or not _claim_scheduler_lock():
+        return
+    scheduler.start()
+    print(f"[Scheduler] Started in process {os.getpid()}")
+
 
 if __name__ == "__main__":
-    scheduler.start()
+    start_background_jobs()
     try:
         app.run(debug=True)
     except KeyboardInterrupt:
@@ -0,0 +1,89 @@
+"""
+Canonical appointment statuses.
+
+appointments.status keeps the readable spelling shown in templates and
+emails; appointments.status_code holds the integer code below and is set by
+triggers (migration 4), so SQL can filter on small integer sets and the
+partial indexes over the active states. Routes classify statuses through
+this module instead of carrying their own spelling lists.
+"""
+
+PENDING = "pending"
+RESCHEDULE_PENDING = "reschedule_pending"
+APPROVED = "approved"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+OWNER_CANCELLED = "owner_cancelled"
+CLINIC_CANCELLED = "clinic_cancelled"
+
+UNKNOWN_CODE = 0
+
+# Stored in the database: never renumber, only append.
+CODES = {
+    PENDING: 1,
+    RESCHEDULE_PENDING: 2,
+    APPROVED: 3,
+    COMPLETED: 4,
+    CANCELLED: 5,
+    OWNER_CANCELLED: 6,
+    CLINIC_CANCELLED: 7,
+}
+
+# Older spellings still found in existing rows
+ALIASES = {
+    "canceled": CANCELLED,
+    "done": COMPLETED,
+    "rescheduled": RESCHEDULE_PENDING,
+}
+
+AWAITING_CLINIC = frozenset({PENDING, RESCHEDULE_PENDING})
+ACTIVE = AWAITING_CLINIC | {APPROVED}
+SLOT_BLOCKING = ACTIVE | {COMPLETED}
+CANCELLED_STATES = frozenset({CANCELLED, OWNER_CANCELLED, CLINIC_CANCELLED})
+
+
+def normalize(status):
+    """'Canceled ' -> 'cancelled'. Unknown spellings are returned lower-cased."""
+    status = (status or "").strip().lower()
+    return ALIASES.get(status, status)
+
+
+def code(status):
+    return CODES.get(normalize(status), UNKNOWN_CODE)
+
+
+def is_awaiting_clinic(status):
+    return normalize(status) in AWAITING_CLINIC
+
+
+def is_active(status):
+    return normalize(status) in ACTIVE
+
+
+def is_approved(status):
+    return normalize(status) == APPROVED
+
+
+def is_completed(status):
+    return normalize(status) == COMPLETED
+
+
+def is_cancelled(status):
+    return normalize(status) in CANCELLED_STATES
+
+
+def sql_in(states, column="status_code"):
+    """
+    "status_code IN (1, 2)" for a group of states. Codes are inlined (not
+    bound) so SQLite can match the partial indexes built from the same text.
+    """
+    codes = sorted(CODES[s] for s in states)
+    return f"{column} IN ({', '.join(str(c) for c in codes)})"
+
+
+def sql_code_case(expr):
+    """SQL CASE mapping a status text expression to its code (triggers/backfill)."""
+    spellings = dict(CODES)
+    spellings.update({alias: CODES[target] for alias, target in ALIASES.items()})
+    whens = " ".join(f"WHEN '{text}' THEN {value}" for text, value in spellings.items())
+    return f"CASE LOWER(TRIM(COALESCE({expr}, ''))) {whens} ELSE {UNKNOWN_CODE} END"
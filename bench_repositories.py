@@ -0,0 +1,104 @@
+"""
+Business-logic load test on the in-memory backend: no Flask, no disk.
+
+Seeds a shared-cache :memory: database (schema.sql + migrations.py) through
+the repositories, then measures booking and clinic-search operations per
+second, one connection per worker thread.
+
+    python bench_repositories.py
+"""
+
+import threading
+import time
+
+import appointment_status as appt_status
+from repositories import Repositories, connect, memory_database
+
+CLINICS = 50
+DOCTORS_PER_CLINIC = 5
+WORKERS = 4
+SECONDS = 3.0
+
+
+def _seed(repos):
+    conn = repos.conn
+    for c in range(CLINICS):
+        user_id = conn.execute(
+            "INSERT INTO users (name, email, password_hash, role, is_verified)"
+            " VALUES (?, ?, '-', 'clinic', 1)",
+            (f"Clinic {c}", f"clinic{c}@bench"),
+        ).lastrowid
+        conn.execute(
+            "INSERT INTO clinics (user_id, name, license_number, email, contact_number, location)"
+            " VALUES (?, ?, 'LIC', ?, '0', ?)",
+            (user_id, f"Clinic {c}", f"clinic{c}@bench", ("Dhaka", "Chattogram", "Sylhet")[c % 3]),
+        )
+        clinic = repos.clinics.by_user(user_id)
+        for d in range(DOCTORS_PER_CLINIC):
+            repos.doctors.add(clinic["id"], f"Dr {c}-{d}", "", 500, "DVM", "Saturday 09:00 - 17:00")
+
+    user_id = conn.execute(
+        "INSERT INTO users (name, email, password_hash, role, is_verified)"
+        " VALUES ('Bench Owner', 'owner@bench', '-', 'owner', 1)"
+    ).lastrowid
+    owner = repos.owners.create_from_user(conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone())
+    pet_id = repos.pets.add(owner["id"], "Mimi", "2", "Cat", "Persian", "F", "Yes")
+    conn.commit()
+    return pet_id
+
+
+def _book(repos, worker, n, pet_id):
+    doctor_id = 1 + (worker * 7919 + n) % (CLINICS * DOCTORS_PER_CLINIC)
+    minute = 27_000_000 + (worker * 1_000_000 + n) * 30
+    if repos.appointments.slot_taken(doctor_id, minute):
+        return
+    day, rest = divmod(minute, 24 * 60)
+    date = time.strftime("%Y-%m-%d", time.gmtime(day * 86400))
+    repos.appointments.create(pet_id, doctor_id, f"{date} {rest // 60:02d}:{rest % 60:02d}", appt_status.PENDING)
+    repos.conn.commit()
+
+
+def _search(repos, worker, n, pet_id):
+    repos.clinics.search_verified(("clinic", "dhaka", "1", "dr 4", "dvm")[n % 5])
+
+
+def _run(uri, op, pet_id):
+    counts = [0] * WORKERS
+    deadline = time.perf_counter() + SECONDS
+    lock = threading.Lock()  # shared-cache writers serialise on the table lock
+
+    def worker(index):
+        repos = Repositories(connect(uri))
+        n = 0
+        while time.perf_counter() < deadline:
+            if op is _book:
+                with lock:
+                    op(repos, index, n, pet_id)
+            else:
+                op(repos, index, n, pet_id)
+            n += 1
+        counts[index] = n
+        repos.conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(WORKERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts)
+
+
+def main():
+    uri, keeper = memory_database("petcare_bench")
+    try:
+        pet_id = _seed(Repositories(connect(uri)))
+        print(f"{'operation':<12}{'workers':>8}{'ops':>10}{'per sec':>10}{'per min':>12}")
+        for name, op in (("booking", _book), ("search", _search)):
+            ops = _run(uri, op, pet_id)
+            print(f"{name:<12}{WORKERS:>8}{ops:>10}{ops / SECONDS:>10.0f}{ops / SECONDS * 60:>12.0f}")
+    finally:
+        keeper.close()
+
+
+if __name__ == "__main__":
+    main()
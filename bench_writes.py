@@ -0,0 +1,161 @@
+"""
+Booking write throughput: WriteCoordinator (group commit) vs. one
+connection per client committing on its own.
+
+Each client books BOOKINGS_PER_CLIENT appointments using the same
+double-book check + INSERT as book_appointment, against a scratch database
+built from schema.sql + migrations.py.
+
+    python bench_writes.py
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import appointment_status as appt_status
+import migrations
+from db import CONNECTION_PRAGMAS, DatabaseBusy, WriteCoordinator
+
+CLIENT_COUNTS = (1, 4, 16)
+BOOKINGS_PER_CLIENT = 200
+DOCTORS = 20
+
+
+def _build_database():
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    conn = sqlite3.connect(path)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")) as f:
+        conn.executescript(f.read())
+    conn.close()
+    migrations.migrate(path)
+
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "INSERT INTO users (name, email, password_hash, role, is_verified)"
+        " VALUES ('Bench Clinic', 'bench@clinic', '-', 'clinic', 1)"
+    )
+    conn.execute(
+        "INSERT INTO clinics (user_id, name, license_number, email, contact_number, location)"
+        " VALUES (1, 'Bench Clinic', 'LIC', 'bench@clinic', '0', 'Dhaka')"
+    )
+    for i in range(DOCTORS):
+        conn.execute(
+            "INSERT INTO doctors (clinic_id, name, email, base_fee, qualifications, weekly_schedule)"
+            " VALUES (1, ?, '', 500, 'DVM', 'Saturday 09:00 - 17:00')",
+            (f"Dr {i}",),
+        )
+    conn.execute(
+        "INSERT INTO users (name, email, password_hash, role, is_verified)"
+        " VALUES ('Bench Owner', 'bench@owner', '-', 'owner', 1)"
+    )
+    conn.execute("INSERT INTO owners (user_id, name, email) VALUES (2, 'Bench Owner', 'bench@owner')")
+    conn.execute(
+        "INSERT INTO pets (owner_id, name, age, animal_type, breed, gender, vaccination_status)"
+        " VALUES (1, 'Mimi', '2', 'Cat', 'Persian', 'F', 'Yes')"
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _booking_job(doctor_id, appointment_dt):
+    def job(conn):
+        taken = conn.execute(f"""
+            SELECT id FROM appointments
+            WHERE doctor_id = ? AND appointment_date = ?
+              AND {appt_status.sql_in(appt_status.SLOT_BLOCKING)}
+        """, (doctor_id, appointment_dt)).fetchone()
+        if taken:
+            return None
+        return conn.execute(
+            "INSERT INTO appointments (pet_id, doctor_id, appointment_date, status)"
+            " VALUES (1, ?, ?, ?)",
+            (doctor_id, appointment_dt, appt_status.PENDING),
+        ).lastrowid
+    return job
+
+
+def _slot(client, n):
+    """Unique (doctor, datetime) per booking so every attempt inserts."""
+    day, minute = divmod(client * BOOKINGS_PER_CLIENT + n, 24 * 2)
+    return (
+        1 + day % DOCTORS,
+        f"2030-{1 + day // 28 % 12:02d}-{1 + day % 28:02d} {minute // 2:02d}:{30 * (minute % 2):02d}",
+    )
+
+
+def _run_clients(clients, book):
+    errors = []
+
+    def client(index):
+        for n in range(BOOKINGS_PER_CLIENT):
+            try:
+                book(index, n)
+            except (DatabaseBusy, sqlite3.OperationalError) as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started, len(errors)
+
+
+def bench_coordinator(path, clients):
+    writer = WriteCoordinator(path)
+
+    def book(index, n):
+        writer.run(_booking_job(*_slot(index, n)))
+
+    elapsed, errors = _run_clients(clients, book)
+    avg_group = writer.jobs / writer.commits if writer.commits else 0
+    return elapsed, errors, avg_group
+
+
+def bench_direct(path, clients):
+    local = threading.local()
+
+    def book(index, n):
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = sqlite3.connect(path, isolation_level=None)
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _booking_job(*_slot(index, n))(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    elapsed, errors = _run_clients(clients, book)
+    return elapsed, errors, 1.0
+
+
+def main():
+    print(f"{'mode':<12}{'clients':>8}{'bookings':>10}{'seconds':>10}{'per sec':>10}{'errors':>8}{'avg group':>11}")
+    for mode, bench in (("coordinator", bench_coordinator), ("direct", bench_direct)):
+        for clients in CLIENT_COUNTS:
+            path = _build_database()
+            try:
+                elapsed, errors, avg_group = bench(path, clients)
+            finally:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+            total = clients * BOOKINGS_PER_CLIENT
+            print(
+                f"{mode:<12}{clients:>8}{total:>10}{elapsed:>10.2f}"
+                f"{(total - errors) / elapsed:>10.0f}{errors:>8}{avg_group:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""
+Booking as one short write transaction plus post-commit hooks.
+
+BookingService.book() runs every check and the INSERT as a single
+WriteCoordinator job, i.e. inside one BEGIN IMMEDIATE transaction: doctor
+and clinic, working hours and slot grid, pet ownership, other owners'
+holds, overlapping visits, then the appointment row and its
+AppointmentContext for notifications. Nothing else happens before the
+owner gets an answer.
+
+Side effects that don't have to be in that transaction (emails, outbreak
+detection, reward points) are registered with on_commit() and run after
+the commit on a small thread pool, for the bookings their `when`
+predicate accepts. A hook failure is logged and never reaches the owner.
+Hooks registered with coalesce=True (expensive recomputations that don't
+depend on which booking triggered them) are queued at most once at a time:
+a burst of bookings triggers one run, plus one more if a booking commits
+while it is running.
+
+A taken slot can be waited for (book_or_wait). Whatever frees a slot calls
+promote_waitlist() inside its own write job, so the cancellation and the
+waiting owner's new appointment commit together; the promoted bookings go
+through the same hooks afterwards.
+"""
+
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import appointment_status as appt_status
+import slot_mask
+from repositories import Repositories
+
+# BookingRejected.reason values
+DOCTOR_NOT_FOUND = "doctor_not_found"
+NOT_AVAILABLE = "not_available"
+OFF_GRID = "off_grid"
+INVALID_PET = "invalid_pet"
+SLOT_HELD = "held"
+SLOT_TAKEN = "taken"
+ALREADY_BOOKED = "already_booked"
+
+Booking = namedtuple(
+    "Booking",
+    "appt_id owner_id is_premium doctor_id start_minute duration_minutes "
+    "appointment_reason symptom_notes context from_waitlist",
+    defaults=(False,),
+)
+
+
+# a conflicting series occurrence gets the nearest free start within this
+# many days either side as its alternative
+ALTERNATIVE_DAYS = 3
+
+_EPOCH = datetime(1970, 1, 1)
+
+SeriesConflict = namedtuple("SeriesConflict", "when reason alternative")
+
+
+class BookingRejected(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class SeriesConflicts(Exception):
+    """Some occurrences of a series can't be booked; nothing was inserted."""
+
+    def __init__(self, conflicts):
+        super().__init__(f"{len(conflicts)} conflicting occurrence(s)")
+        self.conflicts = conflicts  # [SeriesConflict], in series order
+
+
+def from_epoch_minutes(minutes):
+    """appointment_start scale -> naive wall-clock datetime."""
+    return _EPOCH + timedelta(minutes=minutes)
+
+
+def nearest_free(repos, doctor_id, visit, grid, wanted, now_minute, k=1, max_days=ALTERNATIVE_DAYS,
+                 also_taken=()):
+    """
+    The k free starts (epoch minutes) closest to `wanted` for a visit of
+    `visit` minutes on the doctor's `grid`, searching outward day by day up
+    to max_days either side and never before now_minute. Only days the
+    doctor works (from the weekly schedule) are looked at, and the search
+    stops as soon as no remaining day can beat the k-th best distance.
+    Bookings come from doctor_day_booked in one range read; starts in
+    also_taken count as booked too. Holds are not considered.
+    """
+    weekly = repos.doctors.week_masks([doctor_id]).get(doctor_id, {})
+    if not weekly:
+        return []
+    day_minutes = slot_mask.MINUTES_PER_DAY
+    wanted_day = wanted // day_minutes
+    first_day = max(wanted_day - max_days, now_minute // day_minutes)
+    booked = repos.appointments.booked_masks([doctor_id], first_day, wanted_day + max_days + 1 - first_day)
+    extra = {}
+    for start in also_taken:
+        extra.setdefault(start // day_minutes, []).append((start % day_minutes, visit))
+
+    found = []
+    for distance in range(max_days + 1):
+        # every minute of a day `distance` days away is at least this far off
+        if len(found) >= k and (distance - 1) * day_minutes > abs(found[k - 1] - wanted):
+            break
+        for day in sorted({wanted_day - distance, wanted_day + distance}):
+            if day < first_day:
+                continue
+            schedule = weekly.get(from_epoch_minutes(day * day_minutes).weekday(), 0)
+            if not schedule:
+                continue
+            day_start = day * day_minutes
+            mask = slot_mask.free_starts(
+                schedule,
+                booked.get((doctor_id, day - first_day), 0) | slot_mask.from_bookings(extra.get(day, ())),
+                slot_mask.past_mask(now_minute - day_start),
+                visit, grid,
+            )
+            found.extend(day_start + m for m in slot_mask.minutes(mask))
+        found.sort(key=lambda start: (abs(start - wanted), start))
+        del found[k:]
+    return found
+
+
+def series_datetimes(first, every_days, count):
+    """first, first + every_days, ... (count datetimes)."""
+    return [first + timedelta(days=every_days * i) for i in range(count)]
+
+
+def on_slot_grid(doctor, dt):
+    return (dt.hour * 60 + dt.minute) % doctor["slot_minutes"] == 0
+
+
+def fits_doctor_day(repos, doctor, dt):
+    """Is dt on the doctor's slot grid, with the whole visit inside working hours?"""
+    if not on_slot_grid(doctor, dt):
+        return False
+    return repos.doctors.works_at(doctor["id"], dt.weekday(), dt.hour * 60 + dt.minute, doctor["visit_minutes"])
+
+
+def check_doctor_day(repos, doctor, dt):
+    """Raise BookingRejected (OFF_GRID / NOT_AVAILABLE) unless fits_doctor_day()."""
+    if not on_slot_grid(doctor, dt):
+        raise BookingRejected(OFF_GRID)
+    if not fits_doctor_day(repos, doctor, dt):
+        raise BookingRejected(NOT_AVAILABLE)
+
+
+class BookingService:
+    def __init__(self, writer, epoch_minutes, wall_clock, max_workers=2):
+        self.writer = writer                  # WriteCoordinator
+        self.epoch_minutes = epoch_minutes    # datetime -> appointment_start scale
+        self.wall_clock = wall_clock          # () -> seconds, slot_holds.expires_at scale
+        self.max_workers = max_workers
+        self._hooks = []
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def on_commit(self, fn=None, coalesce=False, when=None):
+        """
+        Register fn(booking) to run after committed bookings (those for
+        which when(booking) is true, if given). Usable as a decorator.
+        """
+        if fn is None:
+            return lambda f: self.on_commit(f, coalesce, when)
+        self._hooks.append((fn, coalesce, when))
+        return fn
+
+    def book(self, owner, clinic_id, doctor_id, pet_id, dt,
+             appointment_reason="", symptom_notes=""):
+        """
+        Create a pending appointment for dt (a naive wall-clock datetime).
+        Returns a Booking; raises BookingRejected, or DatabaseBusy from the
+        writer.
+        """
+        booking, _position = self._book(
+            owner, clinic_id, doctor_id, pet_id, dt, appointment_reason, symptom_notes, wait=False
+        )
+        return booking
+
+    def book_or_wait(self, owner, clinic_id, doctor_id, pet_id, dt,
+                     appointment_reason="", symptom_notes=""):
+        """
+        Like book(), but a taken or held slot puts the owner on its waitlist
+        instead. Returns (Booking, None) or (None, position in line).
+        """
+        return self._book(
+            owner, clinic_id, doctor_id, pet_id, dt, appointment_reason, symptom_notes, wait=True
+        )
+
+    def _book(self, owner, clinic_id, doctor_id, pet_id, dt, appointment_reason, symptom_notes, wait):
+        def insert_booking(conn):
+            repos = Repositories(conn)
+            doctor = repos.doctors.by_id(doctor_id)
+            if not doctor or doctor["clinic_id"] != clinic_id:
+                raise BookingRejected(DOCTOR_NOT_FOUND)
+            check_doctor_day(repos, doctor, dt)
+            if not repos.pets.belongs_to(pet_id, owner["id"]):
+                raise BookingRejected(INVALID_PET)
+            try:
+                return self._create(
+                    repos, doctor, owner["id"], owner["is_premium"] == 1, pet_id, dt,
+                    appointment_reason, symptom_notes,
+                ), None
+            except BookingRejected as e:
+                if not wait or e.reason not in (SLOT_HELD, SLOT_TAKEN):
+                    raise
+            start_minute = self.epoch_minutes(dt)
+            # the slot may be taken by the owner's own visit
+            if repos.appointments.owner_overlapping(
+                doctor_id, start_minute, doctor["visit_minutes"], owner["id"], pet_id
+            ):
+                raise BookingRejected(ALREADY_BOOKED)
+            return None, repos.waitlist.join(
+                doctor_id, start_minute, dt.strftime("%Y-%m-%d %H:%M"),
+                owner["id"], pet_id, appointment_reason, symptom_notes,
+            )
+
+        booking, position = self.writer.run(insert_booking)
+        if booking:
+            self._after_commit(booking)
+        return booking, position
+
+    def _create(self, repos, doctor, owner_id, is_premium, pet_id, dt,
+                appointment_reason, symptom_notes, from_waitlist=False):
+        """Overlap/hold checks, INSERT, release the owner's hold. Inside a writer job."""
+        doctor_id, visit = doctor["id"], doctor["visit_minutes"]
+        start_minute = self.epoch_minutes(dt)
+        # Someone else is filling in the form for this slot
+        if repos.holds.held_by_other(doctor_id, start_minute, owner_id, int(self.wall_clock()), visit):
+            raise BookingRejected(SLOT_HELD)
+        if repos.appointments.slot_taken(doctor_id, start_minute, visit):
+            raise BookingRejected(SLOT_TAKEN)
+
+        # idx_appointments_active_slot settles races with other processes
+        try:
+            appt_id = repos.appointments.create(
+                pet_id, doctor_id, dt.strftime("%Y-%m-%d %H:%M"), appt_status.PENDING,
+                appointment_reason, symptom_notes, duration_minutes=visit,
+            )
+        except sqlite3.IntegrityError:
+            raise BookingRejected(SLOT_TAKEN) from None
+        repos.holds.release(doctor_id, start_minute, owner_id)
+
+        return Booking(
+            appt_id, owner_id, is_premium, doctor_id, start_minute, visit,
+            appointment_reason, symptom_notes, repos.appointments.context(appt_id), from_waitlist,
+        )
+
+    # ---- series ----
+
+    def book_series(self, owner, clinic_id, doctor_id, pet_id, dts,
+                    appointment_reason="", symptom_notes=""):
+        """
+        Book every datetime in dts (at least a day apart, e.g. a vaccination
+        course) or none.
+        All occurrences are checked against the doctor's hours, bookings and
+        holds in one query, then inserted in the same write job. Returns
+        [Booking]; raises BookingRejected for a bad doctor/pet, or
+        SeriesConflicts listing each conflicting occurrence with the
+        nearest free alternative (a datetime, or None).
+        """
+        def insert_series(conn):
+            repos = Repositories(conn)
+            doctor = repos.doctors.by_id(doctor_id)
+            if not doctor or doctor["clinic_id"] != clinic_id:
+                raise BookingRejected(DOCTOR_NOT_FOUND)
+            if not repos.pets.belongs_to(pet_id, owner["id"]):
+                raise BookingRejected(INVALID_PET)
+
+            visit, grid = doctor["visit_minutes"], doctor["slot_minutes"]
+            starts = [self.epoch_minutes(dt) for dt in dts]
+            problems = repos.appointments.series_conflicts(
+                doctor_id,
+                [(i, start, dt.weekday(), start % slot_mask.MINUTES_PER_DAY)
+                 for i, (dt, start) in enumerate(zip(dts, starts))],
+                visit, owner["id"], int(self.wall_clock()),
+            )
+            conflicts = {}
+            for i, dt in enumerate(dts):
+                off_hours, taken, held = problems.get(i, (False, False, False))
+                off_grid = (starts[i] % slot_mask.MINUTES_PER_DAY) % grid != 0
+                if off_grid:
+                    conflicts[i] = OFF_GRID
+                elif off_hours:
+                    conflicts[i] = NOT_AVAILABLE
+                elif taken or held:
+                    conflicts[i] = SLOT_TAKEN if taken else SLOT_HELD
+            if conflicts:
+                # an alternative offered for an earlier occurrence is not offered again
+                also_taken = [start for i, start in enumerate(starts) if i not in conflicts]
+                found = []
+                for i, reason in sorted(conflicts.items()):
+                    alternative = self._nearest_free(repos, doctor, dts[i], also_taken)
+                    if alternative:
+                        also_taken.append(self.epoch_minutes(alternative))
+                    found.append(SeriesConflict(dts[i], reason, alternative))
+                raise SeriesConflicts(found)
+
+            # one savepoint per writer job: a failure below undoes every insert
+            appt_ids = []
+            for dt in dts:
+                try:
+                    appt_ids.append(repos.appointments.create(
+                        pet_id, doctor_id, dt.strftime("%Y-%m-%d %H:%M"), appt_status.PENDING,
+                        appointment_reason, symptom_notes, duration_minutes=visit,
+                    ))
+                except sqlite3.IntegrityError:
+                    raise SeriesConflicts([SeriesConflict(dt, SLOT_TAKEN, None)]) from None
+            repos.holds.release(doctor_id, starts[0], owner["id"])
+
+            contexts = repos.appointments.contexts(appt_ids)
+            return [
+                Booking(
+                    appt_id, owner["id"], owner["is_premium"] == 1, doctor_id, start, visit,
+                    appointment_reason, symptom_notes, contexts.get(appt_id),
+                )
+                for appt_id, start in zip(appt_ids, starts)
+            ]
+
+        bookings = self.writer.run(insert_series)
+        self.committed(bookings)
+        return bookings
+
+    def _nearest_free(self, repos, doctor, dt, also_taken):
+        """The free start closest to dt within ALTERNATIVE_DAYS either side, or None."""
+        found = nearest_free(
+            repos, doctor["id"], doctor["visit_minutes"], doctor["slot_minutes"],
+            self.epoch_minutes(dt), int(self.wall_clock()) // 60,
+            k=1, max_days=ALTERNATIVE_DAYS, also_taken=also_taken,
+        )
+        return from_epoch_minutes(found[0]) if found else None
+
+    # ---- waitlist ----
+
+    def promote_waitlist(self, repos, doctor_id, start_minute, duration):
+        """
+        Call inside the write job that just stopped [start_minute,
+        start_minute + duration) from blocking the doctor (cancel, decline,
+        move), so the freed slot never shows up as bookable to anyone else.
+        Waiting owners whose visit now fits are booked oldest entry first;
+        the rest keep their place. Returns the new Bookings: pass them to
+        committed() once the job has returned.
+        """
+        doctor = repos.doctors.by_id(doctor_id)
+        if not doctor:
+            return []
+        now_minute = int(self.wall_clock()) // 60
+        promoted = []
+        for entry in repos.waitlist.waiting_within(doctor_id, start_minute, start_minute + duration, now_minute):
+            dt = datetime.strptime(entry.appointment_date, "%Y-%m-%d %H:%M")
+            # hours changed, the pet is gone or the owner already has a visit
+            # with the doctor then: the entry will never be served
+            if (
+                not fits_doctor_day(repos, doctor, dt)
+                or not repos.pets.belongs_to(entry.pet_id, entry.owner_id)
+                or repos.appointments.owner_overlapping(
+                    doctor_id, entry.appointment_start, doctor["visit_minutes"], entry.owner_id, entry.pet_id
+                )
+            ):
+                repos.waitlist.remove(entry.id)
+                continue
+            try:
+                booking = self._create(
+                    repos, doctor, entry.owner_id, entry.is_premium == 1, entry.pet_id, dt,
+                    entry.appointment_reason or "", entry.symptom_notes or "", from_waitlist=True,
+                )
+            except BookingRejected:
+                continue
+            repos.waitlist.remove(entry.id)
+            promoted.append(booking)
+        return promoted
+
+    def committed(self, bookings):
+        """Run the post-commit hooks for bookings made by promote_waitlist()."""
+        for booking in bookings:
+            self._after_commit(booking)
+
+    # ---- post-commit hooks ----
+
+    def _pool(self):
+        # a fresh pool after a fork: the parent's worker threads are not ours
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="booking-hooks"
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _after_commit(self, booking):
+        pool = self._pool()
+        for fn, coalesce, when in self._hooks:
+            if when is not None and not when(booking):
+                continue
+            if coalesce:
+                with self._lock:
+                    if fn in self._pending:
+                        continue
+                    self._pending.add(fn)
+            pool.submit(self._call, fn, coalesce, booking)
+
+    def _call(self, fn, coalesce, booking):
+        if coalesce:
+            with self._lock:
+                self._pending.discard(fn)
+        try:
+            fn(booking)
+        except Exception as e:
+            print(f"[Booking] post-commit hook {getattr(fn, '__name__', fn)} failed for appointment {booking.appt_id}: {e}")
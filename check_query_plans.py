@@ -0,0 +1,177 @@
+"""
+EXPLAIN QUERY PLAN regression check for the hot dashboard/booking queries.
+
+Builds a throwaway database from schema.sql + migrations.py, runs the real
+repository calls below with a trace callback on the connection, and EXPLAINs
+every statement they issue (bound values inlined, as SQLite traced them),
+plus every statement in the schema's triggers. Fails (exit code 1) if any
+of them needs a full table scan, or if a call no longer issues any SQL.
+
+    python check_query_plans.py
+"""
+
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+import appointment_status as appt_status
+import migrations
+from repositories import Repositories
+
+NOW_SECONDS = 1_790_000_000
+NOW_MINUTE = NOW_SECONDS // 60
+DAY = NOW_MINUTE // 1440
+
+# name -> call on Repositories; each statement the call issues is checked
+HOT_CALLS = {
+    "clinic_dashboard requests": lambda r: r.appointments.clinic_requests(1),
+    "clinic_dashboard history": lambda r: r.appointments.clinic_history(1),
+    "clinic_dashboard reviews": lambda r: r.appointments.clinic_reviews(1),
+    "clinic_doctor_appointments": lambda r: r.appointments.for_doctor(1, "rex"),
+    "clinic_appointments": lambda r: r.appointments.for_clinic(1),
+    "reschedule lookup": lambda r: r.appointments.for_reschedule(1, 1),
+    "owner_demo_complete lookup": lambda r: r.appointments.for_owner_user(1, 1),
+    "owner_appointments": lambda r: r.appointments.for_owner(1),
+    "owner_my_reviews": lambda r: r.appointments.reviews_for_owner(1),
+    "appointment context (batched)": lambda r: r.appointments.contexts([1, 2]),
+    "clinic_reports": lambda r: r.appointments.clinic_totals(1),
+    "doctor booked mask": lambda r: r.appointments.booked_mask(1, DAY),
+    "outbreak window": lambda r: r.appointments.recent_reports(NOW_MINUTE - 14 * 1440),
+    "past-due approved sweep": lambda r: r.appointments.complete_approved_between(NOW_MINUTE - 15, NOW_MINUTE),
+    "past-due pending sweep": lambda r: r.appointments.awaiting_ids_between(NOW_MINUTE - 15, NOW_MINUTE),
+    "expiry rebuild": lambda r: r.appointments.active_starts(),
+    "expiry transition": lambda r: r.appointments.transition_due(
+        [1, 2], NOW_MINUTE, appt_status.AWAITING_CLINIC, appt_status.CANCELLED
+    ),
+    "status change": lambda r: r.appointments.change_status(
+        1, appt_status.AWAITING_CLINIC, appt_status.APPROVED
+    ),
+    "doctor day ranges": lambda r: r.doctors.day_ranges(1, 2),
+    "doctor works at": lambda r: r.doctors.works_at(1, 2, 600, 30),
+    "clinic schedules": lambda r: r.doctors.clinic_schedules(1),
+    "clinic booked masks": lambda r: r.appointments.clinic_booked_masks(1, DAY, 7),
+    "doctors booked masks": lambda r: r.appointments.booked_masks([1, 2], DAY, 7),
+    "bookable doctors in location": lambda r: r.doctors.bookable("Dhaka", 800),
+    "doctors week masks": lambda r: r.doctors.week_masks([1, 2]),
+    "doctor timings": lambda r: r.doctors.timings([1, 2]),
+    "overlapping booking": lambda r: r.appointments.slot_taken(1, NOW_MINUTE, 30, exclude_id=3),
+    "owner's own overlapping visit": lambda r: r.appointments.owner_overlapping(1, NOW_MINUTE, 30, 1, 1),
+    "slot hold": lambda r: r.holds.place(1, NOW_MINUTE, 1, NOW_SECONDS, 300, 30),
+    "expired holds": lambda r: r.holds.purge_expired(NOW_SECONDS),
+    "held slot masks": lambda r: r.holds.held_masks([1, 2], DAY, 7, NOW_SECONDS, owner_id=1),
+    "series occurrence conflicts": lambda r: r.appointments.series_conflicts(
+        1, [(0, NOW_MINUTE, 2, 600), (1, NOW_MINUTE + 7 * 1440, 2, 600)], 30, 1, NOW_SECONDS
+    ),
+    "waitlist next in line": lambda r: r.waitlist.waiting_within(1, NOW_MINUTE, NOW_MINUTE + 30, NOW_MINUTE),
+    "owner's waitlist": lambda r: r.waitlist.for_owner(1, NOW_MINUTE),
+    "started waitlist entries": lambda r: r.waitlist.purge_started(NOW_MINUTE),
+    "idempotency key lookup": lambda r: r.idempotency.get(1, "key", NOW_SECONDS),
+    "expired idempotency keys": lambda r: r.idempotency.purge_expired(NOW_SECONDS),
+    "owner_search (all)": lambda r: r.clinics.search_verified(location="Dhaka"),
+    "owner_search (text)": lambda r: r.clinics.search_verified("happy dh", "Dhaka"),
+    "owner_search (rating)": lambda r: r.clinics.search_verified(location="Dhaka", min_rating=4.0),
+    "owner_search (text, rating)": lambda r: r.clinics.search_verified("happy dh", "Dhaka", min_rating=4.0),
+    "admin clinic lists": lambda r: r.users.with_role("clinic", 0),
+    "admin outbreak alerts": lambda r: r.outbreak_alerts.active(),
+    "area outbreak alerts": lambda r: r.outbreak_alerts.active("Dhaka"),
+    "user by id": lambda r: r.users.by_id(1),
+    "owner by user": lambda r: r.owners.by_user(1),
+    "clinic by user": lambda r: r.clinics.by_user(1),
+}
+
+# what a trace line looks like when it is a statement worth planning
+_STATEMENT_RE = re.compile(r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+_TRIGGER_ROW_RE = re.compile(r"\b(?:NEW|OLD)\.\w+")
+
+
+def full_scans(conn, sql, params=()):
+    """Return the plan lines that scan a table without an index (json_each etc. are fine)."""
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [
+        row[3] for row in plan
+        if row[3].startswith("SCAN ") and "USING" not in row[3] and "VIRTUAL TABLE" not in row[3]
+        and _is_table(conn, row[3].split()[1])
+    ]
+
+
+def _is_table(conn, name):
+    # CTEs and subqueries show up as "SCAN <name>" too; only real tables count
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def traced_statements(conn, call):
+    """Run call(Repositories(conn)) and return the distinct statements it issued."""
+    issued = []
+    conn.set_trace_callback(issued.append)
+    try:
+        call(Repositories(conn))
+    finally:
+        conn.set_trace_callback(None)
+    return list(dict.fromkeys(sql for sql in issued if _STATEMENT_RE.match(sql)))
+
+
+def trigger_statements(conn):
+    """(trigger name, statement, params) for every statement in a trigger body; NEW/OLD columns become ?."""
+    for name, sql in conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name"
+    ):
+        body = sql[sql.upper().index("BEGIN") + len("BEGIN"):sql.upper().rindex("END")]
+        for statement in body.split(";"):
+            if statement.strip():
+                statement, count = _TRIGGER_ROW_RE.subn("?", statement)
+                yield name, statement, (None,) * count
+
+
+def check(conn):
+    failures = 0
+    for name, call in HOT_CALLS.items():
+        statements = traced_statements(conn, call)
+        scans = [scan for sql in statements for scan in full_scans(conn, sql)]
+        if not statements:
+            failures += 1
+            print(f"❌ {name}: issued no SQL")
+        elif scans:
+            failures += 1
+            print(f"❌ {name}: {'; '.join(scans)}")
+        else:
+            print(f"✅ {name}")
+
+    for name, sql, params in trigger_statements(conn):
+        scans = full_scans(conn, sql, params)
+        if scans:
+            failures += 1
+            print(f"❌ trigger {name}: {'; '.join(scans)}")
+        else:
+            print(f"✅ trigger {name}")
+    return failures
+
+
+def main():
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(path)
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")) as f:
+            conn.executescript(f.read())
+        conn.close()
+        migrations.migrate(path)
+
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        try:
+            failures = check(conn)
+        finally:
+            conn.rollback()  # the write calls ran against empty tables; keep nothing
+            conn.close()
+    finally:
+        os.remove(path)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
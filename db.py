@@ -0,0 +1,309 @@
+"""
+SQLite connection handling for app.py.
+
+One pooled connection is handed out per request (stored on flask.g) and
+returned to the pool at app-context teardown, so every helper that calls
+get_db() during a request shares the same handle. Pragmas are applied once,
+when the connection is first opened.
+
+Pure GET routes use a second, read-only pool (mode=ro + query_only) so
+WAL readers never queue behind writers. Hot write paths go through
+WriteCoordinator: one writer connection per process that commits queued jobs
+in small groups.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from urllib.request import pathname2url
+
+from flask import g, has_app_context
+
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous = NORMAL",
+)
+
+
+class DatabaseBusy(Exception):
+    """The write queue is full, or SQLite stayed locked past the timeout."""
+
+
+# journal_mode can't be changed from a read-only handle; it is persistent in
+# the file anyway once a read-write connection has set it.
+READ_ONLY_PRAGMAS = (
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA query_only = ON",
+)
+
+
+def _is_uri(database):
+    # file: URIs (e.g. the shared-cache :memory: database from repositories.py)
+    # are passed through as-is; read-only pools rely on query_only for them.
+    return database.startswith("file:")
+
+
+def _configure(conn, pragmas=CONNECTION_PRAGMAS):
+    conn.row_factory = sqlite3.Row
+    for pragma in pragmas:
+        conn.execute(pragma)
+    return conn
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3.Connection whose close() hands the handle back to its pool.
+
+    Routes still call conn.close() when they are done; for the shared request
+    connection that is a no-op (teardown releases it), anywhere else it
+    returns the connection to the pool.
+    """
+
+    _pool = None
+    _request_bound = False
+
+    def close(self):
+        if self._request_bound:
+            return
+        if self._pool is not None:
+            self._pool.release(self)
+        else:
+            super().close()
+
+    def really_close(self):
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Small LIFO pool of configured connections to one database file.
+    With read_only=True every connection is opened with mode=ro and
+    query_only, so any write raises sqlite3.OperationalError.
+    `factory`/`on_open` let sql_trace swap in instrumented connections.
+    """
+
+    factory = PooledConnection
+    on_open = None
+
+    def __init__(self, database, size=4, g_key="_db_conn", read_only=False):
+        self.database = database
+        self.size = size
+        self.g_key = g_key
+        self.read_only = read_only
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _open(self):
+        target = self.database
+        pragmas = READ_ONLY_PRAGMAS if self.read_only else CONNECTION_PRAGMAS
+        if self.read_only and not _is_uri(target):
+            target = f"file:{pathname2url(os.path.abspath(target))}?mode=ro"
+        conn = sqlite3.connect(
+            target,
+            factory=self.factory,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            uri=_is_uri(target),
+        )
+        _configure(conn, pragmas)
+        conn._pool = self
+        if self.on_open is not None:
+            self.on_open(conn)
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def release(self, conn):
+        conn._request_bound = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.really_close()
+
+    def connection(self):
+        """
+        Inside an app context: the connection shared by the whole request.
+        Outside one (import time, scheduler jobs): a pooled connection the
+        caller gives back with close().
+        """
+        if not has_app_context():
+            return self.acquire()
+
+        conn = g.get(self.g_key)
+        if conn is None:
+            conn = self.acquire()
+            conn._request_bound = True
+            setattr(g, self.g_key, conn)
+        return conn
+
+    def teardown(self, exc=None):
+        conn = g.pop(self.g_key, None)
+        if conn is not None:
+            self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().really_close()
+            except queue.Empty:
+                return
+
+
+class WriteCoordinator:
+    """
+    Single writer per process with group commit.
+
+    run(fn) queues fn(conn) for the writer thread, which drains up to
+    max_batch queued jobs into one BEGIN IMMEDIATE transaction, giving each
+    job its own savepoint so a failing job only rolls back itself. Callers
+    get fn's return value once the group has committed. Jobs must not call
+    commit()/rollback() themselves.
+
+    DatabaseBusy is raised when the queue is full, when the job was not
+    picked up within `timeout` seconds, when another process held the
+    SQLite write lock past busy_timeout, or when a job that had started did
+    not finish within busy_timeout + `timeout` (its group may still commit
+    afterwards).
+    """
+
+    def __init__(self, database, max_batch=32, queue_size=256, timeout=5.0):
+        self.database = database
+        self.max_batch = max_batch
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.jobs = 0
+        self.commits = 0
+        self.tracer = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            # fresh queue after a fork: the parent's writer thread is not ours
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+            self._thread.start()
+
+    def run(self, fn, timeout=None):
+        """Run fn(conn) inside the writer's transaction and return its result."""
+        timeout = self.timeout if timeout is None else timeout
+        self._ensure_started()
+
+        if self.tracer is None:
+            return self._submit(fn, timeout)
+        started = time.perf_counter()
+        try:
+            return self._submit(fn, timeout)
+        finally:
+            label = f"-- writer job {getattr(fn, '__name__', 'job')}"
+            self.tracer.timed(label, None, time.perf_counter() - started, None)
+
+    def _submit(self, fn, timeout):
+        fut = Future()
+        try:
+            self._queue.put((fn, fut), timeout=timeout)
+        except queue.Full:
+            raise DatabaseBusy("write queue is full") from None
+
+        try:
+            return fut.result(timeout)
+        except FutureTimeout:
+            if fut.cancel():
+                raise DatabaseBusy("timed out waiting for the database writer") from None
+        # already running: give it one more busy_timeout to finish before
+        # reporting busy, so a writer stuck on another process's lock can't
+        # hold the request thread indefinitely
+        try:
+            return fut.result(BUSY_TIMEOUT_MS / 1000 + timeout)
+        except FutureTimeout:
+            raise DatabaseBusy("timed out waiting for the database writer to finish") from None
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            uri=_is_uri(self.database),
+        )
+        return _configure(conn)
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            batch = [(fn, fut) for fn, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._commit_group(conn, batch)
+            except Exception as e:
+                for _fn, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+
+    def _commit_group(self, conn, batch):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            for _fn, fut in batch:
+                fut.set_exception(DatabaseBusy(str(e)))
+            return
+
+        outcomes = []
+        for fn, fut in batch:
+            conn.execute("SAVEPOINT write_job")
+            try:
+                result = fn(conn)
+            except Exception as e:
+                conn.execute("ROLLBACK TO write_job")
+                conn.execute("RELEASE write_job")
+                outcomes.append((fut, e, False))
+            else:
+                conn.execute("RELEASE write_job")
+                outcomes.append((fut, result, True))
+
+        try:
+            conn.execute("COMMIT")
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for fut, _value, _ok in outcomes:
+                fut.set_exception(DatabaseBusy(str(e)))
+            return
+
+        self.jobs += len(outcomes)
+        self.commits += 1
+        for fut, value, ok in outcomes:
+            if ok:
+                fut.set_result(value)
+            else:
+                fut.set_exception(value)
@@ -0,0 +1,85 @@
+"""
+Doctors' weekly working hours as rows of the doctor_schedule table.
+
+doctors.weekly_schedule is still stored (and shown) as text, in either of the
+formats found in the data: "Saturday 10:00 - 18:00; Sunday ..." (written by
+build_weekly_schedule_from_form) or "Sun 10:00 - 18:00" (init_db.py). This
+module parses that text once, when it is written, into
+(doctor_id, weekday, start_minute, end_minute) rows: weekday follows
+datetime.weekday() (0 = Monday), minutes count from midnight, and
+overlapping or touching ranges on the same day are merged, so split shifts
+are simply several rows. Availability checks query the table instead of
+re-parsing text.
+"""
+
+import re
+
+# index = datetime.weekday()
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+_DAY_RE = re.compile(r"\b(mon|tue|wed|thu|fri|sat|sun)\w*\b")
+_TIME_RE = re.compile(r"(\d{2}):(\d{2})")
+
+
+def _minutes(hh, mm):
+    hours, minutes = int(hh), int(mm)
+    if hours > 23 or minutes > 59:
+        return None
+    return hours * 60 + minutes
+
+
+def _merge(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def parse_weekly_schedule(text):
+    """
+    {weekday: [(start_minute, end_minute), ...]} for every weekday that has
+    at least one "HH:MM ... HH:MM" range after its name.
+    """
+    text = (text or "").lower()
+    marks = [(m.start(), m.group(1)) for m in _DAY_RE.finditer(text)]
+
+    ranges = {}
+    for i, (pos, day) in enumerate(marks):
+        end_pos = marks[i + 1][0] if i + 1 < len(marks) else len(text)
+        times = _TIME_RE.findall(text, pos, end_pos)
+        for j in range(0, len(times) - 1, 2):
+            start, end = _minutes(*times[j]), _minutes(*times[j + 1])
+            if start is None or end is None or start >= end:
+                continue
+            ranges.setdefault(WEEKDAYS.index(day), []).append((start, end))
+    return {weekday: _merge(day_ranges) for weekday, day_ranges in ranges.items()}
+
+
+def format_minute(minute):
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def replace_schedule(conn, doctor_id, text):
+    """Rewrite doctor_schedule rows for one doctor from its weekly_schedule text."""
+    conn.execute("DELETE FROM doctor_schedule WHERE doctor_id = ?", (doctor_id,))
+    conn.executemany(
+        """
+        INSERT INTO doctor_schedule (doctor_id, weekday, start_minute, end_minute)
+        VALUES (?, ?, ?, ?)
+        """,
+        [
+            (doctor_id, weekday, start, end)
+            for weekday, day_ranges in parse_weekly_schedule(text).items()
+            for start, end in day_ranges
+        ],
+    )
+
+
+def rebuild_all(conn):
+    """Re-derive doctor_schedule for every doctor (migration / seeding)."""
+    doctors = conn.execute("SELECT id, weekly_schedule FROM doctors").fetchall()
+    for doctor_id, text in doctors:
+        replace_schedule(conn, doctor_id, text)
@@ -0,0 +1,109 @@
+"""
+In-process expiry queue for appointment auto-complete / auto-cancel.
+
+A min-heap of (due, appt_id) with lazy deletion: schedule() pushes a new
+entry and remembers the current due time per id, discard() just forgets the
+id, and stale heap entries are skipped when they surface. One daemon thread
+sleeps until the earliest due time (or until schedule() wakes it for an
+earlier one) and hands the due ids to `fire`, so each wake-up costs
+O(k log n) for the k items that are actually due.
+
+The heap is only a cache: start() rebuilds it from `load()` (an index range
+query over the active appointments), and `fire` must re-check status in SQL
+so that several processes holding the same ids never transition a row twice.
+Until start() has run, schedule() is a no-op rather than filling a heap
+that nothing drains; the rebuild picks those appointments up.
+"""
+
+import heapq
+import threading
+import time
+
+
+class ExpiryQueue:
+    def __init__(self, load, fire, clock=time.time, max_wait=60.0, retry_delay=5.0,
+                 name="appointment-expiry"):
+        self.load = load          # () -> iterable of (appt_id, due_seconds)
+        self.fire = fire          # (list of appt_ids) -> None, called off-request
+        self.clock = clock        # seconds on the same scale as the due times
+        self.max_wait = max_wait
+        self.retry_delay = retry_delay
+        self.name = name
+        self._heap = []
+        self._due = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._due)
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def schedule(self, appt_id, due):
+        if not self.running():
+            return  # nothing would drain it; start() loads it from the DB instead
+        with self._cond:
+            if self._due.get(appt_id) == due:
+                return
+            self._due[appt_id] = due
+            heapq.heappush(self._heap, (due, appt_id))
+            if self._heap[0] == (due, appt_id):
+                self._cond.notify()
+
+    def discard(self, appt_id):
+        with self._cond:
+            self._due.pop(appt_id, None)
+
+    def rebuild(self):
+        entries = list(self.load())
+        with self._cond:
+            # keep anything schedule() added while load() was running
+            self._due = {**dict(entries), **self._due}
+            self._heap = [(due, appt_id) for appt_id, due in self._due.items()]
+            heapq.heapify(self._heap)
+            self._cond.notify()
+
+    def pop_due(self, now):
+        """Remove and return the ids due at or before `now`."""
+        due_ids = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due, appt_id = heapq.heappop(self._heap)
+                if self._due.get(appt_id) == due:
+                    del self._due[appt_id]
+                    due_ids.append(appt_id)
+        return due_ids
+
+    def start(self):
+        if self.running():
+            return
+        # the thread first, so schedule() calls racing the load are kept
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self.rebuild()
+
+    def _wait(self):
+        with self._cond:
+            # drop stale heads so we don't wake up for discarded ids
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            timeout = self.max_wait
+            if self._heap:
+                timeout = min(timeout, max(0.0, self._heap[0][0] - self.clock()))
+            if timeout > 0:
+                self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            self._wait()
+            due_ids = self.pop_due(self.clock())
+            if not due_ids:
+                continue
+            try:
+                self.fire(due_ids)
+            except Exception as e:
+                print(f"[Expiry] {len(due_ids)} due appointment(s) failed, retrying: {e}")
+                retry_at = self.clock() + self.retry_delay
+                for appt_id in due_ids:
+                    self.schedule(appt_id, retry_at)
@@ -0,0 +1,13 @@
+"""
+gunicorn settings (loaded from the working directory, see Procfile).
+
+app.py starts no threads at import; each worker starts its background jobs
+(expiry queue, and the scheduler in the worker holding the lock) once it
+has loaded the app.
+"""
+
+
+def post_worker_init(worker):
+    from app import start_background_jobs
+
+    start_background_jobs()
@@ -0,0 +1,174 @@
+"""
+Idempotency keys for POSTs that must not run twice (double-clicks, mobile
+retries, reloading a success URL).
+
+IdempotencyStore.guard(key_fn) wraps a view. Before the view runs, the key
+(from key_fn) is looked up in idempotency_keys by primary key on a read
+connection; a finished request with the same key is answered from the
+stored outcome (status, redirect target or body, and the flash messages it
+produced) without touching any other table. Otherwise the key is claimed
+in one small writer job, the view runs, and its outcome is stored.
+
+- A request whose first copy is still running waits up to
+  IN_FLIGHT_WAIT_SECONDS for it to finish and then replays it.
+- A key sent again with a different request (path or form data) is
+  refused rather than replayed.
+- Views call retry_later() when they could not do the work (e.g.
+  DatabaseBusy), and the claim is released instead of caching that answer;
+  5xx responses and exceptions release it too.
+- Rows expire after their TTL and are deleted by purge_expired() (run from
+  the periodic sweep).
+
+Forms carry a fresh key per render (new_key(), exposed to templates);
+API clients can send an Idempotency-Key header instead.
+"""
+
+import hashlib
+import json
+import time
+import uuid
+from functools import wraps
+
+from flask import flash, g, make_response, redirect, request, session
+
+from db import DatabaseBusy
+from repositories import Repositories
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+# a 'pending' row older than this belongs to a request that died midway
+STALE_PENDING_SECONDS = 60
+IN_FLIGHT_WAIT_SECONDS = 5.0
+IN_FLIGHT_POLL_SECONDS = 0.1
+MAX_KEY_LENGTH = 128
+
+HEADER = "Idempotency-Key"
+FORM_FIELD = "idempotency_key"
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def request_key():
+    """The Idempotency-Key header, else the idempotency_key form field."""
+    return request.headers.get(HEADER) or request.form.get(FORM_FIELD)
+
+
+def retry_later():
+    """Called by a guarded view: don't cache this response, let a retry run the view again."""
+    g.idempotency_retry = True
+
+
+def _fingerprint():
+    body = sorted((k, v) for k, v in request.form.items(multi=True) if k != FORM_FIELD)
+    digest = hashlib.sha256(json.dumps(body).encode()).hexdigest()
+    return f"{request.method} {request.full_path.rstrip('?')} {digest}"
+
+
+class IdempotencyStore:
+    def __init__(self, writer, read_db, clock=time.time):
+        self.writer = writer      # WriteCoordinator
+        self.read_db = read_db    # () -> read-only connection
+        self.clock = clock        # () -> epoch seconds
+
+    def guard(self, key_fn=request_key, ttl=DEFAULT_TTL_SECONDS):
+        """Decorator for a view; key_fn() -> key or None (no key: the view just runs)."""
+        def decorate(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = key_fn()
+                user_id = session.get("user_id")
+                if not key or len(key) > MAX_KEY_LENGTH or user_id is None:
+                    return view(*args, **kwargs)
+                return self._run(view, args, kwargs, user_id, key, ttl)
+            return wrapper
+        return decorate
+
+    def _run(self, view, args, kwargs, user_id, key, ttl):
+        fingerprint = _fingerprint()
+        row = self._lookup(user_id, key)
+        if row is None:
+            try:
+                claimed = self.writer.run(
+                    lambda conn: Repositories(conn).idempotency.claim(
+                        user_id, key, fingerprint, int(self.clock()), ttl, STALE_PENDING_SECONDS
+                    )
+                )
+            except DatabaseBusy:
+                # the view reports busy itself; nothing is stored either way
+                return view(*args, **kwargs)
+            if claimed:
+                return self._run_claimed(view, args, kwargs, user_id, key)
+            row = self._lookup(user_id, key)
+
+        deadline = time.monotonic() + IN_FLIGHT_WAIT_SECONDS
+        while row is not None and row["state"] == "pending" and time.monotonic() < deadline:
+            time.sleep(IN_FLIGHT_POLL_SECONDS)
+            row = self._lookup(user_id, key)
+
+        if row is None:
+            # the first request released its claim (busy / failed): run again
+            return self._run(view, args, kwargs, user_id, key, ttl)
+        if row["request"] != fingerprint:
+            return self._refuse("This form was already submitted with different details. Please try again.", 422)
+        if row["state"] == "pending":
+            return self._refuse("This request is still being processed. Please check back in a moment.", 409)
+        return self._replay(json.loads(row["response"]))
+
+    def _lookup(self, user_id, key):
+        conn = self.read_db()
+        try:
+            return Repositories(conn).idempotency.get(user_id, key, int(self.clock()))
+        finally:
+            conn.close()
+
+    def _run_claimed(self, view, args, kwargs, user_id, key):
+        flashes_before = len(session.get("_flashes", []))
+        g.idempotency_retry = False
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            self._release(user_id, key)
+            raise
+
+        if g.idempotency_retry or response.status_code >= 500 or response.is_streamed:
+            self._release(user_id, key)
+            return response
+
+        outcome = {
+            "status": response.status_code,
+            "location": response.headers.get("Location"),
+            "content_type": response.content_type,
+            "body": None if response.headers.get("Location") else response.get_data(as_text=True),
+            "flashes": [list(f) for f in session.get("_flashes", [])[flashes_before:]],
+        }
+        try:
+            self.writer.run(
+                lambda conn: Repositories(conn).idempotency.complete(user_id, key, json.dumps(outcome))
+            )
+        except DatabaseBusy:
+            # the claim goes stale after STALE_PENDING_SECONDS and a retry runs the view
+            print(f"[Idempotency] Could not store the outcome for key {key}: database busy")
+        return response
+
+    def _release(self, user_id, key):
+        try:
+            self.writer.run(lambda conn: Repositories(conn).idempotency.release(user_id, key))
+        except DatabaseBusy:
+            pass  # goes stale after STALE_PENDING_SECONDS
+
+    def _replay(self, outcome):
+        for category, message in outcome["flashes"]:
+            flash(message, category)
+        if outcome["location"]:
+            return redirect(outcome["location"], code=outcome["status"])
+        response = make_response(outcome["body"], outcome["status"])
+        response.content_type = outcome["content_type"]
+        return response
+
+    def _refuse(self, message, status):
+        # API clients (key in a header) get the status; forms go back to the page
+        if request.headers.get(HEADER):
+            return make_response({"error": message}, status)
+        flash(message, "warning")
+        return redirect(request.referrer or "/")
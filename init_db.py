@@ -1,6 +1,8 @@
 import sqlite3
 import os
 from werkzeug.security import generate_password_hash
+import migrations
+import doctor_schedule
 
 # 1. Setup Paths
 db_folder = "instance"
@@ -17,6 +19,9 @@ if os.path.exists(db_path):
 conn = sqlite3.connect(db_path)
 with open("schema.sql", "r") as f:
     conn.executescript(f.read())
+conn.close()
+migrations.migrate(db_path)
+conn = sqlite3.connect(db_path)
 print("Tables created successfully.")
 
 cur = conn.cursor()
@@ -85,6 +90,9 @@ cur.execute("INSERT INTO appointments (pet_id, doctor_id, appointment_date, stat
 # 3. Pending Appointment
 cur.execute("INSERT INTO appointments (pet_id, doctor_id, appointment_date, status, rating) VALUES (?, ?, '2025-12-10', 'pending', NULL)", (pet_id, doc2_id))
 
+# G. Working hours table from the seeded weekly_schedule text
+doctor_schedule.rebuild_all(conn)
+
 conn.commit()
 conn.close()
 
@@ -0,0 +1,628 @@
+"""
+Versioned schema migrations keyed on PRAGMA user_version.
+
+Each entry in MIGRATIONS is (version, description, step) where step is either
+a tuple of SQL statements or a function taking the connection. Steps must be
+safe to run on databases that were patched by hand before this runner
+existed (IF NOT EXISTS, _add_column_if_missing).
+
+migrate() costs a single PRAGMA read when the database is current. Otherwise
+it takes the SQLite write lock with BEGIN IMMEDIATE, re-checks the version
+(another gunicorn worker may have just finished) and applies every pending
+step plus the version bump in one transaction.
+"""
+
+import sqlite3
+
+import appointment_status as S
+import doctor_schedule
+
+MIGRATION_TIMEOUT_SECONDS = 30
+
+
+def _add_column_if_missing(conn, table, column_def):
+    col_name = column_def.split()[0]
+    cols = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    if col_name not in {c[1] for c in cols}:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column_def}")
+
+
+def _m001_runtime_columns(conn):
+    """Everything ensure_runtime_schema / update_schema.py / add_column.py used to patch in."""
+    _add_column_if_missing(conn, "pets", "photo_filename TEXT")
+
+    _add_column_if_missing(conn, "appointments", "rating INTEGER")
+    _add_column_if_missing(conn, "appointments", "doctor_review TEXT")
+    _add_column_if_missing(conn, "appointments", "clinic_review TEXT")
+    _add_column_if_missing(conn, "appointments", "reviewed_at TEXT")
+    _add_column_if_missing(conn, "appointments", "appointment_reason TEXT")
+    _add_column_if_missing(conn, "appointments", "symptom_notes TEXT")
+
+    # Feature 11/12: premium subscription + reward points
+    _add_column_if_missing(conn, "owners", "is_premium INTEGER NOT NULL DEFAULT 0")
+    _add_column_if_missing(conn, "owners", "reward_points INTEGER NOT NULL DEFAULT 0")
+    _add_column_if_missing(conn, "owners", "subscription_expiry TEXT")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            owner_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            trx_id TEXT,
+            payment_method TEXT,
+            payment_date TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'completed',
+            FOREIGN KEY (owner_id) REFERENCES owners(id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS outbreak_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            disease_guess TEXT NOT NULL,
+            area TEXT NOT NULL,
+            number_of_reports INTEGER NOT NULL,
+            timeframe_days INTEGER NOT NULL,
+            risk_level TEXT NOT NULL,
+            recommendation TEXT,
+            detected_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            status TEXT NOT NULL DEFAULT 'active',
+            UNIQUE (disease_guess, area)
+        )
+    """)
+
+
+# Join paths used by the dashboards: appointments -> pets -> owners and
+# appointments -> doctors -> clinics. owners.user_id and clinics.user_id are
+# already covered by their UNIQUE constraints.
+_M002_JOIN_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_appointments_doctor_date_status"
+    " ON appointments (doctor_id, appointment_date, status)",
+    "CREATE INDEX IF NOT EXISTS idx_appointments_pet ON appointments (pet_id)",
+    "CREATE INDEX IF NOT EXISTS idx_pets_owner ON pets (owner_id)",
+    "CREATE INDEX IF NOT EXISTS idx_doctors_clinic ON doctors (clinic_id)",
+    "CREATE INDEX IF NOT EXISTS idx_users_role_verified ON users (role, is_verified)",
+)
+
+
+# appointment_date is free-form TEXT; appointment_start mirrors it as integer
+# wall-clock minutes since 1970-01-01 00:00 so time windows are index ranges.
+_APPOINTMENT_START_EXPR = "CAST(strftime('%s', {col}) AS INTEGER) / 60"
+
+
+def _m003_appointment_start(conn):
+    _add_column_if_missing(conn, "appointments", "appointment_start INTEGER")
+    conn.execute(
+        "UPDATE appointments SET appointment_start = "
+        + _APPOINTMENT_START_EXPR.format(col="appointment_date")
+    )
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_appointments_start_insert
+        AFTER INSERT ON appointments
+        BEGIN
+            UPDATE appointments
+            SET appointment_start = {_APPOINTMENT_START_EXPR.format(col="NEW.appointment_date")}
+            WHERE id = NEW.id;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_appointments_start_update
+        AFTER UPDATE OF appointment_date ON appointments
+        BEGIN
+            UPDATE appointments
+            SET appointment_start = {_APPOINTMENT_START_EXPR.format(col="NEW.appointment_date")}
+            WHERE id = NEW.id;
+        END
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_appointments_start ON appointments (appointment_start)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_appointments_doctor_start"
+        " ON appointments (doctor_id, appointment_start, status)"
+    )
+
+
+def _m004_status_code(conn):
+    _add_column_if_missing(conn, "appointments", "status_code INTEGER NOT NULL DEFAULT 0")
+    conn.execute(f"UPDATE appointments SET status_code = {S.sql_code_case('status')}")
+    for event in ("INSERT", "UPDATE OF status"):
+        name = "insert" if event == "INSERT" else "update"
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_appointments_status_code_{name}
+            AFTER {event} ON appointments
+            BEGIN
+                UPDATE appointments
+                SET status_code = {S.sql_code_case('NEW.status')}
+                WHERE id = NEW.id;
+            END
+        """)
+
+    # Partial indexes over the small active subsets: the past-due sweep and
+    # slot/conflict checks only ever look at these rows.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_appointments_awaiting_start"
+        f" ON appointments (appointment_start) WHERE {S.sql_in(S.AWAITING_CLINIC)}"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_appointments_approved_start"
+        f" ON appointments (appointment_start) WHERE {S.sql_in({S.APPROVED})}"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_appointments_active_doctor"
+        f" ON appointments (doctor_id, appointment_start) WHERE {S.sql_in(S.ACTIVE)}"
+    )
+
+
+# Progress markers for incremental background jobs (e.g. the past-due sweep
+# remembers the appointment_start minute it has processed up to).
+_M005_SWEEP_STATE = (
+    """
+    CREATE TABLE IF NOT EXISTS sweep_state (
+        name       TEXT PRIMARY KEY,
+        high_water INTEGER NOT NULL
+    )
+    """,
+)
+
+
+def _m006_doctor_schedule(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS doctor_schedule (
+            doctor_id    INTEGER NOT NULL,
+            weekday      INTEGER NOT NULL,  -- 0 = Monday, as datetime.weekday()
+            start_minute INTEGER NOT NULL,  -- minutes after midnight
+            end_minute   INTEGER NOT NULL,
+            PRIMARY KEY (doctor_id, weekday, start_minute)
+        ) WITHOUT ROWID
+    """)
+    # "who works on Saturday at 17:30" across doctors
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_doctor_schedule_weekday"
+        " ON doctor_schedule (weekday, start_minute, end_minute)"
+    )
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_doctors_delete_schedule
+        AFTER DELETE ON doctors
+        BEGIN
+            DELETE FROM doctor_schedule WHERE doctor_id = OLD.id;
+        END
+    """)
+    # one-time parse of both weekly_schedule text formats
+    doctor_schedule.rebuild_all(conn)
+
+
+# Booked slots per doctor-day as a slot_mask (bit i = the 30-minute slot at
+# i * 30 minutes), kept exact by triggers: every write that can change which
+# slots a doctor-day has blocked re-aggregates that day from the
+# idx_appointments_doctor_start range. Availability searches read this small
+# table instead of scanning appointments.
+_BOOKED_MASK_SQL = "SUM(DISTINCT 1 << ((appointment_start % 1440) / 30))"
+
+
+def _refresh_booked_day(row):
+    """Upsert the doctor_day_booked row for the day of `row` (OLD or NEW)."""
+    return f"""
+        INSERT INTO doctor_day_booked (doctor_id, day, booked_mask)
+        SELECT {row}.doctor_id, {row}.appointment_start / 1440, COALESCE({_BOOKED_MASK_SQL}, 0)
+        FROM appointments
+        WHERE doctor_id = {row}.doctor_id
+          AND appointment_start >= {row}.appointment_start / 1440 * 1440
+          AND appointment_start < {row}.appointment_start / 1440 * 1440 + 1440
+          AND {S.sql_in(S.SLOT_BLOCKING)}
+        ON CONFLICT (doctor_id, day) DO UPDATE SET booked_mask = excluded.booked_mask;
+    """
+
+
+def _m007_doctor_day_booked(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS doctor_day_booked (
+            doctor_id   INTEGER NOT NULL,
+            day         INTEGER NOT NULL,  -- appointment_start / 1440
+            booked_mask INTEGER NOT NULL,
+            PRIMARY KEY (doctor_id, day)
+        ) WITHOUT ROWID
+    """)
+    triggers = (
+        ("insert", "AFTER INSERT", "NEW"),
+        ("update_old", "AFTER UPDATE OF doctor_id, appointment_start, status_code", "OLD"),
+        ("update_new", "AFTER UPDATE OF doctor_id, appointment_start, status_code", "NEW"),
+        ("delete", "AFTER DELETE", "OLD"),
+    )
+    for name, event, row in triggers:
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_appointments_booked_{name}
+            {event} ON appointments
+            WHEN {row}.appointment_start IS NOT NULL AND {row}.doctor_id IS NOT NULL
+            BEGIN
+                {_refresh_booked_day(row)}
+            END
+        """)
+    # earliest-slot search narrows to one city first
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clinics_location ON clinics (location)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_doctors_delete_booked
+        AFTER DELETE ON doctors
+        BEGIN
+            DELETE FROM doctor_day_booked WHERE doctor_id = OLD.id;
+        END
+    """)
+    conn.execute("DELETE FROM doctor_day_booked")
+    conn.execute(f"""
+        INSERT INTO doctor_day_booked (doctor_id, day, booked_mask)
+        SELECT doctor_id, appointment_start / 1440, {_BOOKED_MASK_SQL}
+        FROM appointments
+        WHERE appointment_start IS NOT NULL
+          AND doctor_id IS NOT NULL
+          AND {S.sql_in(S.SLOT_BLOCKING)}
+        GROUP BY doctor_id, appointment_start / 1440
+    """)
+
+
+# Appointments a migration had to cancel, so the clinic can follow up with
+# the owners (nobody is notified from inside a migration).
+_MIGRATION_CANCELLATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS migration_cancellations (
+        appointment_id      INTEGER PRIMARY KEY,
+        kept_appointment_id INTEGER NOT NULL,  -- the booking that keeps the slot
+        previous_status     TEXT NOT NULL,
+        migration           INTEGER NOT NULL,
+        cancelled_at        TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+def _m008_slot_ownership(conn):
+    # One active appointment per doctor and start minute. Rows that already
+    # collide (double bookings from before this index) keep the oldest
+    # request; the later ones become clinic_cancelled and are recorded in
+    # migration_cancellations.
+    active = S.sql_in(S.ACTIVE)
+    conn.execute(_MIGRATION_CANCELLATIONS_TABLE)
+    conn.execute(f"""
+        INSERT OR IGNORE INTO migration_cancellations
+            (appointment_id, kept_appointment_id, previous_status, migration)
+        SELECT a.id, MIN(b.id), a.status, 8
+        FROM appointments a
+        JOIN appointments b
+          ON b.doctor_id = a.doctor_id
+         AND b.appointment_start = a.appointment_start
+         AND {S.sql_in(S.ACTIVE, "b.status_code")}
+         AND b.id < a.id
+        WHERE {S.sql_in(S.ACTIVE, "a.status_code")}
+        GROUP BY a.id
+    """)
+    conn.execute(f"""
+        UPDATE appointments
+        SET status = '{S.CLINIC_CANCELLED}'
+        WHERE id IN (SELECT appointment_id FROM migration_cancellations WHERE migration = 8)
+          AND {active}
+    """)
+    cancelled = [row[0] for row in conn.execute(
+        "SELECT appointment_id FROM migration_cancellations WHERE migration = 8 ORDER BY appointment_id"
+    )]
+    if cancelled:
+        print(
+            f"[Schema] Migration 8 cancelled {len(cancelled)} double-booked appointment(s): "
+            f"{cancelled} (see migration_cancellations)"
+        )
+    conn.execute("DROP INDEX IF EXISTS idx_appointments_active_doctor")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_appointments_active_slot"
+        f" ON appointments (doctor_id, appointment_start) WHERE {active}"
+    )
+
+    # Short-lived claims on a slot while the owner fills in the booking form.
+    # expires_at is wall-clock epoch seconds; an expired row is simply taken
+    # over by the next hold on that slot.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS slot_holds (
+            doctor_id         INTEGER NOT NULL,
+            appointment_start INTEGER NOT NULL,
+            owner_id          INTEGER NOT NULL,
+            expires_at        INTEGER NOT NULL,
+            PRIMARY KEY (doctor_id, appointment_start)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_slot_holds_owner ON slot_holds (owner_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_slot_holds_expires ON slot_holds (expires_at)")
+
+
+# Per-doctor visit length / slot grid and per-appointment duration. The
+# booked-slot index switches from 30-minute bit masks to the day's
+# [start, duration] intervals (JSON), which slot_mask turns into minute masks.
+def _refresh_booked_intervals(row):
+    """Upsert the doctor_day_booked intervals for the day of `row` (OLD or NEW)."""
+    return f"""
+        INSERT INTO doctor_day_booked (doctor_id, day, bookings)
+        SELECT {row}.doctor_id, {row}.appointment_start / 1440,
+               json_group_array(json_array(appointment_start % 1440, duration_minutes))
+        FROM appointments
+        WHERE doctor_id = {row}.doctor_id
+          AND appointment_start >= {row}.appointment_start / 1440 * 1440
+          AND appointment_start < {row}.appointment_start / 1440 * 1440 + 1440
+          AND {S.sql_in(S.SLOT_BLOCKING)}
+        ON CONFLICT (doctor_id, day) DO UPDATE SET bookings = excluded.bookings;
+    """
+
+
+def _m009_visit_durations(conn):
+    _add_column_if_missing(conn, "doctors", "visit_minutes INTEGER NOT NULL DEFAULT 30")
+    _add_column_if_missing(conn, "doctors", "slot_minutes INTEGER NOT NULL DEFAULT 30")
+    _add_column_if_missing(conn, "appointments", "duration_minutes INTEGER NOT NULL DEFAULT 30")
+    _add_column_if_missing(conn, "slot_holds", "duration_minutes INTEGER NOT NULL DEFAULT 30")
+
+    for name in ("insert", "update_old", "update_new", "delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_appointments_booked_{name}")
+    conn.execute("DROP TABLE IF EXISTS doctor_day_booked")
+    conn.execute("""
+        CREATE TABLE doctor_day_booked (
+            doctor_id INTEGER NOT NULL,
+            day       INTEGER NOT NULL,  -- appointment_start / 1440
+            bookings  TEXT NOT NULL,     -- JSON [[minute_of_day, duration_minutes], ...]
+            PRIMARY KEY (doctor_id, day)
+        ) WITHOUT ROWID
+    """)
+    changes = "doctor_id, appointment_start, status_code, duration_minutes"
+    triggers = (
+        ("insert", "AFTER INSERT", "NEW"),
+        ("update_old", f"AFTER UPDATE OF {changes}", "OLD"),
+        ("update_new", f"AFTER UPDATE OF {changes}", "NEW"),
+        ("delete", "AFTER DELETE", "OLD"),
+    )
+    for name, event, row in triggers:
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_appointments_booked_{name}
+            {event} ON appointments
+            WHEN {row}.appointment_start IS NOT NULL AND {row}.doctor_id IS NOT NULL
+            BEGIN
+                {_refresh_booked_intervals(row)}
+            END
+        """)
+    conn.execute(f"""
+        INSERT INTO doctor_day_booked (doctor_id, day, bookings)
+        SELECT doctor_id, appointment_start / 1440,
+               json_group_array(json_array(appointment_start % 1440, duration_minutes))
+        FROM appointments
+        WHERE appointment_start IS NOT NULL
+          AND doctor_id IS NOT NULL
+          AND {S.sql_in(S.SLOT_BLOCKING)}
+        GROUP BY doctor_id, appointment_start / 1440
+    """)
+
+
+# Owners queue for a taken slot. FIFO is by id (AUTOINCREMENT, never
+# reused); the (doctor_id, appointment_start, id) index turns "who is next
+# for the slots this cancellation freed" into one index range lookup.
+def _m010_slot_waitlist(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS slot_waitlist (
+            id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+            doctor_id          INTEGER NOT NULL,
+            appointment_start  INTEGER NOT NULL,
+            appointment_date   TEXT NOT NULL,
+            owner_id           INTEGER NOT NULL,
+            pet_id             INTEGER NOT NULL,
+            appointment_reason TEXT,
+            symptom_notes      TEXT,
+            created_at         TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (doctor_id, appointment_start, owner_id),
+            FOREIGN KEY (doctor_id) REFERENCES doctors(id),
+            FOREIGN KEY (owner_id) REFERENCES owners(id),
+            FOREIGN KEY (pet_id) REFERENCES pets(id)
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_slot_waitlist_slot"
+        " ON slot_waitlist (doctor_id, appointment_start, id)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_slot_waitlist_owner ON slot_waitlist (owner_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_slot_waitlist_start ON slot_waitlist (appointment_start)")
+    for table, column in (("doctors", "doctor_id"), ("pets", "pet_id")):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_delete_waitlist
+            AFTER DELETE ON {table}
+            BEGIN
+                DELETE FROM slot_waitlist WHERE {column} = OLD.id;
+            END
+        """)
+
+
+# Outcomes of POSTs that carried an idempotency key (idempotency.py), so a
+# retried request is answered from here. Times are wall-clock epoch seconds.
+_M011_IDEMPOTENCY_KEYS = (
+    """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id    INTEGER NOT NULL,
+        key        TEXT NOT NULL,
+        request    TEXT NOT NULL,             -- method, path + body hash
+        state      TEXT NOT NULL DEFAULT 'pending',
+        response   TEXT,                      -- JSON, once state = 'done'
+        created_at INTEGER NOT NULL,
+        expires_at INTEGER NOT NULL,
+        PRIMARY KEY (user_id, key)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at)",
+)
+
+
+# Full-text directory search: one directory_fts row per clinic (rowid =
+# clinics.id) with its name, location and its doctors' names and
+# qualifications, kept current by triggers on clinics and doctors.
+# prefix='2 3' adds prefix indexes so "hap*"-style queries stay index
+# lookups.
+def _refresh_directory_doctors(clinic_id):
+    return f"""
+        UPDATE directory_fts
+        SET doctors = (SELECT COALESCE(group_concat(name, ' '), '') FROM doctors WHERE clinic_id = {clinic_id}),
+            qualifications = (SELECT COALESCE(group_concat(qualifications, ' '), '') FROM doctors WHERE clinic_id = {clinic_id})
+        WHERE rowid = {clinic_id};
+    """
+
+
+def _m012_directory_fts(conn):
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS directory_fts USING fts5(
+            name, location, doctors, qualifications,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    # the hidden `rank` column = bm25 weighted name > location > doctors > qualifications
+    conn.execute(
+        "INSERT INTO directory_fts (directory_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 4.0, 2.0)')"
+    )
+    triggers = {
+        "trg_clinics_fts_insert": """
+            AFTER INSERT ON clinics
+            BEGIN
+                INSERT INTO directory_fts (rowid, name, location, doctors, qualifications)
+                VALUES (NEW.id, COALESCE(NEW.name, ''), COALESCE(NEW.location, ''), '', '');
+            END
+        """,
+        "trg_clinics_fts_update": """
+            AFTER UPDATE OF name, location ON clinics
+            BEGIN
+                UPDATE directory_fts
+                SET name = COALESCE(NEW.name, ''), location = COALESCE(NEW.location, '')
+                WHERE rowid = NEW.id;
+            END
+        """,
+        "trg_clinics_fts_delete": """
+            AFTER DELETE ON clinics
+            BEGIN
+                DELETE FROM directory_fts WHERE rowid = OLD.id;
+            END
+        """,
+        "trg_doctors_fts_insert": f"""
+            AFTER INSERT ON doctors
+            BEGIN
+                {_refresh_directory_doctors("NEW.clinic_id")}
+            END
+        """,
+        "trg_doctors_fts_update": f"""
+            AFTER UPDATE OF name, qualifications, clinic_id ON doctors
+            BEGIN
+                {_refresh_directory_doctors("OLD.clinic_id")}
+                {_refresh_directory_doctors("NEW.clinic_id")}
+            END
+        """,
+        "trg_doctors_fts_delete": f"""
+            AFTER DELETE ON doctors
+            BEGIN
+                {_refresh_directory_doctors("OLD.clinic_id")}
+            END
+        """,
+    }
+    for name, body in triggers.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+    conn.execute("DELETE FROM directory_fts")
+    conn.execute("""
+        INSERT INTO directory_fts (rowid, name, location, doctors, qualifications)
+        SELECT c.id, COALESCE(c.name, ''), COALESCE(c.location, ''),
+               COALESCE((SELECT group_concat(d.name, ' ') FROM doctors d WHERE d.clinic_id = c.id), ''),
+               COALESCE((SELECT group_concat(d.qualifications, ' ') FROM doctors d WHERE d.clinic_id = c.id), '')
+        FROM clinics c
+    """)
+
+
+# Waiting for a slot the owner's own visit already covers is refused from
+# now on; drop such entries so promotion can't book the owner twice. The
+# pet_id index serves trg_pets_delete_waitlist.
+def _m013_waitlist_cleanup(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_slot_waitlist_pet ON slot_waitlist (pet_id)")
+    conn.execute(f"""
+        DELETE FROM slot_waitlist
+        WHERE EXISTS (
+            SELECT 1
+            FROM appointments a
+            JOIN pets p ON a.pet_id = p.id
+            WHERE a.doctor_id = slot_waitlist.doctor_id
+              AND a.appointment_start <= slot_waitlist.appointment_start
+              AND a.appointment_start + a.duration_minutes > slot_waitlist.appointment_start
+              AND {S.sql_in(S.ACTIVE, "a.status_code")}
+              AND (p.owner_id = slot_waitlist.owner_id OR a.pet_id = slot_waitlist.pet_id)
+        )
+    """)
+
+
+# Dashboard outbreak alerts: active ones, optionally for one area, by reports.
+_M014_OUTBREAK_ALERTS_INDEX = (
+    "CREATE INDEX IF NOT EXISTS idx_outbreak_alerts_active"
+    " ON outbreak_alerts (status, area, number_of_reports)",
+)
+
+
+# Databases migrated past 8 before migration_cancellations existed get the
+# (empty) table too.
+_M015_MIGRATION_CANCELLATIONS = (_MIGRATION_CANCELLATIONS_TABLE,)
+
+
+MIGRATIONS = [
+    (1, "runtime columns, payments, outbreak_alerts", _m001_runtime_columns),
+    (2, "join-path indexes", _M002_JOIN_INDEXES),
+    (3, "appointments.appointment_start epoch minutes", _m003_appointment_start),
+    (4, "appointments.status_code + active partial indexes", _m004_status_code),
+    (5, "sweep_state high-water marks", _M005_SWEEP_STATE),
+    (6, "doctor_schedule minute ranges", _m006_doctor_schedule),
+    (7, "doctor_day_booked slot masks + clinics.location index", _m007_doctor_day_booked),
+    (8, "unique active slot per doctor + slot_holds", _m008_slot_ownership),
+    (9, "visit/slot minutes + interval doctor_day_booked", _m009_visit_durations),
+    (10, "slot_waitlist", _m010_slot_waitlist),
+    (11, "idempotency_keys", _M011_IDEMPOTENCY_KEYS),
+    (12, "directory_fts full-text search", _m012_directory_fts),
+    (13, "slot_waitlist.pet_id index, drop waits on own visits", _m013_waitlist_cleanup),
+    (14, "outbreak_alerts active/area index", _M014_OUTBREAK_ALERTS_INDEX),
+    (15, "migration_cancellations", _M015_MIGRATION_CANCELLATIONS),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _apply(conn, step):
+    if callable(step):
+        step(conn)
+    else:
+        for statement in step:
+            conn.execute(statement)
+
+
+def migrate(database):
+    """
+    Bring `database` (a path or a file: URI) up to SCHEMA_VERSION.
+    Returns the list of versions applied by this call (empty when current).
+    """
+    conn = sqlite3.connect(
+        database,
+        timeout=MIGRATION_TIMEOUT_SECONDS,
+        isolation_level=None,
+        uri=database.startswith("file:"),
+    )
+    try:
+        if current_version(conn) >= SCHEMA_VERSION:
+            return []
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = current_version(conn)
+            applied = []
+            for target, _description, step in MIGRATIONS:
+                if target <= version:
+                    continue
+                _apply(conn, step)
+                applied.append(target)
+            if applied:
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return applied
+    finally:
+        conn.close()
@@ -0,0 +1,1438 @@
+"""
+Data access for users, owners, pets, clinics, doctors, appointments, payments
+and outbreak alerts.
+
+Every repository wraps one sqlite3 connection and never commits: routes pass
+the request connection (get_db()/get_read_db()), writer jobs pass the
+WriteCoordinator connection, and the caller decides when the transaction
+ends. Rows come back as whatever the connection's row_factory produces
+(sqlite3.Row everywhere in the app).
+
+memory_database() builds a shared-cache :memory: database from schema.sql +
+migrations.py, so the same repositories can be driven by load tests without
+Flask or disk I/O:
+
+    uri, keeper = memory_database()
+    repos = Repositories(connect(uri))
+"""
+
+import json
+import os
+import re
+import sqlite3
+from collections import namedtuple
+
+import appointment_status as appt_status
+import doctor_schedule
+import migrations
+import slot_mask
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+
+
+# ranked full-text search results per query
+SEARCH_LIMIT = 50
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+# shorter words must match a whole token: a one-letter prefix matches (and
+# has to rank) most of the directory
+MIN_PREFIX_LENGTH = 2
+
+
+def _fts_match(q):
+    """
+    FTS5 MATCH expression for free text: every word must match as a prefix
+    ("happy dha" -> '"happy"* "dha"*'). Words are quoted, so FTS5 operators
+    typed by the user are just text. None when q has no words.
+    """
+    words = _WORD_RE.findall((q or "").lower())
+    return " ".join(
+        f'"{w}"*' if len(w) >= MIN_PREFIX_LENGTH else f'"{w}"' for w in words
+    ) or None
+
+
+class Repository:
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class UserRepository(Repository):
+    def by_id(self, user_id):
+        return self.conn.execute(
+            "SELECT * FROM users WHERE id = ?", (user_id,)
+        ).fetchone()
+
+    def set_password_hash(self, user_id, password_hash):
+        self.conn.execute(
+            "UPDATE users SET password_hash = ? WHERE id = ?", (password_hash, user_id)
+        )
+
+    def with_role(self, role, is_verified):
+        return self.conn.execute(
+            "SELECT * FROM users WHERE role = ? AND is_verified = ?", (role, is_verified)
+        ).fetchall()
+
+
+class OwnerRepository(Repository):
+    def by_user(self, user_id):
+        return self.conn.execute(
+            "SELECT * FROM owners WHERE user_id = ?", (user_id,)
+        ).fetchone()
+
+    def by_id(self, owner_id):
+        return self.conn.execute(
+            "SELECT * FROM owners WHERE id = ?", (owner_id,)
+        ).fetchone()
+
+    def create_from_user(self, user):
+        self.conn.execute(
+            """
+            INSERT INTO owners (user_id, name, email, location, password)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (user["id"], user["name"], user["email"], "", ""),
+        )
+        return self.by_user(user["id"])
+
+    def update_profile(self, owner_id, name, email, location):
+        self.conn.execute(
+            """
+            UPDATE owners
+            SET name = ?, email = ?, location = ?
+            WHERE id = ?
+            """,
+            (name, email, location, owner_id),
+        )
+
+    def set_password(self, owner_id, password):
+        self.conn.execute(
+            "UPDATE owners SET password = ? WHERE id = ?", (password, owner_id)
+        )
+
+    def add_reward_points(self, owner_id, points):
+        self.conn.execute(
+            """
+            UPDATE owners
+            SET reward_points = COALESCE(reward_points, 0) + ?
+            WHERE id = ?
+            """,
+            (points, owner_id),
+        )
+
+    def activate_premium(self, owner_id, expiry, points_redeemed, points_earned):
+        self.conn.execute(
+            """
+            UPDATE owners
+            SET is_premium = 1,
+                subscription_expiry = ?,
+                reward_points = COALESCE(reward_points, 0) - ? + ?
+            WHERE id = ?
+            """,
+            (expiry, points_redeemed, points_earned, owner_id),
+        )
+
+
+class PetRepository(Repository):
+    def for_owner(self, owner_id, by_name=False):
+        order = "name" if by_name else "id"
+        return self.conn.execute(
+            f"SELECT * FROM pets WHERE owner_id = ? ORDER BY {order}", (owner_id,)
+        ).fetchall()
+
+    def get_for_owner(self, pet_id, owner_id):
+        return self.conn.execute(
+            "SELECT * FROM pets WHERE id = ? AND owner_id = ?", (pet_id, owner_id)
+        ).fetchone()
+
+    def belongs_to(self, pet_id, owner_id):
+        return self.conn.execute(
+            "SELECT 1 FROM pets WHERE id = ? AND owner_id = ?", (pet_id, owner_id)
+        ).fetchone() is not None
+
+    def add(self, owner_id, name, age, animal_type, breed, gender, vaccination_status, photo_filename=None):
+        return self.conn.execute(
+            """
+            INSERT INTO pets (owner_id, name, age, animal_type, breed, gender, vaccination_status, photo_filename)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (owner_id, name, age, animal_type, breed, gender, vaccination_status, photo_filename),
+        ).lastrowid
+
+    def update(self, pet_id, owner_id, name, age, animal_type, breed, gender, vaccination_status, photo_filename):
+        self.conn.execute(
+            """
+            UPDATE pets
+            SET name = ?, age = ?, animal_type = ?, breed = ?, gender = ?, vaccination_status = ?, photo_filename = ?
+            WHERE id = ? AND owner_id = ?
+            """,
+            (name, age, animal_type, breed, gender, vaccination_status, photo_filename, pet_id, owner_id),
+        )
+
+    def delete(self, pet_id, owner_id):
+        self.conn.execute(
+            "DELETE FROM pets WHERE id = ? AND owner_id = ?", (pet_id, owner_id)
+        )
+
+
+class ClinicRepository(Repository):
+    # clinic_rating = AVG(doctors.rating); review count = rated appointments
+    _WITH_RATING = """
+        SELECT
+            c.*,
+            {extra}
+            COALESCE(AVG(COALESCE(d.rating, 0)), 0) AS clinic_rating,
+            (
+                SELECT COUNT(a.rating)
+                FROM appointments a
+                JOIN doctors d2 ON a.doctor_id = d2.id
+                WHERE d2.clinic_id = c.id
+                  AND a.rating IS NOT NULL
+            ) AS clinic_review_count,
+            COUNT(d.id) AS doctor_count
+        FROM clinics c
+        {join}
+        LEFT JOIN doctors d ON d.clinic_id = c.id
+    """
+
+    def by_user(self, user_id):
+        return self.conn.execute(
+            "SELECT * FROM clinics WHERE user_id = ?", (user_id,)
+        ).fetchone()
+
+    def by_id(self, clinic_id):
+        return self.conn.execute(
+            "SELECT * FROM clinics WHERE id = ?", (clinic_id,)
+        ).fetchone()
+
+    def create_from_user(self, user):
+        self.conn.execute(
+            """
+            INSERT INTO clinics (user_id, name, license_number, email, contact_number, location)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                user["id"],
+                user["clinic_name"] or user["name"],
+                user["clinic_license"] or "",
+                user["email"],
+                user["phone"] or "",
+                user["clinic_location"] or "",
+            ),
+        )
+        return self.by_user(user["id"])
+
+    def update_profile(self, clinic_id, name, license_number, email, contact_number, location):
+        self.conn.execute(
+            """
+            UPDATE clinics
+            SET name = ?, license_number = ?, email = ?, contact_number = ?, location = ?
+            WHERE id = ?
+            """,
+            (name, license_number, email, contact_number, location, clinic_id),
+        )
+
+    def with_rating(self, clinic_id):
+        sql = self._WITH_RATING.format(extra="", join="") + " WHERE c.id = ? GROUP BY c.id"
+        return self.conn.execute(sql, (clinic_id,)).fetchone()
+
+    def locations(self):
+        rows = self.conn.execute("SELECT DISTINCT location FROM clinics ORDER BY location").fetchall()
+        return [row[0] for row in rows if row[0]]
+
+    def search_verified(self, q="", location=None, limit=SEARCH_LIMIT, min_rating=None):
+        """
+        Verified clinics matching q, an exact location and a minimum
+        clinic_rating. q is matched against clinic name, location, doctor
+        names and qualifications (directory_fts, every word as a prefix) and
+        results are ranked by bm25, best `limit` first; without q every
+        clinic is listed by name.
+        """
+        if q:
+            return self._search_text(q, location, limit, min_rating)
+
+        sql = self._WITH_RATING.format(
+            extra="u.clinic_location,",
+            join="JOIN users u ON c.user_id = u.id",
+        ) + " WHERE u.is_verified = 1"
+        params = []
+
+        if location:
+            sql += " AND c.location = ?"
+            params.append(location)
+
+        sql += " GROUP BY c.id"
+        if min_rating is not None:
+            sql += " HAVING clinic_rating >= ?"
+            params.append(min_rating)
+        sql += " ORDER BY c.name"
+        return self.conn.execute(sql, params).fetchall()
+
+    def _search_text(self, q, location, limit, min_rating=None):
+        match = _fts_match(q)
+        if not match:
+            return []
+        # The best `limit` verified hits are picked first (rank = weighted
+        # bm25, configured in migration 12), so ratings are only aggregated
+        # for the clinics that are shown, however many match. The rating
+        # filter has to apply before that LIMIT, so it is checked per hit.
+        location_sql = "AND hc.location = ?" if location else ""
+        rating_sql = (
+            "AND (SELECT COALESCE(AVG(COALESCE(hd.rating, 0)), 0)"
+            " FROM doctors hd WHERE hd.clinic_id = hc.id) >= ?"
+        ) if min_rating is not None else ""
+        sql = f"""
+            WITH hits AS (
+                SELECT f.rowid AS clinic_id, f.rank
+                FROM directory_fts f
+                JOIN clinics hc ON hc.id = f.rowid
+                JOIN users hu ON hc.user_id = hu.id
+                WHERE directory_fts MATCH ? AND hu.is_verified = 1 {location_sql} {rating_sql}
+                ORDER BY f.rank
+                LIMIT ?
+            )
+        """ + self._WITH_RATING.format(
+            extra="u.clinic_location, h.rank AS search_rank,",
+            join="JOIN hits h ON h.clinic_id = c.id JOIN users u ON c.user_id = u.id",
+        ) + " GROUP BY c.id ORDER BY search_rank, c.name"
+        params = (
+            [match] + ([location] if location else [])
+            + ([min_rating] if min_rating is not None else []) + [limit]
+        )
+        return self.conn.execute(sql, params).fetchall()
+
+
+class DoctorRepository(Repository):
+    def for_clinic(self, clinic_id):
+        return self.conn.execute(
+            "SELECT * FROM doctors WHERE clinic_id = ? ORDER BY name", (clinic_id,)
+        ).fetchall()
+
+    def get_for_clinic(self, doctor_id, clinic_id):
+        return self.conn.execute(
+            "SELECT * FROM doctors WHERE id = ? AND clinic_id = ?", (doctor_id, clinic_id)
+        ).fetchone()
+
+    def by_id(self, doctor_id):
+        return self.conn.execute(
+            "SELECT * FROM doctors WHERE id = ?", (doctor_id,)
+        ).fetchone()
+
+    def add(self, clinic_id, name, email, base_fee, qualifications, weekly_schedule,
+            visit_minutes=slot_mask.DEFAULT_MINUTES, slot_minutes=slot_mask.DEFAULT_MINUTES):
+        doctor_id = self.conn.execute(
+            """
+            INSERT INTO doctors (
+                clinic_id, name, email, base_fee, qualifications, rating, weekly_schedule,
+                visit_minutes, slot_minutes
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (clinic_id, name, email, base_fee, qualifications, 0, weekly_schedule,
+             visit_minutes, slot_minutes),
+        ).lastrowid
+        doctor_schedule.replace_schedule(self.conn, doctor_id, weekly_schedule)
+        return doctor_id
+
+    def update(self, doctor_id, clinic_id, name, email, base_fee, qualifications, weekly_schedule,
+               visit_minutes=slot_mask.DEFAULT_MINUTES, slot_minutes=slot_mask.DEFAULT_MINUTES):
+        self.conn.execute(
+            """
+            UPDATE doctors
+            SET name = ?, email = ?, base_fee = ?, qualifications = ?, weekly_schedule = ?,
+                visit_minutes = ?, slot_minutes = ?
+            WHERE id = ? AND clinic_id = ?
+            """,
+            (name, email, base_fee, qualifications, weekly_schedule,
+             visit_minutes, slot_minutes, doctor_id, clinic_id),
+        )
+        doctor_schedule.replace_schedule(self.conn, doctor_id, weekly_schedule)
+
+    def delete(self, doctor_id, clinic_id):
+        # doctor_schedule rows go with it (trg_doctors_delete_schedule)
+        self.conn.execute(
+            "DELETE FROM doctors WHERE id = ? AND clinic_id = ?", (doctor_id, clinic_id)
+        )
+
+    def schedule(self, doctor_id):
+        """{weekday: [(start_minute, end_minute), ...]} from doctor_schedule."""
+        out = {}
+        for weekday, start, end in self.conn.execute(
+            """
+            SELECT weekday, start_minute, end_minute FROM doctor_schedule
+            WHERE doctor_id = ?
+            ORDER BY weekday, start_minute
+            """,
+            (doctor_id,),
+        ).fetchall():
+            out.setdefault(weekday, []).append((start, end))
+        return out
+
+    def clinic_schedules(self, clinic_id):
+        """{doctor_id: {weekday: [(start_minute, end_minute), ...]}} for a whole clinic."""
+        out = {}
+        for doctor_id, weekday, start, end in self.conn.execute(
+            """
+            SELECT s.doctor_id, s.weekday, s.start_minute, s.end_minute
+            FROM doctors d
+            JOIN doctor_schedule s ON s.doctor_id = d.id
+            WHERE d.clinic_id = ?
+            ORDER BY s.doctor_id, s.weekday, s.start_minute
+            """,
+            (clinic_id,),
+        ).fetchall():
+            out.setdefault(doctor_id, {}).setdefault(weekday, []).append((start, end))
+        return out
+
+    def bookable(self, location=None, max_fee=None, min_rating=None):
+        """Doctors of verified clinics, with clinic name/location, for availability search."""
+        sql = """
+            SELECT d.id, d.name, d.base_fee, d.rating, d.visit_minutes, d.slot_minutes,
+                   c.id AS clinic_id, c.name AS clinic_name, c.location
+            FROM clinics c
+            JOIN users u ON c.user_id = u.id
+            JOIN doctors d ON d.clinic_id = c.id
+            WHERE u.is_verified = 1
+        """
+        params = []
+        if location:
+            sql += " AND c.location = ?"
+            params.append(location)
+        if max_fee is not None:
+            sql += " AND d.base_fee <= ?"
+            params.append(max_fee)
+        if min_rating is not None:
+            sql += " AND COALESCE(d.rating, 0) >= ?"
+            params.append(min_rating)
+        return self.conn.execute(sql, params).fetchall()
+
+    def timings(self, doctor_ids):
+        """{doctor_id: (visit_minutes, slot_minutes)}."""
+        rows = self.conn.execute(
+            """
+            SELECT d.id, d.visit_minutes, d.slot_minutes
+            FROM json_each(?) AS ids
+            JOIN doctors d ON d.id = ids.value
+            """,
+            (json.dumps(list(doctor_ids)),),
+        ).fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def week_masks(self, doctor_ids):
+        """{doctor_id: {weekday: schedule slot_mask}} from doctor_schedule."""
+        ranges = {}
+        for doctor_id, weekday, start, end in self.conn.execute(
+            """
+            SELECT s.doctor_id, s.weekday, s.start_minute, s.end_minute
+            FROM json_each(?) AS ids
+            JOIN doctor_schedule s ON s.doctor_id = ids.value
+            """,
+            (json.dumps(list(doctor_ids)),),
+        ).fetchall():
+            ranges.setdefault(doctor_id, {}).setdefault(weekday, []).append((start, end))
+        return {
+            doctor_id: {weekday: slot_mask.from_ranges(r) for weekday, r in weekly.items()}
+            for doctor_id, weekly in ranges.items()
+        }
+
+    def day_ranges(self, doctor_id, weekday):
+        rows = self.conn.execute(
+            """
+            SELECT start_minute, end_minute FROM doctor_schedule
+            WHERE doctor_id = ? AND weekday = ?
+            ORDER BY start_minute
+            """,
+            (doctor_id, weekday),
+        ).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    def works_at(self, doctor_id, weekday, minute, duration=1):
+        """Does [minute, minute + duration) lie inside one of the doctor's ranges on weekday?"""
+        return self.conn.execute(
+            """
+            SELECT 1 FROM doctor_schedule
+            WHERE doctor_id = ? AND weekday = ?
+              AND start_minute <= ? AND end_minute >= ?
+            """,
+            (doctor_id, weekday, minute, minute + duration),
+        ).fetchone() is not None
+
+    def refresh_rating(self, doctor_id):
+        """doctors.rating = average rating of its reviewed appointments."""
+        avg_doctor = self.conn.execute(
+            """
+            SELECT AVG(rating)
+            FROM appointments
+            WHERE doctor_id = ? AND rating IS NOT NULL
+            """,
+            (doctor_id,),
+        ).fetchone()[0]
+        avg_doctor = round(avg_doctor, 1) if avg_doctor else 0.0
+        self.conn.execute(
+            "UPDATE doctors SET rating = ? WHERE id = ?", (avg_doctor, doctor_id)
+        )
+        return avg_doctor
+
+
+AppointmentContext = namedtuple(
+    "AppointmentContext",
+    "id appointment_date status owner_name owner_email pet_name doctor_name clinic_name clinic_email",
+)
+
+
+class AppointmentRepository(Repository):
+    _CONTEXT_SQL = """
+        SELECT
+            a.id,
+            a.appointment_date,
+            a.status,
+            o.name   AS owner_name,
+            o.email  AS owner_email,
+            p.name   AS pet_name,
+            d.name   AS doctor_name,
+            c.name   AS clinic_name,
+            c.email  AS clinic_email
+        FROM appointments a
+        JOIN pets p    ON a.pet_id = p.id
+        JOIN owners o  ON p.owner_id = o.id
+        JOIN doctors d ON a.doctor_id = d.id
+        JOIN clinics c ON d.clinic_id = c.id
+        WHERE a.id IN (SELECT value FROM json_each(?))
+    """
+
+    def contexts(self, appt_ids):
+        """
+        Owner / pet / doctor / clinic details for many appointments in one
+        query. Returns {appt_id: AppointmentContext}; unknown ids are missing.
+        """
+        ids = sorted({int(i) for i in appt_ids})
+        if not ids:
+            return {}
+        rows = self.conn.execute(self._CONTEXT_SQL, (json.dumps(ids),)).fetchall()
+        return {row[0]: AppointmentContext(*row) for row in rows}
+
+    def context(self, appt_id):
+        return self.contexts((appt_id,)).get(appt_id)
+
+    def slot_taken(self, doctor_id, start_minute, duration=slot_mask.DEFAULT_MINUTES, exclude_id=None):
+        """
+        Does [start_minute, start_minute + duration) overlap a slot-blocking
+        appointment of the doctor? Visits are at most MAX_VISIT_MINUTES long,
+        so only starts in (start - MAX_VISIT_MINUTES, end) can overlap.
+        """
+        return self.conn.execute(
+            f"""
+            SELECT id FROM appointments
+            WHERE doctor_id = ?
+              AND appointment_start > ? - {slot_mask.MAX_VISIT_MINUTES}
+              AND appointment_start < ? + ?
+              AND appointment_start + duration_minutes > ?
+              AND {appt_status.sql_in(appt_status.SLOT_BLOCKING)}
+              AND id IS NOT ?
+            """,
+            (doctor_id, start_minute, start_minute, duration, start_minute, exclude_id),
+        ).fetchone() is not None
+
+    def owner_overlapping(self, doctor_id, start_minute, duration, owner_id, pet_id):
+        """
+        Does owner_id (any of their pets) or pet_id have an active visit with
+        the doctor overlapping [start_minute, start_minute + duration)?
+        """
+        return self.conn.execute(
+            f"""
+            SELECT 1
+            FROM appointments a
+            JOIN pets p ON a.pet_id = p.id
+            WHERE a.doctor_id = ?
+              AND a.appointment_start > ? - {slot_mask.MAX_VISIT_MINUTES}
+              AND a.appointment_start < ? + ?
+              AND a.appointment_start + a.duration_minutes > ?
+              AND {appt_status.sql_in(appt_status.ACTIVE, "a.status_code")}
+              AND (p.owner_id = ? OR a.pet_id = ?)
+            """,
+            (doctor_id, start_minute, start_minute, duration, start_minute, owner_id, pet_id),
+        ).fetchone() is not None
+
+    def series_conflicts(self, doctor_id, occurrences, duration, owner_id, now):
+        """
+        Check many candidate visits of one doctor in a single query.
+        occurrences: [(key, start_minute, weekday, minute_of_day), ...].
+        Returns {key: (off_hours, taken, held)} for the ones with a problem:
+        outside doctor_schedule, overlapping a slot-blocking appointment, or
+        overlapping another owner's unexpired hold.
+        """
+        rows = self.conn.execute(
+            f"""
+            WITH occ (k, start_minute, weekday, minute) AS (
+                SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'),
+                       json_extract(value, '$[2]'), json_extract(value, '$[3]')
+                FROM json_each(:occurrences)
+            ),
+            checked AS (
+                SELECT occ.k,
+                       NOT EXISTS (
+                           SELECT 1 FROM doctor_schedule s
+                           WHERE s.doctor_id = :doctor AND s.weekday = occ.weekday
+                             AND s.start_minute <= occ.minute AND s.end_minute >= occ.minute + :duration
+                       ) AS off_hours,
+                       EXISTS (
+                           SELECT 1 FROM appointments a
+                           WHERE a.doctor_id = :doctor
+                             AND a.appointment_start > occ.start_minute - {slot_mask.MAX_VISIT_MINUTES}
+                             AND a.appointment_start < occ.start_minute + :duration
+                             AND a.appointment_start + a.duration_minutes > occ.start_minute
+                             AND {appt_status.sql_in(appt_status.SLOT_BLOCKING, "a.status_code")}
+                       ) AS taken,
+                       EXISTS (
+                           SELECT 1 FROM slot_holds h
+                           WHERE h.doctor_id = :doctor
+                             AND h.appointment_start > occ.start_minute - {slot_mask.MAX_VISIT_MINUTES}
+                             AND h.appointment_start < occ.start_minute + :duration
+                             AND h.appointment_start + h.duration_minutes > occ.start_minute
+                             AND h.owner_id != :owner AND h.expires_at > :now
+                       ) AS held
+                FROM occ
+            )
+            SELECT k, off_hours, taken, held FROM checked
+            WHERE off_hours OR taken OR held
+            """,
+            {"occurrences": json.dumps([list(o) for o in occurrences]), "doctor": doctor_id,
+             "duration": duration, "owner": owner_id, "now": now},
+        ).fetchall()
+        return {row[0]: (bool(row[1]), bool(row[2]), bool(row[3])) for row in rows}
+
+    # Booked minutes come from doctor_day_booked (migrations 7/9): triggers
+    # keep each doctor-day's [minute, duration] intervals of slot-blocking
+    # appointments, turned into slot_mask minute masks here.
+
+    def booked_mask(self, doctor_id, day):
+        """slot_mask minutes occupied by slot-blocking appointments on one doctor-day."""
+        row = self.conn.execute(
+            "SELECT bookings FROM doctor_day_booked WHERE doctor_id = ? AND day = ?",
+            (doctor_id, day),
+        ).fetchone()
+        return slot_mask.from_bookings(json.loads(row[0])) if row else 0
+
+    def clinic_booked_masks(self, clinic_id, first_day, days):
+        """{(doctor_id, day_index): booked slot_mask} for every doctor of a clinic."""
+        rows = self.conn.execute(
+            """
+            SELECT b.doctor_id, b.day - ?, b.bookings
+            FROM doctors d
+            JOIN doctor_day_booked b ON b.doctor_id = d.id
+            WHERE d.clinic_id = ?
+              AND b.day >= ?
+              AND b.day < ?
+              AND b.bookings != '[]'
+            """,
+            (first_day, clinic_id, first_day, first_day + days),
+        ).fetchall()
+        return {(row[0], row[1]): slot_mask.from_bookings(json.loads(row[2])) for row in rows}
+
+    def booked_masks(self, doctor_ids, first_day, days):
+        """{(doctor_id, day_index): booked slot_mask} for a set of doctors."""
+        rows = self.conn.execute(
+            """
+            SELECT b.doctor_id, b.day - ?, b.bookings
+            FROM json_each(?) AS ids
+            JOIN doctor_day_booked b ON b.doctor_id = ids.value
+            WHERE b.day >= ?
+              AND b.day < ?
+              AND b.bookings != '[]'
+            """,
+            (first_day, json.dumps(list(doctor_ids)), first_day, first_day + days),
+        ).fetchall()
+        return {(row[0], row[1]): slot_mask.from_bookings(json.loads(row[2])) for row in rows}
+
+    def create(self, pet_id, doctor_id, appointment_date, status=appt_status.PENDING,
+               appointment_reason="", symptom_notes="", duration_minutes=slot_mask.DEFAULT_MINUTES):
+        return self.conn.execute(
+            """
+            INSERT INTO appointments (
+                pet_id, doctor_id, appointment_date, status,
+                appointment_reason, symptom_notes, duration_minutes
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (pet_id, doctor_id, appointment_date, status, appointment_reason, symptom_notes,
+             duration_minutes),
+        ).lastrowid
+
+    def set_status(self, appt_id, status):
+        self.conn.execute(
+            "UPDATE appointments SET status = ? WHERE id = ?", (status, appt_id)
+        )
+
+    def change_status(self, appt_id, from_states, status):
+        """Set status only if the appointment is in one of from_states; True if it was."""
+        return self.conn.execute(
+            f"UPDATE appointments SET status = ? WHERE id = ? AND {appt_status.sql_in(from_states)}",
+            (status, appt_id),
+        ).rowcount == 1
+
+    def move(self, appt_id, appointment_date, status):
+        self.conn.execute(
+            """
+            UPDATE appointments
+            SET appointment_date = ?, status = ?
+            WHERE id = ?
+            """,
+            (appointment_date, status, appt_id),
+        )
+
+    def for_owner_id(self, appt_id, owner_id):
+        """The appointment if its pet belongs to owner_id."""
+        return self.conn.execute(
+            """
+            SELECT a.*
+            FROM appointments a
+            JOIN pets p ON a.pet_id = p.id
+            WHERE a.id = ? AND p.owner_id = ?
+            """,
+            (appt_id, owner_id),
+        ).fetchone()
+
+    def with_owner_user(self, appt_id):
+        """Appointment row plus owner_id and the owner's user_id."""
+        return self.conn.execute(
+            """
+            SELECT a.*, p.owner_id, o.user_id
+            FROM appointments a
+            JOIN pets p ON a.pet_id = p.id
+            JOIN owners o ON p.owner_id = o.id
+            WHERE a.id = ?
+            """,
+            (appt_id,),
+        ).fetchone()
+
+    def for_owner_user(self, appt_id, user_id):
+        """id and status of the appointment if its pet's owner is users.id user_id."""
+        return self.conn.execute(
+            """
+            SELECT a.id, a.status
+            FROM appointments a
+            JOIN pets p ON a.pet_id = p.id
+            JOIN owners o ON p.owner_id = o.id
+            WHERE a.id = ? AND o.user_id = ?
+            """,
+            (appt_id, user_id),
+        ).fetchone()
+
+    def for_reschedule(self, appt_id, clinic_id):
+        """Appointment plus doctor/pet/owner details, if it is one of clinic_id's."""
+        return self.conn.execute(
+            """
+            SELECT
+                a.*,
+                d.id   AS doctor_id,
+                d.name AS doctor_name,
+                d.slot_minutes,
+                p.name AS pet_name,
+                o.id   AS owner_id,
+                o.name AS owner_name
+            FROM appointments a
+            JOIN doctors d ON a.doctor_id = d.id
+            JOIN pets p    ON a.pet_id   = p.id
+            JOIN owners o  ON p.owner_id = o.id
+            WHERE a.id = ? AND d.clinic_id = ?
+            """,
+            (appt_id, clinic_id),
+        ).fetchone()
+
+    def with_clinic(self, appt_id):
+        return self.conn.execute(
+            """
+            SELECT a.id, a.status, a.doctor_id, a.appointment_date, a.appointment_start,
+                   a.duration_minutes, d.clinic_id
+            FROM appointments a
+            JOIN doctors d ON a.doctor_id = d.id
+            WHERE a.id = ?
+            """,
+            (appt_id,),
+        ).fetchone()
+
+    def for_owner(self, owner_id):
+        return self.conn.execute(
+            """
+            SELECT
+                a.*,
+                d.name               AS doctor_name,
+                c.name               AS clinic_name,
+                c.location           AS clinic_location,
+                p.name               AS pet_name,
+                p.animal_type        AS pet_animal_type,
+                p.breed              AS pet_breed,
+                p.gender             AS pet_gender,
+                p.age                AS pet_age,
+                p.vaccination_status AS pet_vaccination_status
+            FROM appointments a
+            JOIN pets    p ON a.pet_id   = p.id
+            JOIN owners  o ON p.owner_id = o.id
+            JOIN doctors d ON a.doctor_id = d.id
+            JOIN clinics c ON d.clinic_id = c.id
+            WHERE o.id = ?
+            ORDER BY a.appointment_date DESC
+            """,
+            (owner_id,),
+        ).fetchall()
+
+    def for_doctor(self, doctor_id, pet_name_like=""):
+        params = [doctor_id]
+        where_extra = ""
+        if pet_name_like:
+            where_extra = " AND LOWER(p.name) LIKE ?"
+            params.append(f"%{pet_name_like.lower()}%")
+
+        return self.conn.execute(
+            f"""
+            SELECT
+                a.id,
+                a.appointment_date,
+                a.status,
+                a.rating,
+                p.name               AS pet_name,
+                CASE
+                    WHEN p.photo_filename IS NOT NULL AND p.photo_filename != ''
+                    THEN 'pet_photos/' || p.photo_filename
+                    ELSE 'images/paw-placeholder.png'
+                END AS pet_photo,
+
+                p.age                AS pet_age,
+                p.age                AS age,
+
+                p.animal_type        AS pet_animal_type,
+                p.animal_type        AS animal_type,
+
+                p.breed              AS pet_breed,
+                p.breed              AS breed,
+
+                p.gender             AS pet_gender,
+                p.gender             AS gender,
+
+                p.vaccination_status AS pet_vaccination_status,
+                p.vaccination_status AS vaccination_status,
+
+                COALESCE(a.appointment_reason, '') AS appointment_reason,
+                COALESCE(a.appointment_reason, '') AS reason,
+                COALESCE(a.symptom_notes, '') AS symptom_notes,
+                COALESCE(a.symptom_notes, '') AS symptoms,
+
+                o.name               AS owner_name,
+                d.name               AS doctor_name
+            FROM appointments a
+            JOIN pets    p ON a.pet_id   = p.id
+            JOIN owners  o ON p.owner_id = o.id
+            JOIN doctors d ON a.doctor_id = d.id
+            WHERE a.doctor_id = ?
+              {where_extra}
+            ORDER BY a.appointment_date ASC
+            """,
+            params,
+        ).fetchall()
+
+    def for_clinic(self, clinic_id):
+        """Every appointment with the clinic's doctors, oldest first."""
+        return self.conn.execute(
+            """
+            SELECT
+                a.*,
+                d.name               AS doctor_name,
+                p.name               AS pet_name,
+                p.animal_type        AS animal_type,
+                p.animal_type        AS pet_animal,
+                p.animal_type        AS pet_animal_type,
+                p.breed              AS breed,
+                p.breed              AS pet_breed,
+                p.gender             AS gender,
+                p.gender             AS pet_gender,
+                p.age                AS age,
+                p.age                AS pet_age,
+                p.vaccination_status AS vaccination_status,
+                p.vaccination_status AS pet_vaccination,
+                p.vaccination_status AS pet_vaccination_status,
+                o.name               AS owner_name
+            FROM appointments a
+            JOIN doctors d ON a.doctor_id = d.id
+            JOIN pets    p ON a.pet_id   = p.id
+            JOIN owners  o ON p.owner_id = o.id
+            WHERE d.clinic_id = ?
+            ORDER BY a.appointment_date ASC
+            """,
+            (clinic_id,),
+        ).fetchall()
+
+    # pending requests / approved history on the clinic dashboard
+    _CLINIC_LIST_SQL = """
+        SELECT
+            a.id,
+            a.appointment_date,
+            a.status,
+            p.name               AS pet_name,
+            CASE
+                WHEN p.photo_filename IS NOT NULL AND p.photo_filename != ''
+                THEN 'pet_photos/' || p.photo_filename
+                ELSE 'images/paw-placeholder.png'
+            END AS pet_photo,
+            p.age                AS age,
+            p.age                AS pet_age,
+            p.animal_type        AS animal_type,
+            p.animal_type        AS pet_animal_type,
+            p.breed              AS breed,
+            p.breed              AS pet_breed,
+            p.gender             AS gender,
+            p.gender             AS pet_gender,
+            p.vaccination_status AS vaccination_status,
+            p.vaccination_status AS pet_vaccination_status,
+            COALESCE(a.appointment_reason, '') AS appointment_reason,
+            COALESCE(a.symptom_notes, '') AS symptom_notes,
+            o.name               AS owner_name,
+            d.name               AS doctor_name
+        FROM appointments a
+        JOIN pets    p ON a.pet_id   = p.id
+        JOIN owners  o ON p.owner_id = o.id
+        JOIN doctors d ON a.doctor_id = d.id
+        WHERE d.clinic_id = ?
+        AND {states}
+        ORDER BY a.appointment_date {order}
+    """
+
+    def clinic_requests(self, clinic_id):
+        """Appointments waiting for the clinic, oldest first."""
+        sql = self._CLINIC_LIST_SQL.format(
+            states=appt_status.sql_in(appt_status.AWAITING_CLINIC, "a.status_code"), order="ASC"
+        )
+        return self.conn.execute(sql, (clinic_id,)).fetchall()
+
+    def clinic_history(self, clinic_id):
+        """Approved and completed appointments, newest first."""
+        sql = self._CLINIC_LIST_SQL.format(
+            states=appt_status.sql_in({appt_status.APPROVED, appt_status.COMPLETED}, "a.status_code"),
+            order="DESC",
+        )
+        return self.conn.execute(sql, (clinic_id,)).fetchall()
+
+    def clinic_reviews(self, clinic_id):
+        return self.conn.execute(
+            """
+            SELECT
+                a.rating,
+                a.doctor_review,
+                a.clinic_review,
+                a.reviewed_at,
+                a.appointment_date,
+                d.name AS doctor_name,
+                p.name AS pet_name,
+                o.name AS owner_name
+            FROM appointments a
+            JOIN doctors d ON a.doctor_id = d.id
+            JOIN pets p ON a.pet_id = p.id
+            JOIN owners o ON p.owner_id = o.id
+            WHERE d.clinic_id = ?
+            AND a.rating IS NOT NULL
+            ORDER BY a.reviewed_at DESC
+            """,
+            (clinic_id,),
+        ).fetchall()
+
+    def clinic_totals(self, clinic_id):
+        """(approved + completed appointments, their summed doctor fees, average rating)."""
+        count, revenue = self.conn.execute(
+            f"""
+            SELECT COUNT(*), SUM(d.base_fee)
+            FROM appointments a
+            JOIN doctors d ON a.doctor_id = d.id
+            WHERE d.clinic_id = ?
+              AND {appt_status.sql_in({appt_status.APPROVED, appt_status.COMPLETED}, "a.status_code")}
+            """,
+            (clinic_id,),
+        ).fetchone()
+        avg_rating = self.conn.execute(
+            """
+            SELECT AVG(a.rating)
+            FROM appointments a
+            JOIN doctors d ON a.doctor_id = d.id
+            WHERE d.clinic_id = ? AND a.rating IS NOT NULL
+            """,
+            (clinic_id,),
+        ).fetchone()[0]
+        return count, revenue, avg_rating
+
+    def recent_reports(self, since_minute):
+        """Symptoms and owner area of the non-cancelled appointments since since_minute (outbreak detection)."""
+        return self.conn.execute(
+            f"""
+            SELECT
+                a.appointment_date,
+                COALESCE(a.symptom_notes, '') AS symptom_notes,
+                COALESCE(a.appointment_reason, '') AS appointment_reason,
+                COALESCE(o.location, '') AS owner_area,
+                COALESCE(p.animal_type, 'Pet') AS animal_type
+            FROM appointments a
+            JOIN pets p   ON a.pet_id = p.id
+            JOIN owners o ON p.owner_id = o.id
+            WHERE a.appointment_start >= ?
+              AND NOT {appt_status.sql_in(appt_status.CANCELLED_STATES, "a.status_code")}
+            """,
+            (since_minute,),
+        ).fetchall()
+
+    def reviews_for_owner(self, owner_id):
+        return self.conn.execute(
+            """
+            SELECT
+                a.id,
+                a.appointment_date,
+                a.rating,
+                a.reviewed_at,
+                a.doctor_review,
+                a.clinic_review,
+                p.name AS pet_name,
+                d.name AS doctor_name,
+                c.name AS clinic_name
+            FROM appointments a
+            JOIN pets p ON a.pet_id = p.id
+            JOIN doctors d ON a.doctor_id = d.id
+            JOIN clinics c ON d.clinic_id = c.id
+            WHERE p.owner_id = ?
+              AND a.reviewed_at IS NOT NULL
+            ORDER BY a.reviewed_at DESC
+            """,
+            (owner_id,),
+        ).fetchall()
+
+    def complete_approved_between(self, start_minute, end_minute):
+        """approved -> completed for appointments starting in [start, end)."""
+        return self.conn.execute(
+            f"""
+            UPDATE appointments
+            SET status = ?
+            WHERE appointment_start >= ? AND appointment_start < ?
+              AND {appt_status.sql_in({appt_status.APPROVED})}
+            """,
+            (appt_status.COMPLETED, start_minute, end_minute),
+        ).rowcount
+
+    def awaiting_ids_between(self, start_minute, end_minute):
+        rows = self.conn.execute(
+            f"""
+            SELECT id FROM appointments
+            WHERE appointment_start >= ? AND appointment_start < ?
+              AND {appt_status.sql_in(appt_status.AWAITING_CLINIC)}
+            """,
+            (start_minute, end_minute),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def active_starts(self, since=0):
+        """(id, appointment_start) of pending/approved rows, via the partial indexes."""
+        rows = []
+        for states in (appt_status.AWAITING_CLINIC, {appt_status.APPROVED}):
+            rows += self.conn.execute(
+                f"""
+                SELECT id, appointment_start FROM appointments
+                WHERE appointment_start >= ? AND {appt_status.sql_in(states)}
+                """,
+                (since,),
+            ).fetchall()
+        return [(row[0], row[1]) for row in rows]
+
+    def transition_due(self, appt_ids, now_minute, from_states, to_status):
+        """
+        Move the given appointments from from_states to to_status if they have
+        started by now_minute; returns the ids this call actually changed.
+        """
+        rows = self.conn.execute(
+            f"""
+            UPDATE appointments
+            SET status = ?
+            WHERE id IN (SELECT value FROM json_each(?))
+              AND appointment_start <= ?
+              AND {appt_status.sql_in(from_states)}
+            RETURNING id
+            """,
+            (to_status, json.dumps(list(appt_ids)), now_minute),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def set_status_many(self, appt_ids, status):
+        self.conn.execute(
+            "UPDATE appointments SET status = ? WHERE id IN (SELECT value FROM json_each(?))",
+            (status, json.dumps(list(appt_ids))),
+        )
+
+    def save_review(self, appt_id, rating, doctor_review, clinic_review, reviewed_at):
+        """Returns 1 if saved, 0 if the appointment was already reviewed."""
+        return self.conn.execute(
+            """
+            UPDATE appointments
+            SET rating = ?, doctor_review = ?, clinic_review = ?, reviewed_at = ?
+            WHERE id = ? AND reviewed_at IS NULL
+            """,
+            (rating, doctor_review, clinic_review, reviewed_at, appt_id),
+        ).rowcount
+
+
+class PaymentRepository(Repository):
+    def record(self, owner_id, amount, trx_id, payment_date, payment_method="Stripe", status="completed"):
+        return self.conn.execute(
+            """
+            INSERT INTO payments (owner_id, amount, trx_id, payment_method, payment_date, status)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (owner_id, amount, trx_id, payment_method, payment_date, status),
+        ).lastrowid
+
+    def for_owner(self, owner_id):
+        return self.conn.execute(
+            "SELECT * FROM payments WHERE owner_id = ? ORDER BY payment_date DESC", (owner_id,)
+        ).fetchall()
+
+
+class OutbreakAlertRepository(Repository):
+    def active(self, area=None):
+        """Active alerts (only area's, if given), most reports first."""
+        where, params = "status = 'active'", ()
+        if area is not None:
+            where, params = "status = 'active' AND area = ?", (area,)
+        return self.conn.execute(
+            f"""
+            SELECT disease_guess, area, number_of_reports, timeframe_days, risk_level, recommendation
+            FROM outbreak_alerts
+            WHERE {where}
+            ORDER BY number_of_reports DESC
+            """,
+            params,
+        ).fetchall()
+
+    def save(self, alert):
+        """Insert or replace the active alert for alert's (disease_guess, area)."""
+        self.conn.execute(
+            """
+            INSERT OR REPLACE INTO outbreak_alerts
+            (disease_guess, area, number_of_reports, timeframe_days, risk_level, recommendation, detected_at, status)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, 'active')
+            """,
+            (
+                alert["disease_guess"],
+                alert["area"],
+                alert["number_of_reports"],
+                alert["timeframe_days"],
+                alert["risk_level"],
+                alert["recommendation"],
+            ),
+        )
+
+    def purge_older_than(self, days):
+        return self.conn.execute(
+            "DELETE FROM outbreak_alerts WHERE datetime(detected_at) < datetime('now', ?)",
+            (f"-{int(days)} days",),
+        ).rowcount
+
+
+class SweepStateRepository(Repository):
+    def high_water(self, name, default=0):
+        row = self.conn.execute(
+            "SELECT high_water FROM sweep_state WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else default
+
+    def set_high_water(self, name, value):
+        self.conn.execute(
+            """
+            INSERT INTO sweep_state (name, high_water) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET high_water = excluded.high_water
+            """,
+            (name, value),
+        )
+
+
+class SlotHoldRepository(Repository):
+    """
+    Short-lived slot claims (slot_holds). Times are wall-clock epoch seconds;
+    an expired hold is reclaimed lazily by the next place() on that slot.
+    """
+
+    def place(self, doctor_id, start_minute, owner_id, now, ttl, duration=slot_mask.DEFAULT_MINUTES):
+        """
+        Hold [start_minute, start_minute + duration) for owner_id until
+        now + ttl (an owner holds one slot at a time). False if it overlaps
+        someone else's unexpired hold.
+        """
+        self.conn.execute(
+            """
+            DELETE FROM slot_holds
+            WHERE owner_id = ? AND NOT (doctor_id = ? AND appointment_start = ?)
+            """,
+            (owner_id, doctor_id, start_minute),
+        )
+        if self.held_by_other(doctor_id, start_minute, owner_id, now, duration):
+            return False
+        return self.conn.execute(
+            """
+            INSERT INTO slot_holds (doctor_id, appointment_start, owner_id, expires_at, duration_minutes)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (doctor_id, appointment_start) DO UPDATE
+            SET owner_id = excluded.owner_id, expires_at = excluded.expires_at,
+                duration_minutes = excluded.duration_minutes
+            WHERE slot_holds.owner_id = excluded.owner_id OR slot_holds.expires_at <= ?
+            RETURNING owner_id
+            """,
+            (doctor_id, start_minute, owner_id, now + ttl, duration, now),
+        ).fetchone() is not None
+
+    def held_by_other(self, doctor_id, start_minute, owner_id, now, duration=slot_mask.DEFAULT_MINUTES):
+        """Does an unexpired hold of another owner overlap the interval?"""
+        return self.conn.execute(
+            f"""
+            SELECT 1 FROM slot_holds
+            WHERE doctor_id = ?
+              AND appointment_start > ? - {slot_mask.MAX_VISIT_MINUTES}
+              AND appointment_start < ? + ?
+              AND appointment_start + duration_minutes > ?
+              AND owner_id != ? AND expires_at > ?
+            """,
+            (doctor_id, start_minute, start_minute, duration, start_minute, owner_id, now),
+        ).fetchone() is not None
+
+    def held_masks(self, doctor_ids, first_day, days, now, owner_id=None):
+        """
+        {(doctor_id, day_index): slot_mask} of the minutes under unexpired
+        holds on those doctors, leaving out owner_id's own hold.
+        """
+        rows = self.conn.execute(
+            """
+            SELECT h.doctor_id, h.appointment_start, h.duration_minutes
+            FROM json_each(?) AS ids
+            JOIN slot_holds h ON h.doctor_id = ids.value
+            WHERE h.appointment_start >= ?
+              AND h.appointment_start < ?
+              AND h.expires_at > ?
+              AND h.owner_id IS NOT ?
+            """,
+            (
+                json.dumps(list(doctor_ids)),
+                first_day * slot_mask.MINUTES_PER_DAY,
+                (first_day + days) * slot_mask.MINUTES_PER_DAY,
+                now,
+                owner_id,
+            ),
+        ).fetchall()
+        holds = {}
+        for doctor_id, start, duration in rows:
+            day, minute = divmod(start, slot_mask.MINUTES_PER_DAY)
+            holds.setdefault((doctor_id, day - first_day), []).append((minute, duration))
+        return {key: slot_mask.from_bookings(spans) for key, spans in holds.items()}
+
+    def release(self, doctor_id, start_minute, owner_id):
+        self.conn.execute(
+            """
+            DELETE FROM slot_holds
+            WHERE doctor_id = ? AND appointment_start = ? AND owner_id = ?
+            """,
+            (doctor_id, start_minute, owner_id),
+        )
+
+    def purge_expired(self, now):
+        return self.conn.execute(
+            "DELETE FROM slot_holds WHERE expires_at <= ?", (now,)
+        ).rowcount
+
+
+WaitlistEntry = namedtuple(
+    "WaitlistEntry",
+    "id doctor_id appointment_start appointment_date owner_id pet_id "
+    "appointment_reason symptom_notes is_premium",
+)
+
+
+class WaitlistRepository(Repository):
+    """
+    Owners waiting for a taken slot (slot_waitlist), served first come first
+    served: a lower id joined earlier.
+    """
+
+    def join(self, doctor_id, start_minute, appointment_date, owner_id, pet_id,
+             appointment_reason="", symptom_notes=""):
+        """
+        Queue owner_id for the slot; joining again only refreshes pet and
+        notes and keeps the place in line. Returns the 1-based position.
+        """
+        self.conn.execute(
+            """
+            INSERT INTO slot_waitlist (
+                doctor_id, appointment_start, appointment_date, owner_id, pet_id,
+                appointment_reason, symptom_notes
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (doctor_id, appointment_start, owner_id) DO UPDATE
+            SET pet_id = excluded.pet_id,
+                appointment_reason = excluded.appointment_reason,
+                symptom_notes = excluded.symptom_notes
+            """,
+            (doctor_id, start_minute, appointment_date, owner_id, pet_id,
+             appointment_reason, symptom_notes),
+        )
+        return self.conn.execute(
+            """
+            SELECT COUNT(*) FROM slot_waitlist
+            WHERE doctor_id = ? AND appointment_start = ?
+              AND id <= (SELECT id FROM slot_waitlist
+                         WHERE doctor_id = ? AND appointment_start = ? AND owner_id = ?)
+            """,
+            (doctor_id, start_minute, doctor_id, start_minute, owner_id),
+        ).fetchone()[0]
+
+    def waiting_within(self, doctor_id, start_minute, end_minute, after_minute):
+        """
+        Entries for the doctor whose visit could use [start_minute,
+        end_minute) and that start after after_minute, oldest first. Visits
+        are at most MAX_VISIT_MINUTES long, so this is one range of
+        idx_slot_waitlist_slot.
+        """
+        rows = self.conn.execute(
+            f"""
+            SELECT w.id, w.doctor_id, w.appointment_start, w.appointment_date, w.owner_id,
+                   w.pet_id, w.appointment_reason, w.symptom_notes, o.is_premium
+            FROM slot_waitlist w
+            JOIN owners o ON o.id = w.owner_id
+            WHERE w.doctor_id = ?
+              AND w.appointment_start > ? - {slot_mask.MAX_VISIT_MINUTES}
+              AND w.appointment_start < ?
+              AND w.appointment_start > ?
+            ORDER BY w.id
+            """,
+            (doctor_id, start_minute, end_minute, after_minute),
+        ).fetchall()
+        return [WaitlistEntry(*row) for row in rows]
+
+    def for_owner(self, owner_id, after_minute):
+        return self.conn.execute(
+            """
+            SELECT w.id, w.appointment_date, w.appointment_start,
+                   d.name AS doctor_name, c.name AS clinic_name, p.name AS pet_name,
+                   (SELECT COUNT(*) FROM slot_waitlist ahead
+                    WHERE ahead.doctor_id = w.doctor_id
+                      AND ahead.appointment_start = w.appointment_start
+                      AND ahead.id <= w.id) AS position
+            FROM slot_waitlist w
+            JOIN doctors d ON d.id = w.doctor_id
+            JOIN clinics c ON c.id = d.clinic_id
+            JOIN pets p    ON p.id = w.pet_id
+            WHERE w.owner_id = ? AND w.appointment_start > ?
+            ORDER BY w.appointment_start
+            """,
+            (owner_id, after_minute),
+        ).fetchall()
+
+    def remove(self, entry_id):
+        self.conn.execute("DELETE FROM slot_waitlist WHERE id = ?", (entry_id,))
+
+    def leave(self, entry_id, owner_id):
+        return self.conn.execute(
+            "DELETE FROM slot_waitlist WHERE id = ? AND owner_id = ?", (entry_id, owner_id)
+        ).rowcount
+
+    def purge_started(self, now_minute):
+        """Drop entries for slots that have already started."""
+        return self.conn.execute(
+            "DELETE FROM slot_waitlist WHERE appointment_start <= ?", (now_minute,)
+        ).rowcount
+
+
+class IdempotencyRepository(Repository):
+    """
+    idempotency_keys rows: 'pending' while the first request with a key runs,
+    'done' with its response afterwards. Times are wall-clock epoch seconds.
+    """
+
+    def get(self, user_id, key, now):
+        return self.conn.execute(
+            """
+            SELECT request, state, response, created_at FROM idempotency_keys
+            WHERE user_id = ? AND key = ? AND expires_at > ?
+            """,
+            (user_id, key, now),
+        ).fetchone()
+
+    def claim(self, user_id, key, request, now, ttl, stale_after):
+        """
+        Mark the key as in progress. True if this caller owns it; False if
+        an unexpired row exists (done, or pending for under stale_after
+        seconds, i.e. its request is presumably still running).
+        """
+        return self.conn.execute(
+            """
+            INSERT INTO idempotency_keys (user_id, key, request, state, created_at, expires_at)
+            VALUES (?, ?, ?, 'pending', ?, ?)
+            ON CONFLICT (user_id, key) DO UPDATE
+            SET request = excluded.request, state = 'pending', response = NULL,
+                created_at = excluded.created_at, expires_at = excluded.expires_at
+            WHERE idempotency_keys.expires_at <= ?
+               OR (idempotency_keys.state = 'pending' AND idempotency_keys.created_at <= ?)
+            RETURNING 1
+            """,
+            (user_id, key, request, now, now + ttl, now, now - stale_after),
+        ).fetchone() is not None
+
+    def complete(self, user_id, key, response):
+        self.conn.execute(
+            """
+            UPDATE idempotency_keys SET state = 'done', response = ?
+            WHERE user_id = ? AND key = ?
+            """,
+            (response, user_id, key),
+        )
+
+    def release(self, user_id, key):
+        self.conn.execute(
+            "DELETE FROM idempotency_keys WHERE user_id = ? AND key = ? AND state = 'pending'",
+            (user_id, key),
+        )
+
+    def purge_expired(self, now):
+        return self.conn.execute(
+            "DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,)
+        ).rowcount
+
+
+class Repositories:
+    """All repositories over one connection: repos.owners, repos.pets, ..."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.users = UserRepository(conn)
+        self.owners = OwnerRepository(conn)
+        self.pets = PetRepository(conn)
+        self.clinics = ClinicRepository(conn)
+        self.doctors = DoctorRepository(conn)
+        self.appointments = AppointmentRepository(conn)
+        self.payments = PaymentRepository(conn)
+        self.outbreak_alerts = OutbreakAlertRepository(conn)
+        self.sweep_state = SweepStateRepository(conn)
+        self.holds = SlotHoldRepository(conn)
+        self.waitlist = WaitlistRepository(conn)
+        self.idempotency = IdempotencyRepository(conn)
+
+
+# ---- in-memory backend ----
+
+def memory_database(name="petcare"):
+    """
+    Create a shared-cache in-memory database seeded from schema.sql and
+    migrations.py. Returns (uri, keeper): the database lives as long as
+    `keeper` stays open, and every connect(uri) in this process sees it.
+    """
+    uri = f"file:{name}?mode=memory&cache=shared"
+    keeper = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    with open(SCHEMA_PATH) as f:
+        keeper.executescript(f.read())
+    migrations.migrate(uri)
+    return uri, keeper
+
+
+def connect(database):
+    """Plain connection with sqlite3.Row rows, for a file path or file: URI."""
+    conn = sqlite3.connect(database, uri=database.startswith("file:"), check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
@@ -1,3 +1,6 @@
+DROP TABLE IF EXISTS outbreak_alerts;
+DROP TABLE IF EXISTS payments;
+DROP TABLE IF EXISTS appointments;
 DROP TABLE IF EXISTS pets;
 DROP TABLE IF EXISTS owners;
 DROP TABLE IF EXISTS doctors;
@@ -24,6 +27,9 @@ CREATE TABLE owners (
     email TEXT NOT NULL,
     location TEXT NOT NULL DEFAULT '',
     password TEXT NOT NULL DEFAULT '',
+    is_premium INTEGER NOT NULL DEFAULT 0,
+    reward_points INTEGER NOT NULL DEFAULT 0,
+    subscription_expiry TEXT,             -- 'YYYY-MM-DD'
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
@@ -75,7 +81,37 @@ CREATE TABLE appointments (
     doctor_review TEXT,      -- doctor review text
     clinic_review TEXT,      -- optional clinic review
     reviewed_at TEXT,        -- timestamp
+    appointment_reason TEXT, -- outbreak radar input
+    symptom_notes TEXT,      -- outbreak radar input
 
     FOREIGN KEY (pet_id) REFERENCES pets(id),
     FOREIGN KEY (doctor_id) REFERENCES doctors(id)
 );
+
+CREATE TABLE payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    trx_id TEXT,
+    payment_method TEXT,
+    payment_date TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'completed',
+    FOREIGN KEY (owner_id) REFERENCES owners(id)
+);
+
+CREATE TABLE outbreak_alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    disease_guess TEXT NOT NULL,
+    area TEXT NOT NULL,
+    number_of_reports INTEGER NOT NULL,
+    timeframe_days INTEGER NOT NULL,
+    risk_level TEXT NOT NULL,
+    recommendation TEXT,
+    detected_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    status TEXT NOT NULL DEFAULT 'active',
+    UNIQUE (disease_guess, area)
+);
+
+-- Tables above are the baseline; indexes and later changes are applied by
+-- migrations.py (keyed on user_version), so start a fresh file at 0.
+PRAGMA user_version = 0;
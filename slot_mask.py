@@ -0,0 +1,124 @@
+"""
+Doctor-day availability as integer bitmasks with one bit per minute of the
+day (bit m = the minute starting m minutes past midnight).
+
+    free   = schedule & ~booked          (minutes the doctor is idle)
+    starts = fits(free, visit, grid) & ~past
+
+schedule comes from doctor_schedule ranges (from_ranges), booked from the
+[start, start + duration) intervals in doctor_day_booked (from_bookings,
+kept up to date by triggers on appointments, see migrations.py), past from
+the current time (past_mask). fits() keeps the grid-aligned minutes where a
+whole visit fits, so doctors with different visit lengths and grids (and
+appointments of mixed durations on one day) use the same arithmetic.
+Intersections across doctors or days are plain & / |, and "who is free at
+17:30?" is one shift per doctor-day.
+"""
+
+from functools import lru_cache, reduce
+
+from doctor_schedule import format_minute
+
+MINUTES_PER_DAY = 24 * 60
+FULL_DAY = (1 << MINUTES_PER_DAY) - 1
+
+DEFAULT_MINUTES = 30
+# allowed doctors.visit_minutes / doctors.slot_minutes values
+CHOICES = (15, 20, 30, 45, 60)
+MAX_VISIT_MINUTES = max(CHOICES)
+
+
+def _span(start, end):
+    start, end = max(start, 0), min(end, MINUTES_PER_DAY)
+    if end <= start:
+        return 0
+    return ((1 << (end - start)) - 1) << start
+
+
+def bit(minute):
+    """Mask with only minute-of-day set."""
+    return 1 << minute
+
+
+def from_ranges(ranges):
+    """Minutes covered by [(start_minute, end_minute), ...]."""
+    return reduce(lambda mask, r: mask | _span(*r), ranges, 0)
+
+
+def from_bookings(bookings):
+    """Minutes occupied by [(start_minute, duration), ...] (clipped to the day)."""
+    return reduce(lambda mask, b: mask | _span(b[0], b[0] + b[1]), bookings, 0)
+
+
+@lru_cache(maxsize=None)
+def grid_mask(grid):
+    """Minutes that are multiples of grid."""
+    return reduce(lambda mask, m: mask | (1 << m), range(0, MINUTES_PER_DAY, grid), 0)
+
+
+def fits(free, length, grid=DEFAULT_MINUTES):
+    """
+    Grid-aligned minutes m with [m, m + length) entirely inside free.
+    Runs of free minutes are grown by doubling: O(log length) shifts.
+    """
+    run, covered = free, 1
+    while covered * 2 <= length:
+        run &= run >> covered
+        covered *= 2
+    if covered < length:
+        run &= run >> (length - covered)
+    return run & grid_mask(grid)
+
+
+def past_mask(after_minute):
+    """Minutes at or before after_minute (-1 -> none)."""
+    if after_minute < 0:
+        return 0
+    return (1 << min(after_minute + 1, MINUTES_PER_DAY)) - 1
+
+
+def free_starts(schedule, booked=0, past=0, length=DEFAULT_MINUTES, grid=DEFAULT_MINUTES):
+    """Start minutes (as a mask) where a visit of `length` can be booked."""
+    return fits(schedule & ~booked & FULL_DAY, length, grid) & ~past
+
+
+def intersect(masks):
+    """Minutes set in every mask (e.g. the same doctor across several days)."""
+    return reduce(lambda a, b: a & b, masks, FULL_DAY)
+
+
+def union(masks):
+    """Minutes set in at least one mask (e.g. any doctor of a clinic)."""
+    return reduce(lambda a, b: a | b, masks, 0)
+
+
+def is_free(mask, minute):
+    return bool(mask >> minute & 1)
+
+
+def who_is_free(masks, minute):
+    """Keys of {key: start mask} that can start a visit at minute-of-day."""
+    return [key for key, mask in masks.items() if mask >> minute & 1]
+
+
+def first_free(mask, after_minute=-1):
+    """Earliest set minute after after_minute, or None."""
+    mask &= ~past_mask(after_minute)
+    if not mask:
+        return None
+    return (mask & -mask).bit_length() - 1
+
+
+def minutes(mask):
+    """Set minutes, ascending (one step per set bit)."""
+    out = []
+    while mask:
+        low = mask & -mask
+        out.append(low.bit_length() - 1)
+        mask ^= low
+    return out
+
+
+def to_times(mask):
+    """['HH:MM', ...] for the set minutes."""
+    return [format_minute(m) for m in minutes(mask)]
@@ -0,0 +1,193 @@
+"""
+Opt-in SQL instrumentation (enable with SQL_TRACE=1).
+
+Per request it counts statements (sqlite3 trace callback, so trigger bodies
+and implicit BEGIN/COMMIT are included) and times every execute() through
+TracedConnection/TracedCursor. At the end of the request the numbers are
+folded into rolling per-endpoint aggregates that /admin/sql-stats returns.
+
+Statements slower than slow_ms are written to the slow-query log together
+with their EXPLAIN QUERY PLAN. Requests issuing more statements than the
+endpoint's budget are counted and logged as well.
+"""
+
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from flask import g, has_app_context, has_request_context, request
+
+from db import PooledConnection
+
+
+class TracedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection._tracer.timed(sql, parameters, time.perf_counter() - started, self.connection)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection._tracer.timed(sql, None, time.perf_counter() - started, None)
+
+
+class TracedConnection(PooledConnection):
+    """PooledConnection whose statements are timed by its SqlTracer."""
+
+    _tracer = None
+
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = TracedCursor if self._tracer is not None else sqlite3.Cursor
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class _RequestTrace:
+    __slots__ = ("statements", "db_seconds", "timings")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.timings = []
+
+
+class _EndpointStats:
+    def __init__(self, window, keep_slowest):
+        self.requests = 0
+        self.over_budget = 0
+        self.recent = deque(maxlen=window)  # (statements, db_ms)
+        self.slowest = []                   # min-heap of (ms, sql)
+        self.keep_slowest = keep_slowest
+
+    def add(self, trace, over_budget):
+        self.requests += 1
+        self.over_budget += over_budget
+        self.recent.append((trace.statements, trace.db_seconds * 1000))
+        for sql, seconds in trace.timings:
+            item = (round(seconds * 1000, 3), " ".join(sql.split()))
+            if len(self.slowest) < self.keep_slowest:
+                heapq.heappush(self.slowest, item)
+            elif item > self.slowest[0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def snapshot(self):
+        n = len(self.recent) or 1
+        statements = [s for s, _ in self.recent]
+        db_ms = [ms for _, ms in self.recent]
+        return {
+            "requests": self.requests,
+            "over_budget": self.over_budget,
+            "window": len(self.recent),
+            "avg_statements": round(sum(statements) / n, 2),
+            "max_statements": max(statements, default=0),
+            "avg_db_ms": round(sum(db_ms) / n, 3),
+            "max_db_ms": round(max(db_ms, default=0), 3),
+            "slowest": [{"ms": ms, "sql": sql} for ms, sql in sorted(self.slowest, reverse=True)],
+        }
+
+
+class SqlTracer:
+    def __init__(self, slow_ms=50, window=200, keep_slowest=5,
+                 default_budget=25, budgets=None, log_path=None):
+        self.slow_ms = slow_ms
+        self.window = window
+        self.keep_slowest = keep_slowest
+        self.default_budget = default_budget
+        self.budgets = dict(budgets or {})
+        self._stats = {}
+        self._lock = threading.Lock()
+
+        self.log = logging.getLogger("petcare.sql")
+        if log_path and not self.log.handlers:
+            handler = logging.FileHandler(log_path, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.log.addHandler(handler)
+            self.log.setLevel(logging.INFO)
+
+    def init_app(self, app, pools=(), writers=()):
+        for pool in pools:
+            pool.factory = TracedConnection
+            pool.on_open = self._attach
+        for writer in writers:
+            writer.tracer = self
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+
+    def _attach(self, conn):
+        conn._tracer = self
+        conn.set_trace_callback(self._on_statement)
+
+    # ---- per request ----
+
+    def _current(self):
+        return g.get("_sql_trace") if has_app_context() else None
+
+    def _start_request(self):
+        g._sql_trace = _RequestTrace()
+
+    def _on_statement(self, sql):
+        trace = self._current()
+        if trace is not None and not sql.startswith("--"):
+            trace.statements += 1
+
+    def timed(self, sql, parameters, seconds, conn):
+        """Record one timed statement (also used for writer jobs, conn=None)."""
+        trace = self._current()
+        if trace is not None:
+            trace.db_seconds += seconds
+            trace.timings.append((sql, seconds))
+        if seconds * 1000 >= self.slow_ms:
+            self._log_slow(sql, parameters, seconds, conn)
+
+    def _log_slow(self, sql, parameters, seconds, conn):
+        plan = ""
+        if conn is not None and sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")):
+            try:
+                rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", parameters or ()).fetchall()
+                plan = " | ".join(row[3] for row in rows)
+            except sqlite3.Error as e:
+                plan = f"(plan unavailable: {e})"
+        endpoint = request.endpoint if has_request_context() else None
+        self.log.info(
+            "SLOW %.1f ms [%s] %s -- plan: %s",
+            seconds * 1000, endpoint or "-", " ".join(sql.split()), plan or "-",
+        )
+
+    def _finish_request(self, exc=None):
+        trace = g.pop("_sql_trace", None)
+        if trace is None:
+            return
+        endpoint = request.endpoint or "<unmatched>"
+        budget = self.budgets.get(endpoint, self.default_budget)
+        over_budget = trace.statements > budget
+        if over_budget:
+            self.log.info(
+                "BUDGET [%s] %d statements (budget %d), %.1f ms in SQLite",
+                endpoint, trace.statements, budget, trace.db_seconds * 1000,
+            )
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = _EndpointStats(self.window, self.keep_slowest)
+            stats.add(trace, over_budget)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "slow_ms": self.slow_ms,
+                "endpoints": {name: stats.snapshot() for name, stats in sorted(self._stats.items())},
+            }
@@ -1,29 +1,14 @@
-import sqlite3
+import migrations
 
 DB_PATH = "instance/petcare.db"
 
-def add_column_if_missing(cur, table, column_def):
-    col_name = column_def.split()[0]
-    cur.execute(f"PRAGMA table_info({table})")
-    existing_cols = [row[1] for row in cur.fetchall()]
-    if col_name not in existing_cols:
-        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column_def}")
-        print(f"✅ Added column: {col_name}")
-    else:
-        print(f"⚠️ Column already exists: {col_name}")
-
 def main():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    # ✅ make sure the columns used in app.py exist
-    add_column_if_missing(cur, "appointments", "rating INTEGER")
-    add_column_if_missing(cur, "appointments", "doctor_review TEXT")
-    add_column_if_missing(cur, "appointments", "clinic_review TEXT")
-    add_column_if_missing(cur, "appointments", "reviewed_at TEXT")
-
-    conn.commit()
-    conn.close()
+    # ✅ columns/tables used in app.py are managed by migrations.py
+    applied = migrations.migrate(DB_PATH)
+    if applied:
+        print(f"✅ Applied migrations: {applied}")
+    else:
+        print(f"⚠️ Schema already at version {migrations.SCHEMA_VERSION}")
     print("✅ Schema updated successfully!")
 
 if __name__ == "__main__":